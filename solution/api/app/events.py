@@ -0,0 +1,49 @@
+"""
+Day advance events.
+
+Advancing the day bumps the ``epoch`` key, which in-process caches compare
+against to drop entries of past days, publishes the change on a Redis
+channel for other services (the bot keeps its own day cache) and sends the
+``day_advanced`` signal. Receivers queue the work that follows a day
+change, such as closing the daily statistics or rebuilding ad candidates.
+"""
+import json
+import logging
+
+from django.core.cache import cache
+from django.dispatch import Signal
+from redis import RedisError
+
+from app.jobs import queue
+
+logger = logging.getLogger(__name__)
+
+EPOCH_KEY = "epoch"
+DAY_ADVANCED_CHANNEL = "events:day-advanced"
+
+# Sent with ``previous``, ``day`` and ``epoch`` keyword arguments.
+day_advanced = Signal()
+
+
+def get_epoch():
+    return cache.get(EPOCH_KEY, 0)
+
+
+def bump_epoch():
+    try:
+        return cache.incr(EPOCH_KEY)
+    except ValueError:
+        if cache.add(EPOCH_KEY, 1, None):
+            return 1
+        return cache.incr(EPOCH_KEY)
+
+
+def advance_day(previous, day):
+    epoch = bump_epoch()
+    message = json.dumps({"previous": previous, "day": day, "epoch": epoch})
+    try:
+        queue.connection.publish(DAY_ADVANCED_CHANNEL, message)
+    except RedisError as e:
+        logger.error(f"Failed to publish day advance to {day}: {e}")
+    day_advanced.send(sender=None, previous=previous, day=day, epoch=epoch)
+    return epoch
@@ -0,0 +1,92 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from app.metrics import record_cache_access
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+IN_PROGRESS = "in-progress"
+DONE = "done"
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """
+    Lets clients retry a request with the same ``Idempotency-Key`` header
+    without repeating its effect. The first request takes the key with a
+    SET NX in the default cache, its response is kept for
+    IDEMPOTENCY_KEY_TTL seconds and replayed to retries without running the
+    view. Server errors release the key so the request can be retried, and
+    the key of a request whose worker was killed is released after
+    IDEMPOTENCY_IN_PROGRESS_TTL seconds.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({"detail": f"invalid {HEADER}"}, status=400)
+
+        cache_key = f"idempotency:{_digest(request.method, request.path, key)}"
+        fingerprint = _digest(request.get_full_path(), request.body)
+        in_progress_timeout = settings.IDEMPOTENCY_IN_PROGRESS_TTL
+        while not cache.add(cache_key, (IN_PROGRESS, fingerprint), in_progress_timeout):
+            if (stored := cache.get(cache_key)) is None:
+                # Expired in between, take it again.
+                continue
+            record_cache_access("idempotency", True)
+            state, stored_fingerprint, *stored_response = stored
+            if stored_fingerprint != fingerprint:
+                return JsonResponse(
+                    {"detail": f"{HEADER} was used for another request"}, status=422
+                )
+            if state == IN_PROGRESS:
+                response = JsonResponse(
+                    {"detail": "request with this key is in progress"}, status=409
+                )
+                response["Retry-After"] = "1"
+                return response
+            status_code, content, content_type = stored_response
+            response = HttpResponse(content, status=status_code, content_type=content_type)
+            response["Idempotent-Replayed"] = "true"
+            return response
+        record_cache_access("idempotency", False)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render"):
+                # DRF responses are rendered after the view returns.
+                response.render()
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(
+                cache_key,
+                (
+                    DONE,
+                    fingerprint,
+                    response.status_code,
+                    response.content,
+                    response.get("Content-Type"),
+                ),
+                settings.IDEMPOTENCY_KEY_TTL,
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,184 @@
+import json
+import logging
+import random
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+# Pushes the job unless its idempotency key was already taken. Doing both in
+# one script keeps the check and the push atomic and lets enqueue_many send
+# thousands of jobs in a single pipeline round trip.
+ENQUEUE_SCRIPT = """
+if ARGV[2] ~= '' and not redis.call('SET', KEYS[2], ARGV[2], 'NX', 'EX', ARGV[3]) then
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Moves jobs whose retry delay has passed back to the queue.
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+
+def task(name, max_retries=5):
+    """Registers a function that the worker can run by ``name``."""
+
+    def decorator(func):
+        func.task_name = name
+        func.max_retries = max_retries
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+class JobQueue:
+    """
+    Redis backed job queue. Workers move jobs to their own processing list
+    while running them, so jobs of a killed worker are put back when a worker
+    with the same name starts again.
+    """
+
+    def __init__(self, name="default", url=None):
+        self.name = name
+        self.url = url
+        self._connection = None
+        self._enqueue = None
+        self._promote = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            connection = redis.Redis.from_url(self.url or settings.JOBS_REDIS_URL)
+            self._enqueue = connection.register_script(ENQUEUE_SCRIPT)
+            self._promote = connection.register_script(PROMOTE_SCRIPT)
+            self._connection = connection
+        return self._connection
+
+    def key(self, *parts):
+        return ":".join(("jobs", self.name, *parts))
+
+    def build(self, task_name, args, kwargs, idempotency_key=None):
+        return json.dumps(
+            {
+                "id": uuid.uuid4().hex,
+                "task": task_name,
+                "args": list(args),
+                "kwargs": kwargs,
+                "idempotency_key": idempotency_key,
+                "attempts": 0,
+            }
+        )
+
+    def enqueue(self, task_name, *args, idempotency_key=None, **kwargs):
+        return self.enqueue_many(task_name, [(args, kwargs)], [idempotency_key])[0]
+
+    def enqueue_many(self, task_name, calls, idempotency_keys=None):
+        """
+        Enqueues ``(args, kwargs)`` pairs in one round trip. Returns a flag per
+        call telling whether it was queued or skipped as a duplicate.
+        """
+        connection = self.connection
+        idempotency_keys = idempotency_keys or [None] * len(calls)
+        pipeline = connection.pipeline(transaction=False)
+        for (args, kwargs), idempotency_key in zip(calls, idempotency_keys):
+            self._enqueue(
+                keys=[self.key("queue"), self.key("idempotency", idempotency_key or "")],
+                args=[
+                    self.build(task_name, args, kwargs, idempotency_key),
+                    idempotency_key or "",
+                    settings.JOBS_IDEMPOTENCY_TTL,
+                ],
+                client=pipeline,
+            )
+        return [bool(result) for result in pipeline.execute()]
+
+    def forget(self, *idempotency_keys):
+        keys = [self.key("idempotency", key) for key in idempotency_keys]
+        if keys:
+            self.connection.delete(*keys)
+
+    def reserve(self, worker, timeout=1):
+        connection = self.connection
+        self._promote(keys=[self.key("delayed"), self.key("queue")], args=[time.time()])
+        return connection.blmove(
+            self.key("queue"), self.key("processing", worker), timeout, "RIGHT", "LEFT"
+        )
+
+    def complete(self, worker, raw):
+        self.connection.lrem(self.key("processing", worker), 1, raw)
+
+    def retry(self, worker, raw, max_retries):
+        job = json.loads(raw)
+        job["attempts"] += 1
+        pipeline = self.connection.pipeline()
+        pipeline.lrem(self.key("processing", worker), 1, raw)
+        if job["attempts"] > max_retries:
+            pipeline.lpush(self.key("failed"), json.dumps(job))
+            # Let the same job be enqueued again once the cause is fixed.
+            if job.get("idempotency_key"):
+                pipeline.delete(self.key("idempotency", job["idempotency_key"]))
+            pipeline.execute()
+            return None
+
+        delay = min(
+            settings.JOBS_RETRY_BASE_DELAY * 2 ** (job["attempts"] - 1),
+            settings.JOBS_RETRY_MAX_DELAY,
+        )
+        delay *= random.uniform(0.5, 1)
+        pipeline.zadd(self.key("delayed"), {json.dumps(job): time.time() + delay})
+        pipeline.execute()
+        return delay
+
+    def recover(self, worker):
+        """Puts jobs left in the processing list of ``worker`` back to the queue."""
+        count = 0
+        while self.connection.lmove(
+            self.key("processing", worker), self.key("queue"), "RIGHT", "RIGHT"
+        ):
+            count += 1
+        return count
+
+    def run(self, worker, raw):
+        """Runs a reserved job. Returns False if it failed and was retried or dropped."""
+        job = json.loads(raw)
+        func = TASKS.get(job["task"])
+        if func is None:
+            logger.error(f"Unknown task {job['task']} in job {job['id']}")
+            self.retry(worker, raw, max_retries=0)
+            return False
+
+        try:
+            func(*job["args"], **job["kwargs"])
+        except Exception as e:
+            delay = self.retry(worker, raw, func.max_retries)
+            if delay is None:
+                logger.exception(f"Job {job['id']} ({job['task']}) failed permanently: {e}")
+            else:
+                logger.warning(
+                    f"Job {job['id']} ({job['task']}) failed: {e}, retrying in {delay:.1f}s"
+                )
+            return False
+
+        self.complete(worker, raw)
+        return True
+
+
+queue = JobQueue()
+
+
+def enqueue(task_name, *args, idempotency_key=None, **kwargs):
+    return queue.enqueue(task_name, *args, idempotency_key=idempotency_key, **kwargs)
@@ -0,0 +1,79 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Gunicorn workers write their samples into PROMETHEUS_MULTIPROC_DIR, the
+# /metrics view merges them so every scrape sees all workers at once.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Number of SQL queries executed per request.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 25, 50, 100),
+)
+
+ADS_STAGE_DURATION = Histogram(
+    "ads_stage_duration_seconds",
+    "Duration of GET /ads stages.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+ADS_CANDIDATES = Histogram(
+    "ads_candidates",
+    "Number of candidate campaigns ranked per GET /ads.",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+ADS_RESERVATION_ATTEMPTS = Histogram(
+    "ads_reservation_attempts",
+    "Number of impression reservation attempts per GET /ads.",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by key family and result.",
+    ["cache", "result"],
+)
+
+
+def record_cache_access(cache, hit):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def export_metrics():
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,4 +1,12 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
 from django.utils.deprecation import MiddlewareMixin
+
+from app.metrics import REQUEST_DB_QUERIES, REQUEST_DURATION
+from app.tracing import capture_query, finish_trace, start_trace
 from business.utils import set_local_cache_cur_min_max_score
 
 initialized = False
@@ -13,3 +21,54 @@ class LocalCacheInitializationMiddleware(MiddlewareMixin):
             except Exception as e:
                 pass
             initialized = True
+
+
+class TracingMiddleware:
+    """
+    Records SQL queries, cache calls and stage spans of a sampled fraction of
+    requests and logs them as a single JSON line per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.TRACING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        trace, token = start_trace(request)
+        status_code = 500
+        try:
+            with connection.execute_wrapper(capture_query):
+                response = self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            match = request.resolver_match
+            finish_trace(trace, token, match.route if match else None, status_code)
+
+
+class PrometheusMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        REQUEST_DURATION.labels(
+            method=request.method, route=route, status=response.status_code
+        ).observe(duration)
+        REQUEST_DB_QUERIES.labels(method=request.method, route=route).observe(queries)
+        return response
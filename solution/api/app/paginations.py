@@ -1,6 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
 
+from app.exceptions import CustomAPIException
+
 
 class PurePageNumberPagination(PageNumberPagination):
     page_size = 10
@@ -9,3 +16,133 @@ class PurePageNumberPagination(PageNumberPagination):
 
     def get_paginated_response(self, data):
         return Response(data)
+
+
+class OptionalPageNumberPagination(PurePageNumberPagination):
+    """
+    Paginates only when ``page`` or ``size`` is given, so existing clients
+    still get the full list. The total number of items is sent in the
+    ``X-Total-Count`` header.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(data, headers={"X-Total-Count": str(self.page.paginator.count)})
+
+
+def keyset_filter(fields, values, lookup):
+    """
+    Row comparison ``(fields) > (values)`` (or ``<``) spelled with Q objects.
+    The leading ``>=`` on the first field bounds the index range scan.
+    """
+    condition = Q()
+    for i, field in enumerate(fields):
+        equal = dict(zip(fields[:i], values[:i]))
+        condition |= Q(**equal, **{f"{field}__{lookup}": values[i]})
+    return Q(**{f"{fields[0]}__{lookup}e": values[0]}) & condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering, so deep pages cost the same as
+    the first one. Cursors are sent in the ``X-Next-Cursor``,
+    ``X-Previous-Cursor`` and ``X-Last-Cursor`` headers and passed back in
+    ``?cursor=``. The last cursor gives the last page of forward paging, so
+    pages stay the same in both directions. Requests with ``?page=`` keep
+    the old offset pagination.
+    """
+
+    ordering = ("created_at", "id")
+    page_size = 10
+    page_size_query_param = "size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    legacy_pagination_class = PurePageNumberPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.legacy = None
+        if self.legacy_pagination_class.page_query_param in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(
+                queryset.order_by(*self.ordering), request, view
+            )
+
+        page_size = self.get_page_size(request)
+        forward, position = self.decode_cursor(request)
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*(f"-{field}" for field in self.ordering))
+        if position is None and not forward:
+            # The last page holds what is left after the full pages, like the
+            # last page of forward paging.
+            count = queryset.count()
+            page_size = count % page_size or page_size
+            items = list(queryset[:page_size])
+            has_more = count > page_size
+        else:
+            if position is not None:
+                queryset = queryset.filter(
+                    keyset_filter(self.ordering, position, "gt" if forward else "lt")
+                )
+            items = list(queryset[: page_size + 1])
+            has_more = len(items) > page_size
+            items = items[:page_size]
+
+        if not forward:
+            items.reverse()
+
+        self.has_next = has_more if forward else position is not None
+        self.has_previous = position is not None if forward else has_more
+        self.page = items
+        return items
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+
+        headers = {"X-Last-Cursor": self.encode_cursor(False, None)}
+        if self.page and self.has_next:
+            headers["X-Next-Cursor"] = self.encode_cursor(True, self.position(self.page[-1]))
+        if self.page and self.has_previous:
+            headers["X-Previous-Cursor"] = self.encode_cursor(
+                False, self.position(self.page[0])
+            )
+        return Response(data, headers=headers)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def position(self, instance):
+        return [str(getattr(instance, field)) for field in self.ordering]
+
+    def encode_cursor(self, forward, position):
+        raw = json.dumps([forward, position], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return True, None
+        try:
+            forward, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if position is not None and (
+                len(position) != len(self.ordering)
+                or not all(isinstance(value, str) for value in position)
+            ):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise CustomAPIException(
+                detail="Неверный курсор.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        return bool(forward), position
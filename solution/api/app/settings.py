@@ -31,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.middleware.PrometheusMetricsMiddleware",
+    "app.middleware.TracingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -62,13 +64,17 @@ DATABASES = {
 
 REDIS_HOST = environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = environ.get("REDIS_PORT", 6380)
+# Fraction of requests whose queries, cache calls and spans are logged by
+# app.middleware.TracingMiddleware.
+TRACING_SAMPLE_RATE = float(environ.get("TRACING_SAMPLE_RATE", 0.01))
+
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "BACKEND": "app.tracing.TracedRedisCache",
         "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}",
     },
     "local": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "BACKEND": "app.tracing.TracedLocMemCache",
         "LOCATION": "unique-local-cache",
     },
 }
@@ -106,6 +112,8 @@ MINIO_STORAGE_MEDIA_BUCKET_NAME = "local-media"
 MINIO_STORAGE_MEDIA_BACKUP_BUCKET = "Recycle Bin"
 MINIO_STORAGE_MEDIA_BACKUP_FORMAT = "%c/"
 MINIO_STORAGE_AUTO_CREATE_MEDIA_BUCKET = True
+# Media names are content hashes, so objects never change once written.
+MINIO_STORAGE_MEDIA_OBJECT_METADATA = {"Cache-Control": "public, max-age=31536000, immutable"}
 # MINIO_STORAGE_MEDIA_USE_PRESIGNED = True
 MINIO_STORAGE_STATIC_BUCKET_NAME = "local-static"
 MINIO_STORAGE_AUTO_CREATE_STATIC_BUCKET = True
@@ -114,6 +122,9 @@ STORAGE_URL = os.environ.get("MINIO_STORAGE_URL", "http://localhost:9011")
 MINIO_STORAGE_MEDIA_URL = f"{STORAGE_URL}/local-media"
 MINIO_STORAGE_STATIC_URL = f"{STORAGE_URL}/local-static"
 
+CAMPAIGN_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+CAMPAIGN_IMAGE_MAX_PIXELS = 40_000_000
+
 WSGI_APPLICATION = "app.wsgi.application"
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -186,3 +197,40 @@ GRAFANA_ADVERTISER_DEFAULT_PASSWORD = os.environ.get(
     "GRAFANA_ADVERTISER_DEFAULT_PASSWORD", "password"
 )
 GRAFANA_TEAM_ID = os.environ.get("GRAFANA_TEAM_ID", "dedbuu38t0zcwe")
+# (connect, read) timeouts in seconds.
+GRAFANA_TIMEOUT = (3.05, 10)
+
+AD_TEXT_GENERATION = {
+    # business.ai.StubBackend generates texts offline.
+    "BACKEND": environ.get("AD_TEXT_BACKEND", "business.ai.YandexGPTBackend"),
+    "MODEL": "yandexgpt-lite",
+    "TEMPERATURE": 0,
+    "CACHE_TIMEOUT": 7 * 24 * 60 * 60,
+    "JOB_TIMEOUT": 10 * 60,
+    "OPTIONS": {
+        "folder_id": environ.get("YANDEX_FOLDER_ID", "b1gd9iki2060shcc9st8"),
+        "auth": environ.get("YANDEX_API_TOKEN", "REDACTED"),
+    },
+}
+
+# Background jobs, see app/jobs.py and the run_worker command.
+JOBS_REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
+JOBS_IDEMPOTENCY_TTL = 24 * 60 * 60
+JOBS_RETRY_BASE_DELAY = 5
+JOBS_RETRY_MAX_DELAY = 10 * 60
+
+# Responses kept for retries with the same Idempotency-Key, see app/idempotency.py.
+IDEMPOTENCY_KEY_TTL = 10 * 60
+# Keeps a key taken by a request killed mid-way, about the gunicorn timeout.
+IDEMPOTENCY_IN_PROGRESS_TTL = 30
+
+# Targeting matched ahead of GET /ads, see client/candidates.py.
+ADS_CANDIDATES = {
+    "WORKERS": int(environ.get("ADS_CANDIDATES_WORKERS", os.cpu_count() or 1)),
+    "SHARDS": 16,
+}
+# Campaign ids per targeting segment kept by every server process.
+ADS_SEGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Rows fetched and encoded at a time by statistics exports, see business/exports.py.
+STATS_EXPORT_CHUNK_SIZE = 5000
@@ -0,0 +1,57 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+# Transaction bookkeeping of TestCase and atomic() blocks, not real work.
+IGNORED_QUERY = re.compile(r"^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b", re.I)
+
+_LITERALS = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}\b", re.I), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.I), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+)
+
+
+def query_shape(sql):
+    """SQL with literals replaced, so the same statement run for different rows compares equal."""
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return " ".join(sql.split())
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing a test when a block runs more SQL queries than its
+    budget, or when a single query is slower than ``max_query_ms``. The failure
+    message lists repeated query shapes, which is how N+1 loops show up.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget, max_query_ms=None, using="default"):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+
+        queries = [q for q in context.captured_queries if not IGNORED_QUERY.match(q["sql"])]
+        problems = []
+        if len(queries) > budget:
+            problems.append(f"{len(queries)} queries executed, budget is {budget}.")
+        if max_query_ms is not None:
+            for query in queries:
+                duration_ms = float(query["time"]) * 1000
+                if duration_ms > max_query_ms:
+                    problems.append(f"Slow query ({duration_ms:.1f}ms > {max_query_ms}ms): {query['sql']}")
+        if not problems:
+            return
+
+        shapes = Counter(query_shape(q["sql"]) for q in queries)
+        repeated = [f"  {count}x {shape}" for shape, count in shapes.most_common() if count > 1]
+        if repeated:
+            problems.append("Repeated query shapes:\n" + "\n".join(repeated))
+        problems.append(
+            "Queries:\n" + "\n".join(f"  {i}. {q['sql']}" for i, q in enumerate(queries, 1))
+        )
+        self.fail("\n".join(problems))
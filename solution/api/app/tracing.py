@@ -0,0 +1,217 @@
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+
+from app.metrics import ADS_STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+_current_trace = ContextVar("trace", default=None)
+_NOOP = nullcontext()
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Trace:
+    """
+    Everything recorded for one sampled request. Offsets are relative to the
+    start of the request so spans, queries and cache calls line up.
+    """
+
+    def __init__(self, request):
+        self.trace_id = uuid.uuid4().hex
+        self.method = request.method
+        self.path = request.path
+        self.started = time.perf_counter()
+        self.queries = []
+        self.cache_calls = []
+        self.spans = []
+
+    def offset(self, moment):
+        return _ms(moment - self.started)
+
+    def add_query(self, sql, many, started, finished):
+        self.queries.append(
+            {
+                "sql": sql,
+                "many": many,
+                "start_ms": self.offset(started),
+                "duration_ms": _ms(finished - started),
+            }
+        )
+
+    def add_cache_call(self, cache, operation, key, hit, started, finished):
+        call = {
+            "cache": cache,
+            "op": operation,
+            "key": key,
+            "start_ms": self.offset(started),
+            "duration_ms": _ms(finished - started),
+        }
+        if hit is not None:
+            call["hit"] = hit
+        self.cache_calls.append(call)
+
+    def add_span(self, name, started, finished):
+        self.spans.append(
+            {
+                "name": name,
+                "start_ms": self.offset(started),
+                "duration_ms": _ms(finished - started),
+            }
+        )
+
+    def to_dict(self, route, status_code, finished):
+        # The same statement executed over and over within one request is
+        # almost always a loop issuing a query per row.
+        repeated = [
+            {"sql": sql, "count": count}
+            for sql, count in Counter(q["sql"] for q in self.queries).most_common()
+            if count > 1
+        ]
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status_code,
+            "duration_ms": self.offset(finished),
+            "query_count": len(self.queries),
+            "query_ms": round(sum(q["duration_ms"] for q in self.queries), 3),
+            "repeated_queries": repeated,
+            "queries": self.queries,
+            "cache": self.cache_calls,
+            "spans": self.spans,
+        }
+
+
+def start_trace(request):
+    trace = Trace(request)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace, token, route, status_code):
+    _current_trace.reset(token)
+    payload = trace.to_dict(route, status_code, time.perf_counter())
+    logger.info(json.dumps(payload, default=str))
+    return payload
+
+
+def capture_query(execute, sql, params, many, context):
+    trace = _current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(sql, many, started, time.perf_counter())
+
+
+class _Span:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(self.name, self.started, time.perf_counter())
+
+
+def span(name):
+    """Times a block of a sampled request, does nothing otherwise."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.name, self.started)
+
+
+def stage(name):
+    """Times a GET /ads stage for both Prometheus and the request trace."""
+    return _Stage(name)
+
+
+def observe_stage(name, started, finished=None):
+    if finished is None:
+        finished = time.perf_counter()
+    ADS_STAGE_DURATION.labels(stage=name).observe(finished - started)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, finished)
+
+
+def _traced(operation):
+    def method(self, key, *args, **kwargs):
+        call = getattr(super(TracedCacheMixin, self), operation)
+        trace = _current_trace.get()
+        if trace is None:
+            return call(key, *args, **kwargs)
+
+        started = time.perf_counter()
+        result = call(key, *args, **kwargs)
+        hit = None
+        if operation == "get":
+            default = args[0] if args else kwargs.get("default")
+            hit = result is not default
+        elif operation == "get_many":
+            hit = len(result) == len(key)
+        if isinstance(key, dict):
+            key = list(key)
+        trace.add_cache_call(
+            self.trace_name, operation, key, hit, started, time.perf_counter()
+        )
+        return result
+
+    method.__name__ = operation
+    return method
+
+
+class TracedCacheMixin:
+    trace_name = None
+
+    get = _traced("get")
+    get_many = _traced("get_many")
+    set = _traced("set")
+    set_many = _traced("set_many")
+    add = _traced("add")
+    delete = _traced("delete")
+    delete_many = _traced("delete_many")
+    incr = _traced("incr")
+    has_key = _traced("has_key")
+    touch = _traced("touch")
+
+
+class TracedRedisCache(TracedCacheMixin, RedisCache):
+    trace_name = "redis"
+
+
+class TracedLocMemCache(TracedCacheMixin, LocMemCache):
+    trace_name = "locmem"
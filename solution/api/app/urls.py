@@ -5,6 +5,7 @@ from app.views import (
     BanlistView,
     change_banlist_status,
     ping,
+    metrics_view,
 )
 
 urlpatterns = [
@@ -15,4 +16,5 @@ urlpatterns = [
     path("banlist/", BanlistView.as_view()),
     path("banlist/status", change_banlist_status),
     path("ping", ping),
+    path("metrics", metrics_view),
 ]
@@ -1,8 +1,12 @@
 from django.core.cache import cache
 
+from app.metrics import record_cache_access
+
 
 def get_current_day() -> int:
-    return cache.get("current_day", 1)
+    current_day = cache.get("current_day")
+    record_cache_access("current_day", current_day is not None)
+    return current_day if current_day is not None else 1
 
 
 def set_day(day: int) -> None:
@@ -1,4 +1,5 @@
 from better_profanity import profanity
+from django.http import HttpResponse
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -6,6 +7,8 @@ from rest_framework.views import APIView
 
 from . import settings
 from .exceptions import CustomAPIException
+from .metrics import export_metrics
+from .events import advance_day
 from .utils import set_day as cache_set_day, get_current_day, set_banlist_status
 
 
@@ -29,6 +32,8 @@ def set_day_view(request):
             status_code=status.HTTP_400_BAD_REQUEST,
         )
     cache_set_day(day)
+    if day != current_day:
+        advance_day(current_day, day)
     return Response({"current_date": day})
 
 
@@ -99,3 +104,8 @@ def change_banlist_status(request):
 @api_view(["GET"])
 def ping(request):
     return Response({"message": "prod."})
+
+
+def metrics_view(request):
+    content, content_type = export_metrics()
+    return HttpResponse(content, content_type=content_type)
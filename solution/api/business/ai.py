@@ -1,27 +1,158 @@
-import os
-from yandex_cloud_ml_sdk import YCloudML
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from app.jobs import queue
+
+INSTRUCTION = "Ты — профессиональный маркетолог с опытом написания высококонверсионной рекламы. Для генерации рекламного текста ты изучаешь потенциальную целевую аудиторию и оптимизируешь рекламный текст так, чтобы он обращался именно к этой целевой аудитории. Напиши рекламный текст для следующих продуктов/услуг. Создай текст до 300 символов объявления с привлекающим внимание заголовком и убедительным призывом к действию, который побуждает пользователей к целевому действию."
+
+
+class YandexGPTBackend:
+    def __init__(self, model, temperature, folder_id, auth):
+        from yandex_cloud_ml_sdk import YCloudML
+
+        sdk = YCloudML(folder_id=folder_id, auth=auth)
+        self.model = sdk.models.completions(model).configure(temperature=temperature)
+
+    def complete(self, messages):
+        return self.model.run(messages).alternatives[0].text
+
+
+class StubBackend:
+    """Deterministic offline backend for tests and local development."""
+
+    calls = 0
+
+    def __init__(self, model, temperature, **options):
+        self.delay = options.get("delay", 0)
+
+    def complete(self, messages):
+        StubBackend.calls += 1
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return f"Реклама: {messages[-1]['text']}"
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_backend():
+    # The SDK client holds a connection, so it is built once per process.
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            config = settings.AD_TEXT_GENERATION
+            backend_class = import_string(config["BACKEND"])
+            _backend = backend_class(
+                model=config["MODEL"],
+                temperature=config["TEMPERATURE"],
+                **config.get("OPTIONS", {}),
+            )
+        return _backend
 
-def generate_advertising_text(title, targeting=None):
-    instruction = "Ты — профессиональный маркетолог с опытом написания высококонверсионной рекламы. Для генерации рекламного текста ты изучаешь потенциальную целевую аудиторию и оптимизируешь рекламный текст так, чтобы он обращался именно к этой целевой аудитории. Напиши рекламный текст для следующих продуктов/услуг. Создай текст до 300 символов объявления с привлекающим внимание заголовком и убедительным призывом к действию, который побуждает пользователей к целевому действию."
 
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == "AD_TEXT_GENERATION":
+        _backend = None
+
+
+def build_messages(title, targeting=None):
     prompt = f"Продукт/услуга: {title}. "
     if targeting:
         prompt += f"Целевая аудитория: {targeting}."
 
-    messages = [
-        {"role": "system", "text": instruction},
+    return [
+        {"role": "system", "text": INSTRUCTION},
         {"role": "user", "text": prompt},
     ]
 
-    sdk = YCloudML(
-        folder_id="b1gd9iki2060shcc9st8",
-        auth=os.environ.get(
-            "YANDEX_API_TOKEN", "REDACTED"
-        ),
+
+def prompt_key(title, targeting=None):
+    """
+    Content address of a generation. Temperature is 0, so the same prompt and
+    model always give the same text and the result can be cached.
+    """
+    config = settings.AD_TEXT_GENERATION
+    payload = json.dumps(
+        [title, targeting or None, config["MODEL"], config["TEMPERATURE"]],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def result_cache_key(key):
+    return f"ad-text:{key}"
+
+
+def pending_cache_key(key):
+    return f"ad-text-pending:{key}"
+
+
+def generate_advertising_text(title, targeting=None):
+    key = prompt_key(title, targeting)
+    if (text := cache.get(result_cache_key(key))) is not None:
+        return text
+
+    # Identical prompts requested while a generation is running wait for it
+    # instead of calling the model again.
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        text = cache.get(result_cache_key(key))
+        if text is None:
+            text = get_backend().complete(build_messages(title, targeting))
+            cache.set(
+                result_cache_key(key),
+                text,
+                settings.AD_TEXT_GENERATION["CACHE_TIMEOUT"],
+            )
+        future.set_result(text)
+        return text
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+
+def submit_advertising_text(title, targeting=None):
+    """
+    Queues a generation for the worker. Returns the job id, which is the
+    prompt key, and the text if it is already cached.
+    """
+    key = prompt_key(title, targeting)
+    if (text := cache.get(result_cache_key(key))) is not None:
+        return key, text
+
+    cache.set(pending_cache_key(key), True, settings.AD_TEXT_GENERATION["JOB_TIMEOUT"])
+    queue.enqueue(
+        "ai.generate_text", title, targeting, idempotency_key=f"ad-text:{key}"
     )
+    return key, None
 
-    model = sdk.models.completions("yandexgpt-lite")
-    result = model.configure(temperature=0).run(messages)
 
-    return result.alternatives[0].text
+def get_advertising_text_job(job_id):
+    """Returns ``(pending, text)``, both empty for unknown or expired jobs."""
+    text = cache.get(result_cache_key(job_id))
+    if text is not None:
+        return False, text
+    return bool(cache.get(pending_cache_key(job_id))), None
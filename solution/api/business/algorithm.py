@@ -1,4 +1,3 @@
-from django.db import connection
 from django.db.models import Min, Max
 
 from business.models import Campaign, Score
@@ -127,35 +126,6 @@ def compute_ad_score(
     final_score = base_score * D
     return final_score
 
-def get_max_profit(client_id, campaign_ids: tuple):
-    """
-    Computes the maximum profit P for the given client and list of campaign IDs.
-
-    The profit P for a campaign is computed as:
-        P = cost_per_impression + (ml_norm * cost_per_click)
-
-    where ml_norm is taken from the business_score table (here assumed to be score/100).
-    """
-    # Build the SQL query.
-    query = """
-        SELECT MAX(bc.cost_per_impression + (COALESCE(bs.normalized_ml, 0) * bc.cost_per_click)) AS max_profit
-        FROM business_campaign bc
-        LEFT JOIN (
-            -- Get the normalized ML score for this client per advertiser.
-            SELECT advertiser_id, score / 100.0 AS normalized_ml
-            FROM business_score
-            WHERE client_id = %s
-        ) bs
-          ON bs.advertiser_id = bc.advertiser_id
-        WHERE bc.id IN %s;
-    """
-    # Execute the query. Note that campaign_ids must be a tuple.
-    with connection.cursor() as cursor:
-        cursor.execute(
-            query, [str(client_id), campaign_ids]
-        )  # campaign_ids может быть пустым
-        row = cursor.fetchone()
-    return row[0] if row and row[0] is not None else 0
 
 def get_max_P(client, campaigns):
     max_P = 0
@@ -0,0 +1,125 @@
+"""
+Statistics exports.
+
+Impression and click events of an advertiser are streamed to the client as
+CSV or Parquet. Rows are read through a server-side cursor in chunks of
+``STATS_EXPORT_CHUNK_SIZE`` and every chunk is encoded and sent before the
+next one is fetched, so memory use does not grow with the number of events.
+Parquet files get one row group per chunk.
+"""
+import csv
+import io
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from rest_framework import status
+
+from app.exceptions import CustomAPIException
+from client.models import Click, Impression
+
+COLUMNS = ("event", "day", "campaign_id", "client_id", "cost")
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def iter_events(advertiser_id, from_day, to_day, chunk_size):
+    """Yields lists of at most ``chunk_size`` rows in the order of COLUMNS."""
+    for event, model in (("impression", Impression), ("click", Click)):
+        rows = (
+            model.objects.filter(
+                advertiser_id=advertiser_id, day__gte=from_day, day__lte=to_day
+            )
+            .order_by("day", "id")
+            .values_list("day", "advertisement_id", "client_id", "cost")
+            .iterator(chunk_size=chunk_size)
+        )
+        while chunk := list(islice(rows, chunk_size)):
+            yield [
+                (event, day, str(campaign_id), str(client_id), cost)
+                for day, campaign_id, client_id, cost in chunk
+            ]
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file that hands out what was written since the last ``take``."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def stream_parquet(chunks):
+    schema = pa.schema(
+        [
+            ("event", pa.string()),
+            ("day", pa.int64()),
+            ("campaign_id", pa.string()),
+            ("client_id", pa.string()),
+            ("cost", pa.float64()),
+        ]
+    )
+    buffer = ChunkBuffer()
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for chunk in chunks:
+            columns = zip(*chunk)
+            arrays = [
+                pa.array(values, type=field.type)
+                for values, field in zip(columns, schema)
+            ]
+            writer.write_table(
+                pa.Table.from_arrays(arrays, schema=schema), row_group_size=len(chunk)
+            )
+            yield buffer.take()
+    yield buffer.take()
+
+
+def check_format(export_format):
+    if export_format not in FORMATS:
+        raise CustomAPIException(
+            detail=f"Формат должен быть одним из: {', '.join(FORMATS)}.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def export_events(advertiser_id, from_day, to_day, export_format):
+    """Returns an iterator of the encoded export and its content type and extension."""
+    check_format(export_format)
+    chunks = iter_events(
+        advertiser_id, from_day, to_day, settings.STATS_EXPORT_CHUNK_SIZE
+    )
+    stream = stream_parquet if export_format == "parquet" else stream_csv
+    content_type, extension = FORMATS[export_format]
+    return stream(chunks), content_type, extension
@@ -1,62 +1,83 @@
 import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
+def create_session():
+    # Creating a user twice is harmless (Grafana answers 412), so POST is
+    # retried together with the idempotent methods.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Content-Type"] = "application/json"
+    return session
+
+
+session = create_session()
+
+
 def create_grafana_user(advertiser):
     url = f"{settings.GRAFANA_API_URL}/api/admin/users"
     basic = HTTPBasicAuth("admin", "admin")
-    headers = {"Content-Type": "application/json"}
     data = {
         "name": advertiser.name,
         "login": str(advertiser.id),
         "password": settings.GRAFANA_ADVERTISER_DEFAULT_PASSWORD,
     }
 
-    try:
-        response = requests.post(url, headers=headers, json=data, auth=basic)
-        response.raise_for_status()
-        return response.json().get("id")
-    except requests.RequestException as e:
-        logger.error(f"Failed to create Grafana user for {advertiser.id}: {e}")
-        return None
+    response = session.post(url, json=data, auth=basic, timeout=settings.GRAFANA_TIMEOUT)
+    if response.status_code == 412:
+        # The user already exists, e.g. the job is retried after a timeout.
+        return get_grafana_user(advertiser.id).get("id")
+    response.raise_for_status()
+    return response.json().get("id")
 
 
 def add_user_to_grafana_team(user_id):
     if not user_id:
         return
     url = f"{settings.GRAFANA_API_URL}/api/teams/{settings.GRAFANA_TEAM_ID}/members"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {settings.GRAFANA_API_KEY}",
-    }
+    headers = {"Authorization": f"Bearer {settings.GRAFANA_API_KEY}"}
     data = {"userId": user_id}
 
-    try:
-        requests.post(url, headers=headers, json=data)
-    except requests.RequestException as e:
-        logger.error(f"Failed to add user {user_id} to Grafana team: {e}")
+    response = session.post(url, headers=headers, json=data, timeout=settings.GRAFANA_TIMEOUT)
+    # 400 means the user is already a member of the team.
+    if response.status_code != 400:
+        response.raise_for_status()
+
+
+def ensure_grafana_user(advertiser):
+    add_user_to_grafana_team(create_grafana_user(advertiser))
 
 
 def process_grafana_user(advertiser):
-    user_id = create_grafana_user(advertiser)
-    if user_id:
-        add_user_to_grafana_team(user_id)
+    try:
+        ensure_grafana_user(advertiser)
+    except requests.RequestException as e:
+        logger.error(f"Failed to create Grafana user for {advertiser.id}: {e}")
 
 
 def get_grafana_user(user_login):
     url = f"{settings.GRAFANA_API_URL}/api/users/lookup"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {settings.GRAFANA_API_KEY}",
-    }
+    headers = {"Authorization": f"Bearer {settings.GRAFANA_API_KEY}"}
     params = {"loginOrEmail": user_login}
 
-    response = requests.get(url, headers=headers, params=params)
+    response = session.get(url, headers=headers, params=params, timeout=settings.GRAFANA_TIMEOUT)
     return response.json()
 
 
@@ -64,15 +85,96 @@ def delete_grafana_user(user_id):
     url = f"{settings.GRAFANA_API_URL}/api/admin/users/{user_id}"
 
     basic = HTTPBasicAuth("admin", "admin")
-    headers = {
-        "Content-Type": "application/json",
-    }
-    response = requests.delete(url, headers=headers, auth=basic)
+    response = session.delete(url, auth=basic, timeout=settings.GRAFANA_TIMEOUT)
+    # Already deleted, e.g. by a retried request.
+    if response.status_code == 404:
+        return {}
+    response.raise_for_status()
 
     return response.json()
 
 
-def delete_advertiser_from_grafana(advertiser):
-    response = get_grafana_user(advertiser.id)
-    if grafana_user_id := response.get("id"):
-        delete_grafana_user(grafana_user_id)
+def iter_grafana_users(per_page=1000):
+    url = f"{settings.GRAFANA_API_URL}/api/users/search"
+    basic = HTTPBasicAuth("admin", "admin")
+    page = 1
+    while True:
+        response = session.get(
+            url,
+            params={"perpage": per_page, "page": page},
+            auth=basic,
+            timeout=settings.GRAFANA_TIMEOUT,
+        )
+        response.raise_for_status()
+        users = response.json()["users"]
+        yield from users
+        if len(users) < per_page:
+            return
+        page += 1
+
+
+def is_advertiser_login(login):
+    try:
+        uuid.UUID(login)
+    except ValueError:
+        return False
+    return True
+
+
+def plan_reconciliation(grafana_users, advertisers, purge=False):
+    """
+    Diffs Grafana users against advertisers by login. Only users whose login is
+    an advertiser id are managed, so admin and team accounts are never touched.
+    With ``purge`` every managed user is deleted and nothing is created.
+    """
+    managed = {
+        user["login"]: user["id"]
+        for user in grafana_users
+        if is_advertiser_login(user["login"])
+    }
+    if purge:
+        return [], managed
+
+    to_create = [
+        advertiser for login, advertiser in advertisers.items() if login not in managed
+    ]
+    to_delete = {
+        login: user_id for login, user_id in managed.items() if login not in advertisers
+    }
+    return to_create, to_delete
+
+
+def reconcile_grafana_users(advertisers, purge=False, workers=10, progress=None):
+    """
+    Brings Grafana users in line with ``advertisers`` (a list of Advertiser).
+    Grafana is listed once, the creates and deletes then run on a bounded
+    thread pool sharing the pooled session. ``progress(done, total)`` is called
+    after every applied change.
+    """
+    advertisers = {str(advertiser.id): advertiser for advertiser in advertisers}
+    to_create, to_delete = plan_reconciliation(iter_grafana_users(), advertisers, purge)
+
+    result = {"created": [], "deleted": [], "failed": []}
+    total = len(to_create) + len(to_delete)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(ensure_grafana_user, advertiser): ("created", str(advertiser.id))
+            for advertiser in to_create
+        }
+        futures.update(
+            {
+                executor.submit(delete_grafana_user, user_id): ("deleted", login)
+                for login, user_id in to_delete.items()
+            }
+        )
+        for done, future in enumerate(as_completed(futures), 1):
+            action, login = futures[future]
+            try:
+                future.result()
+                result[action].append(login)
+            except requests.RequestException as e:
+                logger.error(f"Failed to reconcile Grafana user {login}: {e}")
+                result["failed"].append(login)
+            if progress:
+                progress(done, total)
+    return result
@@ -0,0 +1,127 @@
+import hashlib
+import io
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import status
+
+from app.exceptions import CustomAPIException
+
+# Longest side in pixels, images are never upscaled.
+IMAGE_VARIANTS = {
+    "large": 1280,
+    "medium": 640,
+    "thumb": 320,
+}
+IMAGE_FORMATS = {
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+}
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+MAIN_VARIANT = ("large", "jpg")
+
+IMAGE_NAME = re.compile(r"^campaigns/(?P<digest>[0-9a-f]{32})_(?P<variant>\w+)\.(?P<ext>\w+)$")
+
+
+def check_upload_size(request):
+    """Rejects an oversized upload by its Content-Length before the body is read."""
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > settings.CAMPAIGN_IMAGE_MAX_SIZE:
+        raise CustomAPIException(
+            detail="Изображение слишком большое.",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+
+def inspect_image(upload):
+    """
+    Checks format and dimensions from the image header only. Pixels are not
+    decoded, so a small file declaring a huge image is rejected cheaply.
+    """
+    if upload.size > settings.CAMPAIGN_IMAGE_MAX_SIZE:
+        raise CustomAPIException(
+            detail="Изображение слишком большое.",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    try:
+        upload.seek(0)
+        image = Image.open(upload)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise CustomAPIException(
+            detail="Неверный формат изображения.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    width, height = image.size
+    if image.format not in ALLOWED_FORMATS or width * height > settings.CAMPAIGN_IMAGE_MAX_PIXELS:
+        raise CustomAPIException(
+            detail="Неверный формат изображения.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    return image
+
+
+def image_variant_name(digest, variant, ext):
+    return f"campaigns/{digest}_{variant}.{ext}"
+
+
+def render_variants(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for ext, (image_format, options) in IMAGE_FORMATS.items():
+            frame = resized
+            if image_format == "JPEG" and frame.mode == "RGBA":
+                frame = Image.new("RGB", frame.size, "white")
+                frame.paste(resized, mask=resized.getchannel("A"))
+            buffer = io.BytesIO()
+            frame.save(buffer, image_format, **options)
+            yield variant, ext, buffer.getvalue()
+
+
+def store_campaign_image(upload, storage=default_storage):
+    """
+    Stores resized JPEG and WebP variants of an uploaded image under names
+    derived from its content hash and returns the name of the main variant.
+    The same image uploaded twice is stored once.
+    """
+    image = inspect_image(upload)
+    upload.seek(0)
+    hasher = hashlib.sha256()
+    for chunk in upload.chunks():
+        hasher.update(chunk)
+    digest = hasher.hexdigest()[:32]
+
+    main_name = image_variant_name(digest, *MAIN_VARIANT)
+    if storage.exists(main_name):
+        return main_name
+
+    image.load()
+    # The main variant goes last, its presence means all variants are stored.
+    variants = sorted(render_variants(image), key=lambda item: item[:2] == MAIN_VARIANT)
+    for variant, ext, data in variants:
+        name = image_variant_name(digest, variant, ext)
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+    return main_name
+
+
+def image_variant_urls(name, storage=default_storage):
+    if not name or not (match := IMAGE_NAME.match(name)):
+        return None
+    return {
+        variant: {
+            ext: storage.url(image_variant_name(match["digest"], variant, ext))
+            for ext in IMAGE_FORMATS
+        }
+        for variant in IMAGE_VARIANTS
+    }
@@ -1,19 +1,93 @@
-import uuid
-import random
+import io
+import time
 
+import numpy as np
 from django.core.management.base import BaseCommand
-from django.db import IntegrityError
-from faker import Faker
+from django.db import connection
 
-# Import your models
-from business.models import Advertiser, Campaign
-from client.models import Client, Impression, Click, Score
+from business.models import Advertiser, Campaign, Score
+from business.reach import rebuild_reach
+from client.models import Client, Impression, Click
+
+NULL = b"\\N"
+
+
+def uuid_column(rng, size):
+    """Random version 4 UUIDs as 32 char hex strings accepted by PostgreSQL."""
+    raw = rng.integers(0, 256, size=(size, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    return np.frombuffer(raw.tobytes().hex().encode(), dtype="S32")
+
+
+def text_column(prefix, values):
+    return np.char.add(prefix.encode(), values.astype("S"))
+
+
+def nullable(values, mask):
+    return np.where(mask, NULL, values.astype("S"))
+
+
+def zipf_weights(size, exponent, rng):
+    """Zipfian popularity over ``size`` items, shuffled so rank is not id order."""
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def copy_rows(*columns):
+    """Formats equally sized columns as tab separated COPY rows."""
+    rows = columns[0].astype("S")
+    for column in columns[1:]:
+        rows = np.char.add(np.char.add(rows, b"\t"), column.astype("S"))
+    if not len(rows):
+        return b""
+    return b"\n".join(rows.tolist()) + b"\n"
+
+
+class ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks for COPY FROM STDIN."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.current = b""
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while self.position >= len(self.current):
+            self.current = next(self.chunks, None)
+            self.position = 0
+            if self.current is None:
+                self.current = b""
+                return b""
+        if size is None or size < 0:
+            size = len(self.current) - self.position
+        data = self.current[self.position : self.position + size]
+        self.position += len(data)
+        return data
+
+
+def copy_into(model, fields, chunks):
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ", ".join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    with connection.cursor() as cursor:
+        # Positional, CursorDebugWrapper.copy_expert takes no keyword arguments.
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN", ChunkStream(chunks), 1 << 20
+        )
 
 
 class Command(BaseCommand):
     help = (
-        "Generates sample data for Advertiser, Campaign, Client (PostgreSQL) "
-        "and Impression/Click (ClickHouse), including Score generation."
+        "Generates a synthetic dataset of advertisers, campaigns, clients, ML scores, "
+        "impressions and clicks. Distributions are sampled with NumPy and rows are "
+        "streamed into PostgreSQL with COPY FROM STDIN."
     )
 
     def add_arguments(self, parser):
@@ -30,127 +104,302 @@ class Command(BaseCommand):
             "--impressions",
             type=int,
             default=100,
-            help="Number of impressions to create",
+            help="Approximate number of impressions to create",
+        )
+        parser.add_argument(
+            "--ctr",
+            type=float,
+            default=0.02,
+            help="Mean click-through rate, per campaign CTR follows a Beta distribution",
+        )
+        parser.add_argument(
+            "--scores-per-client",
+            dest="scores_per_client",
+            type=int,
+            default=5,
+            help="Number of advertisers each client gets an ML score for",
+        )
+        parser.add_argument(
+            "--locations", type=int, default=50, help="Number of distinct locations"
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="Campaigns run within days 1..days"
         )
         parser.add_argument(
-            "--click-chance",
-            dest="click_chance",
+            "--zipf",
             type=float,
-            default=0.3,
-            help="Probability (0.0 to 1.0) that an impression generates a click",
+            default=1.1,
+            help="Zipf exponent of campaign and location popularity",
         )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=200_000,
+            help="Approximate number of impressions generated per batch",
+        )
+        parser.add_argument("--seed", type=int, help="Random seed")
 
     def handle(self, *args, **options):
-        fake = Faker()
-
-        num_advertisers = options["advertisers"]
-        num_campaigns = options["campaigns"]
-        num_clients = options["clients"]
-        num_impressions = options["impressions"]
-        click_chance = options["click_chance"]
-
-        self.stdout.write("Generating Advertisers...")
-        advertisers = []
-        for _ in range(num_advertisers):
-            advertiser = Advertiser(id=uuid.uuid4(), name=fake.company())
-            advertiser.save()
-            advertisers.append(advertiser)
+        self.rng = np.random.default_rng(options["seed"])
+        self.options = options
+        started = time.monotonic()
+
+        self.generate_advertisers()
+        self.generate_campaigns()
+        self.generate_clients()
+        self.generate_events()
+        self.update_campaign_counters()
+        # COPY bypasses record_reach, so the sketches are filled from the table.
+        rebuild_reach()
+        self.stdout.write(self.style.SUCCESS("Rebuilt reach sketches."))
+
         self.stdout.write(
-            self.style.SUCCESS(f"Created {len(advertisers)} advertisers.")
-        )
-
-        self.stdout.write("Generating Campaigns...")
-        campaigns = []
-        for _ in range(num_campaigns):
-            adv = random.choice(advertisers)
-            start_day = random.randint(1, 10)
-            end_day = random.randint(start_day, start_day + 5)
-            age_from = random.randint(18, 40)
-            age_to = random.randint(age_from + 1, 65)
-
-            campaign = Campaign(
-                impressions_limit=random.randint(1000, 10000),
-                clicks_limit=random.randint(100, 1000),
-                cost_per_impression=round(random.uniform(0.01, 1.00), 2),
-                cost_per_click=round(random.uniform(0.1, 5.00), 2),
-                ad_title=fake.sentence(nb_words=6),
-                ad_text=fake.text(max_nb_chars=200),
-                start_date=start_day,
-                end_date=end_day,
-                targeted_gender=random.choice(["MALE", "FEMALE", "ALL"]),
-                targeted_age_from=age_from,
-                targeted_age_to=age_to,
-                erid=fake.bothify(text="???-########"),
-                advertiser=adv,
-            )
-            campaign.save()
-            campaigns.append(campaign)
-        self.stdout.write(self.style.SUCCESS(f"Created {len(campaigns)} campaigns."))
-
-        self.stdout.write("Generating Clients...")
-        clients = []
-        for _ in range(num_clients):
-            client = Client(
-                id=uuid.uuid4(),
-                login=fake.user_name(),
-                age=random.randint(18, 70),
-                location=fake.city(),
-                gender=random.choice(["MALE", "FEMALE"]),
+            self.style.SUCCESS(
+                f"Data generation complete in {time.monotonic() - started:.1f}s."
             )
-            client.save()
-            clients.append(client)
-        self.stdout.write(self.style.SUCCESS(f"Created {len(clients)} clients."))
-
-        self.stdout.write("Generating Impressions and Clicks in ClickHouse...")
-        impressions = []
-        clicks = []
-        for _ in range(num_impressions):
-            while True:
-                try:
-                    client = random.choice(clients)
-                    campaign = random.choice(campaigns)
-                    advertiser = campaign.advertiser
-
-                    impression_day = random.randint(campaign.start_date, campaign.end_date)
-                    impression = Impression(
-                        client_id=client.id,
-                        cost=int(random.uniform(1, 100)),
-                        advertiser_id=advertiser.id,
-                        advertisement_id=campaign.id,
-                        day=impression_day,
-                    )
-                    impression.save()
-                    break
-                except IntegrityError:
-                    pass
-            impressions.append(impression)
-
-            if random.random() < click_chance:
-                click_day = random.randint(impression_day, campaign.end_date)
-                click_cost = int(campaign.cost_per_click * 100)
-                click = Click(
-                    client_id=client.id,
-                    cost=click_cost,
-                    advertiser_id=advertiser.id,
-                    advertisement_id=campaign.id,
-                    day=click_day,
+        )
+
+    def generate_advertisers(self):
+        count = self.options["advertisers"]
+        self.advertiser_ids = uuid_column(self.rng, count)
+        names = text_column("Advertiser ", np.arange(1, count + 1))
+        copy_into(
+            Advertiser, ["id", "name"], [copy_rows(self.advertiser_ids, names)]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {count} advertisers."))
+
+    def generate_campaigns(self):
+        rng, count, days = self.rng, self.options["campaigns"], self.options["days"]
+        self.location_weights = zipf_weights(
+            self.options["locations"], self.options["zipf"], rng
+        )
+
+        self.campaign_ids = uuid_column(rng, count)
+        self.campaign_advertisers = self.advertiser_ids[
+            rng.integers(0, len(self.advertiser_ids), size=count)
+        ]
+        self.start_dates = rng.integers(1, days + 1, size=count)
+        self.end_dates = np.minimum(
+            self.start_dates + rng.geometric(0.15, size=count), days
+        )
+        self.cost_per_impression = np.round(rng.lognormal(-2.5, 0.7, size=count), 2)
+        self.cost_per_click = np.round(rng.lognormal(0, 0.8, size=count), 2)
+        self.popularity = zipf_weights(count, self.options["zipf"], rng)
+        mean_ctr = self.options["ctr"]
+        self.ctr = rng.beta(2, 2 * (1 - mean_ctr) / mean_ctr, size=count)
+
+        impressions_limit = rng.integers(1_000, 100_000, size=count)
+        clicks_limit = np.maximum(1, (impressions_limit * self.ctr * 1.5).astype(int))
+        age_from = rng.integers(14, 50, size=count)
+        age_to = age_from + rng.integers(5, 30, size=count)
+        locations = text_column(
+            "City ",
+            rng.choice(len(self.location_weights), size=count, p=self.location_weights),
+        )
+        numbers = np.arange(1, count + 1)
+
+        copy_into(
+            Campaign,
+            [
+                "id",
+                "advertiser",
+                "impressions_limit",
+                "clicks_limit",
+                "impressions_count",
+                "clicks_count",
+                "cost_per_impression",
+                "cost_per_click",
+                "ad_title",
+                "ad_text",
+                "start_date",
+                "end_date",
+                "targeted_gender",
+                "targeted_age_from",
+                "targeted_age_to",
+                "targeted_location",
+            ],
+            [
+                copy_rows(
+                    self.campaign_ids,
+                    self.campaign_advertisers,
+                    impressions_limit,
+                    clicks_limit,
+                    np.zeros(count, dtype=int),
+                    np.zeros(count, dtype=int),
+                    self.cost_per_impression,
+                    self.cost_per_click,
+                    text_column("Campaign ", numbers),
+                    text_column("Synthetic ad text ", numbers),
+                    self.start_dates,
+                    self.end_dates,
+                    rng.choice(
+                        np.array([b"MALE", b"FEMALE", b"ALL", NULL]),
+                        size=count,
+                        p=[0.25, 0.25, 0.25, 0.25],
+                    ),
+                    nullable(age_from, rng.random(count) < 0.5),
+                    nullable(age_to, rng.random(count) < 0.5),
+                    nullable(locations, rng.random(count) < 0.7),
+                )
+            ],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {count} campaigns."))
+
+    def generate_clients(self):
+        rng, count = self.rng, self.options["clients"]
+        self.client_ids = uuid_column(rng, count)
+        ages = np.clip(rng.normal(35, 12, size=count), 14, 80).astype(int)
+        locations = rng.choice(
+            len(self.location_weights), size=count, p=self.location_weights
+        )
+        copy_into(
+            Client,
+            ["id", "login", "age", "location", "gender"],
+            [
+                copy_rows(
+                    self.client_ids,
+                    text_column("user_", np.arange(1, count + 1)),
+                    ages,
+                    text_column("City ", locations),
+                    rng.choice(np.array([b"MALE", b"FEMALE"]), size=count),
+                )
+            ],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {count} clients."))
+
+    def client_batches(self):
+        """Splits clients so a batch holds about ``batch_size`` impressions."""
+        clients = len(self.client_ids)
+        per_client = max(1.0, self.options["impressions"] / max(1, clients))
+        step = max(1, int(self.options["batch_size"] / per_client))
+        for start in range(0, clients, step):
+            yield np.arange(start, min(start + step, clients)), per_client
+
+    def sample_pairs(self, client_idx, per_client, choices, weights):
+        """
+        Samples distinct (client, item) pairs. Batches never share clients, so
+        pairs deduplicated inside a batch are globally unique.
+        """
+        counts = np.minimum(
+            self.rng.poisson(per_client, size=len(client_idx)), len(weights)
+        )
+        clients = np.repeat(client_idx, counts)
+        items = self.rng.choice(choices, size=len(clients), p=weights)
+        keys = np.unique(clients.astype(np.int64) * len(weights) + items)
+        return keys // len(weights), keys % len(weights)
+
+    def generate_events(self):
+        campaigns = len(self.campaign_ids)
+        self.impressions_count = np.zeros(campaigns, dtype=np.int64)
+        self.clicks_count = np.zeros(campaigns, dtype=np.int64)
+        scores_total = 0
+
+        def impression_batches():
+            if not campaigns:
+                return
+            for client_idx, per_client in self.client_batches():
+                clients, items = self.sample_pairs(
+                    client_idx, per_client, campaigns, self.popularity
+                )
+                span = self.end_dates[items] - self.start_dates[items] + 1
+                days = self.start_dates[items] + (
+                    self.rng.random(len(items)) * span
+                ).astype(int)
+                clicked = self.rng.random(len(items)) < self.ctr[items]
+
+                self.impressions_count += np.bincount(items, minlength=campaigns)
+                self.clicks_count += np.bincount(
+                    items[clicked], minlength=campaigns
+                )
+                self.pending_clicks.append(
+                    (clients[clicked], items[clicked], days[clicked])
+                )
+                yield copy_rows(
+                    self.client_ids[clients],
+                    self.cost_per_impression[items],
+                    self.campaign_advertisers[items],
+                    self.campaign_ids[items],
+                    days,
+                )
+                self.stdout.write(
+                    f"  {self.impressions_count.sum():,} impressions, "
+                    f"{self.clicks_count.sum():,} clicks"
+                )
+
+        def click_batches():
+            while self.pending_clicks:
+                clients, items, days = self.pending_clicks.pop()
+                yield copy_rows(
+                    self.client_ids[clients],
+                    self.cost_per_click[items],
+                    self.campaign_advertisers[items],
+                    self.campaign_ids[items],
+                    days,
                 )
-                click.save()
-                clicks.append(click)
 
+        def score_batches():
+            nonlocal scores_total
+            advertisers = len(self.advertiser_ids)
+            per_client = min(self.options["scores_per_client"], advertisers)
+            if not per_client:
+                return
+            uniform = np.full(advertisers, 1 / advertisers)
+            for client_idx, _ in self.client_batches():
+                clients, items = self.sample_pairs(
+                    client_idx, per_client, advertisers, uniform
+                )
+                scores_total += len(clients)
+                yield copy_rows(
+                    self.client_ids[clients],
+                    self.advertiser_ids[items],
+                    self.rng.integers(1, 101, size=len(clients)),
+                )
+
+        self.stdout.write("Generating Impressions and Clicks...")
+        # Clicks are buffered as index arrays only, which keeps memory far below
+        # the size of the formatted rows.
+        self.pending_clicks = []
+        event_fields = ["client_id", "cost", "advertiser_id", "advertisement", "day"]
+        copy_into(Impression, event_fields, impression_batches())
+        copy_into(Click, event_fields, click_batches())
         self.stdout.write(
-            self.style.SUCCESS(f"Created {len(impressions)} impressions.")
+            self.style.SUCCESS(
+                f"Created {self.impressions_count.sum():,} impressions "
+                f"and {self.clicks_count.sum():,} clicks."
+            )
         )
-        self.stdout.write(self.style.SUCCESS(f"Created {len(clicks)} clicks."))
 
         self.stdout.write("Generating Scores...")
-        scores = []
-        for client in clients:
-            for advertiser in advertisers:
-                score_value = random.randint(1, 100)  # Arbitrary score value
-                score = Score(client=client, advertiser=advertiser, score=score_value)
-                score.save()
-                scores.append(score)
-
-        self.stdout.write(self.style.SUCCESS(f"Created {len(scores)} scores."))
-        self.stdout.write(self.style.SUCCESS("Data generation complete."))
+        copy_into(Score, ["client", "advertiser", "score"], score_batches())
+        self.stdout.write(self.style.SUCCESS(f"Created {scores_total:,} scores."))
+
+    def update_campaign_counters(self):
+        table = connection.ops.quote_name(Campaign._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE generated_counters "
+                "(id uuid PRIMARY KEY, impressions bigint, clicks bigint)"
+            )
+            cursor.copy_expert(
+                "COPY generated_counters (id, impressions, clicks) FROM STDIN",
+                ChunkStream(
+                    [
+                        copy_rows(
+                            self.campaign_ids, self.impressions_count, self.clicks_count
+                        )
+                    ]
+                ),
+            )
+            cursor.execute(
+                f"""
+                UPDATE {table} AS c
+                SET impressions_count = g.impressions,
+                    clicks_count = g.clicks,
+                    impressions_limit = GREATEST(c.impressions_limit, g.impressions),
+                    clicks_limit = GREATEST(c.clicks_limit, g.clicks)
+                FROM generated_counters AS g
+                WHERE c.id = g.id
+                """
+            )
+            cursor.execute("DROP TABLE generated_counters")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from business.reach import rebuild_reach
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the reach sketches in Redis from the recorded impressions, "
+        "e.g. after impressions were loaded with generate_data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--advertiser",
+            help="Rebuild only the sketches of this advertiser and its campaigns.",
+        )
+
+    def handle(self, *args, **options):
+        added = rebuild_reach(options["advertiser"])
+        self.stdout.write(self.style.SUCCESS(f"Reach rebuilt from {added:,} impressions."))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from app.jobs import queue
+from business.grafana import reconcile_grafana_users
+from business.models import Advertiser
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates missing Grafana users for advertisers and deletes users of "
+        "advertisers that no longer exist."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--purge",
+            action="store_true",
+            help="Delete every advertiser user from Grafana instead.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=10,
+            help="Number of concurrent Grafana requests (default: 10).",
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            if done % 100 == 0 or done == total:
+                self.stdout.write(f"{done}/{total} changes applied")
+
+        result = reconcile_grafana_users(
+            Advertiser.objects.only("id", "name"),
+            purge=options["purge"],
+            workers=options["workers"],
+            progress=progress,
+        )
+        queue.forget(*(f"grafana-user:{login}" for login in result["deleted"]))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Grafana reconciled: {len(result['created'])} created, "
+                f"{len(result['deleted'])} deleted."
+            )
+        )
+        if result["failed"]:
+            self.stdout.write(
+                self.style.WARNING(f"{len(result['failed'])} changes failed, see the log.")
+            )
@@ -0,0 +1,62 @@
+import signal
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from app.jobs import queue
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the Redis queue (see app/jobs.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--name",
+            type=str,
+            default=socket.gethostname(),
+            help=(
+                "Worker name. Jobs left unfinished by a worker with the same name "
+                "are picked up again on start (default: hostname)."
+            ),
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        autodiscover_modules("tasks")
+        worker = options["name"]
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if recovered := queue.recover(worker):
+            self.stdout.write(f"Requeued {recovered} unfinished jobs of {worker}.")
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} started."))
+
+        done = failed = 0
+        while self.running:
+            raw = queue.reserve(worker)
+            if raw is None:
+                if options["burst"]:
+                    break
+                continue
+
+            close_old_connections()
+            if queue.run(worker, raw):
+                done += 1
+            else:
+                failed += 1
+            close_old_connections()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Worker {worker} stopped: {done} done, {failed} failed.")
+        )
+
+    def stop(self, signum, frame):
+        # Finish the current job, the loop checks the flag before taking the next one.
+        self.running = False
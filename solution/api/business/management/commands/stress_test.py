@@ -1,18 +1,121 @@
-import requests
+import asyncio
+import logging
 import random
-import time
-from django.core.management.base import BaseCommand
-from concurrent.futures import ThreadPoolExecutor
-from client.models import Client  # Adjust to your actual Client model import
+from collections import deque
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from business.models import Campaign
+from client.models import Client
+
+ARRIVAL_PATTERNS = ("constant", "poisson", "ramp")
+DEFAULT_MIX = "ads=85,stats=10,click=5"
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of latencies in microseconds.
+
+    Every power-of-two range is split into ``2 ** sub_bucket_bits`` linear
+    buckets, so the relative error is bounded and memory does not grow with the
+    number of recorded samples.
+    """
+
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def _bucket(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (value >> shift) << shift, (1 << shift) - 1
+
+    def record(self, value_us, count=1):
+        value_us = max(0, int(value_us))
+        lower, _ = self._bucket(value_us)
+        self.counts[lower] = self.counts.get(lower, 0) + count
+        self.total += count
+        self.max = max(self.max, value_us)
+
+    def merge(self, other):
+        for lower, count in other.counts.items():
+            self.counts[lower] = self.counts.get(lower, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile):
+        if not self.total:
+            return 0
+        threshold = self.total * percentile / 100
+        seen = 0
+        for lower in sorted(self.counts):
+            seen += self.counts[lower]
+            if seen >= threshold:
+                _, width = self._bucket(lower)
+                return min(lower + width, self.max)
+        return self.max
+
+
+def arrival_offsets(pattern, rate, duration, ramp_to=None, rng=random):
+    """
+    Yields the intended send times (seconds from start) of an open-loop
+    schedule. ``ramp`` grows the rate linearly from ``rate`` to ``ramp_to``.
+    """
+    offset = 0.0
+    while True:
+        current_rate = rate
+        if pattern == "ramp":
+            current_rate = rate + (ramp_to - rate) * offset / duration
+        if pattern == "poisson":
+            offset += rng.expovariate(current_rate)
+        else:
+            offset += 1 / current_rate
+        if offset >= duration:
+            return
+        yield offset
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("ads", "click", "stats") or not weight:
+            raise CommandError(f"Неверный формат mix: {part}")
+        mix[name] = float(weight)
+    if not sum(mix.values()):
+        raise CommandError("Сумма весов mix должна быть больше нуля.")
+    return mix
+
+
+class OperationStats:
+    def __init__(self):
+        self.response_time = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.statuses = {}
+
+    def record(self, status, intended, sent, done):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.response_time.record((done - intended) * 1_000_000)
+        self.service_time.record((done - sent) * 1_000_000)
 
 
 class Command(BaseCommand):
-    help = "Stress test the /ads endpoint with random client_id from clients table and calculate average response time."
+    help = (
+        "Open-loop load test of /ads, click and stats endpoints. Requests are sent "
+        "on a fixed arrival schedule regardless of server latency, response time is "
+        "measured from the intended send time to avoid coordinated omission."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("url", type=str, help="The base URL of the API to test.")
         parser.add_argument(
-            "--rps", type=int, default=500, help="Requests per second (default: 500)."
+            "--rps",
+            type=float,
+            default=500,
+            help="Arrival rate in requests per second (default: 500).",
         )
         parser.add_argument(
             "--duration",
@@ -20,67 +123,184 @@ class Command(BaseCommand):
             default=10,
             help="Duration for the test in seconds (default: 10).",
         )
+        parser.add_argument(
+            "--arrival",
+            choices=ARRIVAL_PATTERNS,
+            default="poisson",
+            help="Arrival process (default: poisson).",
+        )
+        parser.add_argument(
+            "--ramp-to",
+            dest="ramp_to",
+            type=float,
+            help="Final arrival rate for --arrival=ramp (default: 2 * rps).",
+        )
+        parser.add_argument(
+            "--mix",
+            type=str,
+            default=DEFAULT_MIX,
+            help=f"Traffic mix weights (default: {DEFAULT_MIX}).",
+        )
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=500,
+            help="Maximum number of open HTTP connections (default: 500).",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=10,
+            help="Request timeout in seconds (default: 10).",
+        )
+        parser.add_argument("--seed", type=int, help="Random seed.")
 
-    def get_all_client_ids(self):
-        # Fetch all client_ids from the clients table
-        client_ids = list(Client.objects.values_list("id", flat=True))
-        return client_ids
+    def handle(self, *args, **options):
+        if options["rps"] <= 0:
+            raise CommandError("rps должен быть больше нуля.")
+        if options["arrival"] == "ramp" and options["ramp_to"] is None:
+            options["ramp_to"] = options["rps"] * 2
 
-    def send_request(self, url, client_ids, response_times):
-        try:
-            # Get a random client_id from pre-fetched client_ids
-            client_id = random.choice(client_ids)
-            full_url = f"{url}?client_id={client_id}"
+        client_ids = [str(pk) for pk in Client.objects.values_list("id", flat=True)]
+        campaign_ids = [str(pk) for pk in Campaign.objects.values_list("id", flat=True)]
+        if not client_ids:
+            raise CommandError("No clients found in the database.")
 
-            start_time = time.time()  # Start measuring response time
-            response = requests.get(full_url)
-            end_time = time.time()  # End measuring response time
+        # httpx logs every request at INFO, which would flood the output.
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        self.rng = random.Random(options["seed"])
+        self.mix = parse_mix(options["mix"])
+        self.client_ids = client_ids
+        self.campaign_ids = campaign_ids
+        self.served = deque(maxlen=10_000)
+        self.stats = {name: OperationStats() for name in ("ads", "click", "stats")}
+        self.max_lag = 0.0
 
-            # Calculate the response time and add it to the list
-            response_time = end_time - start_time
-            response_times.append(response_time)
+        self.stdout.write(
+            f"Starting {options['arrival']} open-loop test on {options['url']} "
+            f"at {options['rps']:g} rps for {options['duration']} seconds."
+        )
+        elapsed = asyncio.run(self.run(options))
+        self.report(elapsed)
 
-            print(
-                f"Sent request to {full_url}, Response: {response.status_code}, Time: {response_time:.4f}s"
-            )
-        except Exception as e:
-            print(f"Error while sending request: {e}")
+    def choose_operation(self):
+        names = list(self.mix)
+        name = self.rng.choices(names, weights=[self.mix[n] for n in names])[0]
+        if name == "click" and not self.served:
+            return "ads"
+        if name == "stats" and not self.campaign_ids:
+            return "ads"
+        return name
+
+    def build_request(self, name):
+        if name == "click":
+            client_id, ad_id = self.served.popleft()
+            return "POST", f"/ads/{ad_id}/click", {"client_id": client_id}
+        if name == "stats":
+            campaign_id = self.rng.choice(self.campaign_ids)
+            suffix = "/daily" if self.rng.random() < 0.5 else ""
+            return "GET", f"/stats/campaigns/{campaign_id}{suffix}", None
+        client_id = self.rng.choice(self.client_ids)
+        return "GET", f"/ads?client_id={client_id}", None
+
+    async def send(self, http, name, request, intended):
+        loop = asyncio.get_running_loop()
+        method, path, body = request
+        stats = self.stats[name]
+        sent = loop.time()
+        try:
+            response = await http.request(method, path, json=body)
+        except httpx.HTTPError:
+            stats.record("error", intended, sent, loop.time())
+            return
+        stats.record(response.status_code, intended, sent, loop.time())
 
-    def handle(self, *args, **kwargs):
-        url = kwargs["url"]
-        rps = kwargs["rps"]
-        duration = kwargs["duration"]
+        if name == "ads" and response.status_code == 200:
+            # Clicks are only sent for ads that were actually shown, otherwise
+            # the endpoint rejects them before doing any real work.
+            self.served.append((path.rsplit("=", 1)[1], response.json()["ad_id"]))
 
-        print(
-            f"Starting stress test on {url} with {rps} requests per second for {duration} seconds."
+    async def run(self, options):
+        loop = asyncio.get_running_loop()
+        limits = httpx.Limits(
+            max_connections=options["connections"],
+            max_keepalive_connections=options["connections"],
+        )
+        schedule = arrival_offsets(
+            options["arrival"],
+            options["rps"],
+            options["duration"],
+            ramp_to=options["ramp_to"],
+            rng=self.rng,
         )
 
-        # Fetch all client_ids before starting the test
-        client_ids = self.get_all_client_ids()
+        tasks = set()
+        async with httpx.AsyncClient(
+            base_url=options["url"], limits=limits, timeout=options["timeout"]
+        ) as http:
+            start = loop.time()
+            for offset in schedule:
+                intended = start + offset
+                delay = intended - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
 
-        if not client_ids:
-            print("No clients found in the database.")
-            return
+                name = self.choose_operation()
+                request = self.build_request(name)
+                task = asyncio.create_task(self.send(http, name, request, intended))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
-        response_times = []  # List to store response times
+            if tasks:
+                await asyncio.gather(*tasks)
+            return loop.time() - start
 
-        # Use ThreadPoolExecutor to simulate the requests per second
-        with ThreadPoolExecutor(max_workers=rps) as executor:
-            start_time = time.time()
-            end_time = start_time + duration
+    def format_histogram(self, histogram):
+        values = [
+            f"p{p:g}={histogram.percentile(p) / 1000:.2f}ms" for p in PERCENTILES
+        ]
+        values.append(f"max={histogram.max / 1000:.2f}ms")
+        return " ".join(values)
 
-            while time.time() < end_time:
-                # Dispatch a request every second to maintain steady load
-                for _ in range(rps):
-                    executor.submit(self.send_request, url, client_ids, response_times)
+    def report(self, elapsed):
+        total = LatencyHistogram()
+        self.stdout.write(f"\nStress test finished in {elapsed:.2f} seconds.")
+        for name, stats in self.stats.items():
+            if not stats.response_time.total:
+                continue
+            total.merge(stats.response_time)
+            statuses = ", ".join(
+                f"{status}: {count}"
+                for status, count in sorted(stats.statuses.items(), key=str)
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f"\n{name}: {stats.response_time.total} requests")
+            )
+            self.stdout.write(f"  statuses: {statuses}")
+            self.stdout.write(
+                f"  response time: {self.format_histogram(stats.response_time)}"
+            )
+            self.stdout.write(
+                f"  service time:  {self.format_histogram(stats.service_time)}"
+            )
 
-            # Calculate the average response time after the test
-            if response_times:
-                avg_response_time = sum(response_times) / len(response_times)
-                print(
-                    f"\nStress test finished. Total time: {time.time() - start_time:.2f} seconds."
+        if not total.total:
+            self.stdout.write(
+                "No requests were made, so no response time data is available."
+            )
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\nTotal: {total.total} requests, {total.total / elapsed:.1f} rps"
+            )
+        )
+        self.stdout.write(f"  response time: {self.format_histogram(total)}")
+        if self.max_lag > 0.01:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Generator fell behind schedule by up to {self.max_lag * 1000:.1f}ms, "
+                    "the client machine is saturated."
                 )
-                print(f"Total requests made: {len(response_times)}")
-                print(f"Average response time: {avg_response_time:.4f} seconds.")
-            else:
-                print("No requests were made, so no response time data is available.")
+            )
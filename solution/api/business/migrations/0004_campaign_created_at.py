@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0003_campaign_clicks_count_campaign_impressions_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['advertiser', 'created_at', 'id'], name='business_ca_adverti_e31a32_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0004_campaign_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCampaignStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('advertiser_id', models.UUIDField()),
+                ('day', models.BigIntegerField()),
+                ('impressions_count', models.PositiveIntegerField(default=0)),
+                ('clicks_count', models.PositiveIntegerField(default=0)),
+                ('spent_impressions', models.FloatField(default=0)),
+                ('spent_clicks', models.FloatField(default=0)),
+                ('advertisement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='business.campaign')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['advertiser_id', 'day'], name='business_da_adverti_ea3810_idx')],
+                'unique_together': {('advertisement', 'day')},
+            },
+        ),
+    ]
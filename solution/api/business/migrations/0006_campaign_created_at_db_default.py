@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:09
+
+import django.db.models.functions.datetime
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0005_dailycampaignstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='campaign',
+            name='created_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), default=django.utils.timezone.now, editable=False),
+        ),
+    ]
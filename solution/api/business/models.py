@@ -1,8 +1,10 @@
 import uuid
 
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
 from django.db.models import Max, Min
+from django.db.models.functions import Now
+from django.utils import timezone
 
 from app.utils import get_current_day
 from app.validators import profanity_validator
@@ -47,6 +49,9 @@ class Campaign(models.Model):
         max_length=500, null=True, blank=True, validators=[profanity_validator]
     )
     erid = models.CharField(max_length=20, null=True, blank=True)  # Для РФ
+    created_at = models.DateTimeField(
+        default=timezone.now, db_default=Now(), editable=False
+    )
 
     advertiser = models.ForeignKey(
         Advertiser, on_delete=models.CASCADE, related_name="campaigns"
@@ -65,9 +70,69 @@ class Campaign(models.Model):
             models.Index(fields=["targeted_age_to"]),
             models.Index(fields=["targeted_location"]),
             models.Index(fields=["erid"]),
+            # Keyset pagination of an advertiser's campaigns in creation order.
+            models.Index(fields=["advertiser", "created_at", "id"]),
         ]
 
     def is_started(self):
         return self.start_date < get_current_day()
 
 
+class DailyCampaignStats(models.Model):
+    """
+    Impressions and clicks of a campaign on a closed day. Field names follow
+    Impression and Click so statistics filters apply to both.
+    """
+
+    advertisement = models.ForeignKey(
+        Campaign, on_delete=models.CASCADE, related_name="daily_stats"
+    )
+    advertiser_id = models.UUIDField()
+    day = models.BigIntegerField()
+    impressions_count = models.PositiveIntegerField(default=0)
+    clicks_count = models.PositiveIntegerField(default=0)
+    spent_impressions = models.FloatField(default=0)
+    spent_clicks = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = (("advertisement", "day"),)
+        indexes = [models.Index(fields=["advertiser_id", "day"])]
+
+    @staticmethod
+    def close_days(first, last):
+        """
+        Rolls the impressions and clicks of days ``first`` to ``last`` up per
+        campaign with one statement. Closing a day again recounts it.
+        Returns the number of rows written.
+        """
+        query = """
+            INSERT INTO business_dailycampaignstats (
+                advertisement_id, advertiser_id, day,
+                impressions_count, clicks_count, spent_impressions, spent_clicks
+            )
+            SELECT advertisement_id, advertiser_id, day,
+                   SUM(impressions), SUM(clicks), SUM(spent_impressions), SUM(spent_clicks)
+            FROM (
+                SELECT advertisement_id, advertiser_id, day,
+                       COUNT(*) AS impressions, 0 AS clicks,
+                       SUM(cost) AS spent_impressions, 0 AS spent_clicks
+                FROM client_impression
+                WHERE day BETWEEN %s AND %s
+                GROUP BY advertisement_id, advertiser_id, day
+                UNION ALL
+                SELECT advertisement_id, advertiser_id, day,
+                       0, COUNT(*), 0, SUM(cost)
+                FROM client_click
+                WHERE day BETWEEN %s AND %s
+                GROUP BY advertisement_id, advertiser_id, day
+            ) AS events
+            GROUP BY advertisement_id, advertiser_id, day
+            ON CONFLICT (advertisement_id, day) DO UPDATE SET
+                impressions_count = EXCLUDED.impressions_count,
+                clicks_count = EXCLUDED.clicks_count,
+                spent_impressions = EXCLUDED.spent_impressions,
+                spent_clicks = EXCLUDED.spent_clicks;
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, [first, last, first, last])
+            return cursor.rowcount
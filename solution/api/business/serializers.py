@@ -1,9 +1,9 @@
-from django.db.models import Sum, Count
 from rest_framework import serializers, status
 
 from app.exceptions import CustomAPIException
 from app.serializers import ClearNullMixin
 from app.utils import get_current_day
+from .images import image_variant_urls
 from .models import Advertiser, Score, Campaign
 
 
@@ -143,6 +143,7 @@ class CampaignSerializer(ClearNullMixin, serializers.ModelSerializer):
         required=False,
     )
     targeting = TargetingSerializer(required=False)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Campaign
@@ -159,6 +160,7 @@ class CampaignSerializer(ClearNullMixin, serializers.ModelSerializer):
             "end_date",
             "targeting",
             "image",
+            "image_variants",
             "erid",
             "targeted_gender",
             "targeted_age_from",
@@ -196,6 +198,9 @@ class CampaignSerializer(ClearNullMixin, serializers.ModelSerializer):
             },
         }
 
+    def get_image_variants(self, obj):
+        return image_variant_urls(obj.image.name)
+
     def update(self, instance, validated_data):
         (validated_data.pop("impressions_limit", instance.impressions_limit),)
         (validated_data.pop("clicks_limit", instance.impressions_limit),)
@@ -273,118 +278,6 @@ class CampaignForClientSerializer(ClearNullMixin, serializers.ModelSerializer):
         )
 
 
-class CampaignStatisticsSerializer(ClearNullMixin, serializers.ModelSerializer):
-    impressions_count = serializers.SerializerMethodField()
-    clicks_count = serializers.SerializerMethodField()
-    conversion = serializers.SerializerMethodField()
-    spent_impressions = serializers.SerializerMethodField()
-    spent_clicks = serializers.SerializerMethodField()
-    spent_total = serializers.SerializerMethodField()
-
-    def get_impressions_count(self, obj):
-        self.impressions_count = obj.impressions.count()  # FIX
-        return self.impressions_count
-
-    def get_clicks_count(self, obj):
-        self.clicks_count = obj.clicks.count()  # FIX
-        return self.clicks_count
-
-    def get_conversion(self, obj):
-        self.conversion = 0
-        if not self.impressions_count == 0:
-            self.conversion = (self.clicks_count / self.impressions_count) * 100
-        return self.conversion
-
-    def get_spent_impressions(self, obj):
-        self.spent_impressions = obj.impressions.aggregate(total=Sum("cost"))[
-            "total"
-        ]  # FIX
-        if not self.spent_impressions:
-            self.spent_impressions = 0
-        return self.spent_impressions
-
-    def get_spent_clicks(self, obj):
-        self.spent_clicks = obj.clicks.aggregate(total=Sum("cost"))["total"]  # FIX
-        if not self.spent_clicks:
-            self.spent_clicks = 0
-        return self.spent_clicks
-
-    def get_spent_total(self, obj):
-        return self.spent_clicks + self.spent_impressions
-
-    class Meta:
-        model = Campaign
-        fields = (
-            "impressions_count",
-            "clicks_count",
-            "conversion",
-            "spent_impressions",
-            "spent_clicks",
-            "spent_total",
-        )
-
-
-class AdvertiserStatisticsSerializer(ClearNullMixin, serializers.ModelSerializer):
-    impressions_count = serializers.SerializerMethodField()
-    clicks_count = serializers.SerializerMethodField()
-    conversion = serializers.SerializerMethodField()
-    spent_impressions = serializers.SerializerMethodField()
-    spent_clicks = serializers.SerializerMethodField()
-    spent_total = serializers.SerializerMethodField()
-
-    def get_impressions_count(self, obj):
-        self.impressions_count = obj.campaigns.aggregate(total=Count("impressions"))[
-            "total"
-        ]  # FIX
-        if not self.impressions_count:
-            self.impressions_count = 0
-        return self.impressions_count
-
-    def get_clicks_count(self, obj):
-        self.clicks_count = obj.campaigns.aggregate(total=Count("clicks"))[
-            "total"
-        ]  # FIX
-        if not self.clicks_count:
-            self.clicks_count = 0
-        return self.clicks_count
-
-    def get_conversion(self, obj):
-        self.conversion = 0
-        if not self.impressions_count == 0:
-            self.conversion = (self.clicks_count / self.impressions_count) * 100
-        return self.conversion
-
-    def get_spent_impressions(self, obj):
-        self.spent_impressions = obj.campaigns.aggregate(
-            total=Sum("impressions__cost")
-        )["total"]  # FIX
-        if not self.spent_impressions:
-            self.spent_impressions = 0
-        return self.spent_impressions
-
-    def get_spent_clicks(self, obj):
-        self.spent_clicks = obj.campaigns.aggregate(total=Sum("clicks__cost"))[
-            "total"
-        ]  # FIX
-        if not self.spent_clicks:
-            self.spent_clicks = 0
-        return self.spent_clicks
-
-    def get_spent_total(self, obj):
-        return self.spent_clicks + self.spent_impressions
-
-    class Meta:
-        model = Advertiser
-        fields = (
-            "impressions_count",
-            "clicks_count",
-            "conversion",
-            "spent_impressions",
-            "spent_clicks",
-            "spent_total",
-        )
-
-
 class StatisticsSerializer(serializers.Serializer):
     impressions_count = serializers.IntegerField()
     clicks_count = serializers.IntegerField()
@@ -392,3 +285,9 @@ class StatisticsSerializer(serializers.Serializer):
     spent_impressions = serializers.FloatField()
     spent_clicks = serializers.FloatField()
     spent_total = serializers.FloatField()
+    # Approximate distinct clients, None when it could not be counted.
+    reach = serializers.IntegerField(allow_null=True)
+
+
+class DailyStatisticsSerializer(StatisticsSerializer):
+    date = serializers.IntegerField()
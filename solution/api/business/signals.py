@@ -0,0 +1,31 @@
+import logging
+
+from django.dispatch import receiver
+from redis import RedisError
+
+from app.events import day_advanced
+from app.jobs import queue
+from business.utils import get_closed_day
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(day_advanced)
+def close_statistics(sender, previous, day, **kwargs):
+    """
+    Queues the rollup of the days that ended before ``previous``. Requests
+    that read the day before the advance may still record events of
+    ``previous``, so it is closed on the next advance.
+    """
+    first, last = get_closed_day() + 1, previous - 1
+    if first > last:
+        return
+    try:
+        queue.enqueue(
+            "stats.close_days",
+            first,
+            last,
+            idempotency_key=f"stats-close:{first}:{last}",
+        )
+    except RedisError as e:
+        logger.error(f"Failed to queue closing of days {first}-{last}: {e}")
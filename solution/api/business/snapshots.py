@@ -0,0 +1,96 @@
+"""
+Campaign snapshots.
+
+Fields of a campaign that change only through the campaign endpoints are
+cached as a plain tuple under a key carrying the campaign's version. The
+update and delete paths bump the version, so a snapshot filled from a read
+that raced with an update is never served. Counters are not part of the
+snapshot and are always read from the database.
+"""
+import time
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from app.metrics import record_cache_access
+from business.models import Campaign
+
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+# A fill holds its lock at most this long, e.g. when its process dies.
+FILL_LOCK_TIMEOUT = 5
+FILL_WAIT = 0.01
+FILL_WAIT_ATTEMPTS = 20
+
+
+class CampaignSnapshot(NamedTuple):
+    id: str
+    advertiser_id: str
+    impressions_limit: int
+    clicks_limit: int
+    cost_per_impression: float
+    cost_per_click: float
+    ad_title: str
+    ad_text: str
+    start_date: int
+    end_date: int
+    targeted_gender: str | None
+    targeted_age_from: int | None
+    targeted_age_to: int | None
+    targeted_location: str | None
+
+
+def version_key(campaign_id):
+    return f"campaign-version:{campaign_id}"
+
+
+def snapshot_key(campaign_id, version):
+    return f"campaign:{campaign_id}:{version}"
+
+
+def bump_campaign_version(campaign_id):
+    try:
+        cache.incr(version_key(campaign_id))
+    except ValueError:
+        if not cache.add(version_key(campaign_id), 1, None):
+            cache.incr(version_key(campaign_id))
+
+
+def load_snapshot(campaign_id):
+    values = (
+        Campaign.objects.filter(pk=campaign_id)
+        .values_list(*CampaignSnapshot._fields)
+        .first()
+    )
+    if values is None:
+        return None
+    campaign_id, advertiser_id, *fields = values
+    return CampaignSnapshot(str(campaign_id), str(advertiser_id), *fields)
+
+
+def get_campaign_snapshot(campaign_id):
+    """
+    Returns the snapshot of the campaign or None if it does not exist. Only
+    one process fills a missing snapshot, the others wait for it briefly and
+    read the database themselves if it takes longer.
+    """
+    version = cache.get(version_key(campaign_id), 0)
+    key = snapshot_key(campaign_id, version)
+    values = cache.get(key)
+    record_cache_access("campaign_snapshot", values is not None)
+    if values is not None:
+        return CampaignSnapshot(*values)
+
+    if not cache.add(f"{key}:fill", 1, FILL_LOCK_TIMEOUT):
+        for _ in range(FILL_WAIT_ATTEMPTS):
+            time.sleep(FILL_WAIT)
+            if (values := cache.get(key)) is not None:
+                return CampaignSnapshot(*values)
+        return load_snapshot(campaign_id)
+
+    try:
+        snapshot = load_snapshot(campaign_id)
+        if snapshot is not None:
+            cache.set(key, tuple(snapshot), SNAPSHOT_TIMEOUT)
+        return snapshot
+    finally:
+        cache.delete(f"{key}:fill")
@@ -0,0 +1,55 @@
+import logging
+
+from app.jobs import queue, task
+from business.ai import generate_advertising_text
+from business.grafana import ensure_grafana_user, reconcile_grafana_users
+from business.models import Advertiser, DailyCampaignStats
+from business.reach import rebuild_reach
+from business.utils import set_closed_day
+
+logger = logging.getLogger(__name__)
+
+
+@task("grafana.provision_user")
+def provision_grafana_user(advertiser_id):
+    # The advertiser may have been removed while the job was waiting.
+    if advertiser := Advertiser.objects.filter(pk=advertiser_id).first():
+        ensure_grafana_user(advertiser)
+
+
+@task("grafana.reconcile_users", max_retries=3)
+def reconcile_grafana(purge=False):
+    def progress(done, total):
+        if done % 1000 == 0 or done == total:
+            logger.info(f"Grafana reconciliation: {done}/{total}")
+
+    result = reconcile_grafana_users(
+        Advertiser.objects.only("id", "name"), purge=purge, progress=progress
+    )
+    # Deleted users must be provisioned again on the next upsert.
+    queue.forget(*(f"grafana-user:{login}" for login in result["deleted"]))
+    logger.info(
+        f"Grafana reconciliation finished: {len(result['created'])} created, "
+        f"{len(result['deleted'])} deleted, {len(result['failed'])} failed"
+    )
+    return result
+
+
+@task("ai.generate_text")
+def generate_text(title, targeting=None):
+    generate_advertising_text(title, targeting)
+
+
+@task("stats.close_days", max_retries=3)
+def close_days(first, last):
+    rows = DailyCampaignStats.close_days(first, last)
+    set_closed_day(last)
+    logger.info(f"Closed statistics of days {first}-{last}: {rows} campaign rows")
+    return rows
+
+
+@task("reach.rebuild", max_retries=3)
+def rebuild_advertiser_reach(advertiser_id=None):
+    added = rebuild_reach(advertiser_id)
+    logger.info(f"Rebuilt reach of {advertiser_id or 'all advertisers'} from {added} impressions")
+    return added
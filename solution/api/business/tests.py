@@ -1,14 +1,69 @@
+import csv
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 from rest_framework.exceptions import ValidationError
 
+from app.events import EPOCH_KEY, get_epoch
+from app.exceptions import CustomAPIException
+from app.idempotency import idempotent
+from app.jobs import JobQueue, queue, task
+from app.middleware import TracingMiddleware
+from app.testing import QueryBudgetMixin, query_shape
+from app.tracing import span
 from app.utils import set_day
-from django.test import TestCase
+from business.ai import StubBackend, generate_advertising_text
+from business.grafana import reconcile_grafana_users
+from business.models import DailyCampaignStats
+from business.reach import (
+    ADVERTISER,
+    ALL_DAYS,
+    CAMPAIGN,
+    reach_key,
+    rebuild_reach,
+    record_reach,
+)
+from business.snapshots import get_campaign_snapshot, snapshot_key, version_key
+from business.images import image_variant_urls, store_campaign_image
+from business.tasks import close_days
+from business.utils import (
+    CLOSED_DAY_KEY,
+    get_closed_day,
+    set_closed_day,
+    set_local_cache_cur_min_max_score,
+)
+from client import candidates
+from client.segments import ENTRY_OVERHEAD, SegmentCache, segments
+from client.views import reserve_impressions
+from business.management.commands.stress_test import (
+    LatencyHistogram,
+    arrival_offsets,
+)
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+import pyarrow.parquet as pq
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
+from redis import RedisError
 import uuid
 from client.models import Client
-from unittest.mock import patch
+from unittest.mock import PropertyMock, call, patch
 from client.models import (
     Advertiser,
+    Candidate,
+    Click,
     Campaign,
     Score,
     Impression,
@@ -102,6 +157,39 @@ class CampaignsTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_list_campaigns_keyset(self):
+        url = f"/advertisers/{self.advertiser.id}/campaigns"
+        for i in range(5):
+            self.client.post(
+                url, {**self.campaign_data, "ad_title": f"Campaign {i}"}, format="json"
+            )
+
+        titles = []
+        response = self.client.get(url, {"size": 2, "count": 1})
+        self.assertEqual(response["X-Total-Count"], "5")
+        self.assertNotIn("X-Previous-Cursor", response)
+        while True:
+            titles += [campaign["ad_title"] for campaign in response.data]
+            if "X-Next-Cursor" not in response:
+                break
+            response = self.client.get(url, {"size": 2, "cursor": response["X-Next-Cursor"]})
+        self.assertEqual(titles, [f"Campaign {i}" for i in range(5)])
+
+        # Backward pages are the forward pages: [0, 1], [2, 3], [4].
+        response = self.client.get(url, {"size": 2, "cursor": response["X-Last-Cursor"]})
+        self.assertEqual([c["ad_title"] for c in response.data], ["Campaign 4"])
+        self.assertNotIn("X-Next-Cursor", response)
+        response = self.client.get(url, {"size": 2, "cursor": response["X-Previous-Cursor"]})
+        self.assertEqual([c["ad_title"] for c in response.data], ["Campaign 2", "Campaign 3"])
+        response = self.client.get(url, {"size": 2, "cursor": response["X-Previous-Cursor"]})
+        self.assertEqual([c["ad_title"] for c in response.data], ["Campaign 0", "Campaign 1"])
+        self.assertNotIn("X-Previous-Cursor", response)
+        response = self.client.get(url, {"size": 5, "cursor": response["X-Last-Cursor"]})
+        self.assertEqual(len(response.data), 5)
+
+        response = self.client.get(url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_campaign(self):
         post_url = f"/advertisers/{self.advertiser.id}/campaigns"
         post_response = self.client.post(post_url, self.campaign_data, format="json")
@@ -123,6 +211,63 @@ class CampaignsTests(TestCase):
         self.assertEqual(Campaign.objects.count(), 0)
 
 
+class BatchReadTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Batch")
+        self.campaigns = [
+            Campaign.objects.create(
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0,
+                cost_per_click=5.0,
+                ad_title=f"Batch Ad {i}",
+                ad_text="Content",
+                start_date=1,
+                end_date=30,
+            )
+            for i in range(3)
+        ]
+
+    def test_campaigns_batch(self):
+        ids = [self.campaigns[2].id, uuid.uuid4(), self.campaigns[0].id]
+        response = self.client.get("/campaigns/batch", {"ids": ",".join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [campaign["ad_title"] for campaign in response.data],
+            ["Batch Ad 2", "Batch Ad 0"],
+        )
+
+    def test_advertisers_batch(self):
+        response = self.client.get("/advertisers/batch", {"ids": str(self.advertiser.id)})
+        self.assertEqual(
+            response.data, [{"advertiser_id": str(self.advertiser.id), "name": "Batch"}]
+        )
+
+        response = self.client.get("/advertisers/batch", {"ids": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conditional_get(self):
+        url = f"/campaigns/batch?ids={self.campaigns[0].id}"
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Campaign.objects.filter(pk=self.campaigns[0].pk).update(ad_title="Changed")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Other endpoints do not pay for hashing their responses.
+        response = self.client.get(f"/stats/campaigns/{self.campaigns[0].id}")
+        self.assertNotIn("ETag", response)
+
+
 class AdsTests(TestCase):
     databases = "__all__"
     databases = "__all__"
@@ -353,6 +498,279 @@ class AdsEndpointTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 
+@patch("client.views.get_current_day", return_value=5)
+class AdsBatchTests(QueryBudgetMixin, TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        segments.clear()
+        self.clients = [
+            Client.objects.create(
+                id=uuid.uuid4(), login=f"batch{i}", age=25, location="City", gender="MALE"
+            )
+            for i in range(2)
+        ]
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Batch")
+        self.campaigns = [
+            Campaign.objects.create(
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0 + i,
+                cost_per_click=5.0,
+                ad_title=f"Batch Ad {i}",
+                ad_text="Content",
+                start_date=1,
+                end_date=30,
+            )
+            for i in range(3)
+        ]
+        set_local_cache_cur_min_max_score()
+
+    def test_batch_reserves_distinct_ads(self, mock_day):
+        client_id = self.clients[0].id
+        response = self.api_client.get("/ads/batch", {"client_id": client_id, "n": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = [ad["ad_id"] for ad in response.json()]
+        self.assertEqual(len(set(first)), 2)
+
+        response = self.api_client.get("/ads/batch", {"client_id": client_id, "n": 2})
+        second = [ad["ad_id"] for ad in response.json()]
+        self.assertEqual(len(second), 1)
+        self.assertNotIn(second[0], first)
+        self.assertEqual(Impression.objects.filter(client_id=client_id).count(), 3)
+
+    def test_multi_client_batch(self, mock_day):
+        client_ids = ",".join(str(client.id) for client in self.clients)
+        with self.assertQueryBudget(4):
+            response = self.api_client.get("/ads/batch", {"client_ids": client_ids, "n": 3})
+        data = response.json()
+        self.assertEqual(set(data), {str(client.id) for client in self.clients})
+        self.assertTrue(all(len(ads) == 3 for ads in data.values()))
+        for campaign in self.campaigns:
+            campaign.refresh_from_db()
+            self.assertEqual(campaign.impressions_count, 2)
+
+    def test_multi_client_batch_respects_impressions_limit(self, mock_day):
+        Campaign.objects.filter(advertiser=self.advertiser).update(impressions_limit=1)
+        self.clients += [
+            Client.objects.create(
+                id=uuid.uuid4(), login=f"batch{i}", age=25, location="City", gender="MALE"
+            )
+            for i in range(2, 5)
+        ]
+        client_ids = ",".join(str(client.id) for client in self.clients)
+        response = self.api_client.get("/ads/batch", {"client_ids": client_ids, "n": 1})
+        data = response.json()
+        self.assertEqual(sum(len(ads) for ads in data.values()), 3)
+        self.assertEqual(Impression.objects.count(), 3)
+        for campaign in self.campaigns:
+            campaign.refresh_from_db()
+            self.assertEqual(campaign.impressions_count, 1)
+
+    def test_invalid_n(self, mock_day):
+        response = self.api_client.get(
+            "/ads/batch", {"client_id": self.clients[0].id, "n": 0}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch("client.candidates.get_current_day", return_value=5)
+@patch("client.views.get_current_day", return_value=5)
+class AdsCandidatesTests(QueryBudgetMixin, TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        segments.clear()
+        cache.delete_many([candidates.VERSION_KEY, candidates.READY_KEY])
+        self.addCleanup(cache.delete_many, [candidates.VERSION_KEY, candidates.READY_KEY])
+        self.clients = [
+            Client.objects.create(
+                id=uuid.uuid4(), login=f"cand{i}", age=age, location=location, gender=gender
+            )
+            for i, (age, location, gender) in enumerate(
+                [(25, "City", "MALE"), (40, "City", "FEMALE"), (25, "Town", "MALE")]
+            )
+        ]
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Candidates")
+        targetings = [
+            {},
+            {"targeted_gender": "MALE", "targeted_age_to": 30},
+            {"targeted_location": "Town"},
+            {"targeted_gender": "ALL", "targeted_age_from": 35},
+            {"start_date": 6},
+        ]
+        for i, targeting in enumerate(targetings):
+            Campaign.objects.create(
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0,
+                cost_per_click=5.0,
+                ad_title=f"Candidate Ad {i}",
+                ad_text="Content",
+                **{"start_date": 1, "end_date": 30, **targeting},
+            )
+        set_local_cache_cur_min_max_score()
+
+    def test_candidates_match_targeting(self, *mocks):
+        candidates.precompute(5, 0, workers=1, shards=4)
+
+        self.assertEqual(candidates.get_build(5)[:3], (5, 0, True))
+        for client in self.clients:
+            expected = set(
+                client.get_targeted_and_not_impressed_campaigns(5).values_list("id", flat=True)
+            )
+            precomputed = set(
+                Candidate.objects.filter(client=client).values_list(
+                    "campaign_id", flat=True
+                )
+            )
+            self.assertEqual(precomputed, expected)
+
+    def test_ads_are_served_from_build(self, *mocks):
+        candidates.precompute(5, 0, workers=1, shards=4)
+        client = self.clients[0]
+
+        served = []
+        for _ in range(2):
+            with self.assertQueryBudget(3):
+                response = self.api_client.get("/ads", {"client_id": client.id})
+            served.append(response.json()["ad_id"])
+        response = self.api_client.get("/ads", {"client_id": client.id})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(set(served)), 2)
+
+    @patch("client.candidates.queue.enqueue")
+    def test_campaign_change_invalidates_build(self, enqueue, *mocks):
+        candidates.precompute(5, 0, workers=1, shards=4)
+        campaign = Campaign.objects.first()
+
+        response = self.api_client.patch(
+            f"/advertisers/{self.advertiser.id}/campaigns/{campaign.id}",
+            {"ad_title": "Changed"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(candidates.get_build(5)[:3], (5, 1, False))
+        enqueue.assert_called_once_with(
+            "ads.precompute_candidates", 5, 1, idempotency_key="ads-candidates:5:1"
+        )
+        candidates.precompute(5, 1, workers=1, shards=4)
+        self.assertEqual(candidates.get_build(5)[:3], (5, 1, True))
+        self.assertFalse(Candidate.objects.filter(version=0).exists())
+
+    @patch("client.candidates.Candidate.materialize", return_value=0)
+    def test_outdated_build_is_skipped(self, materialize, *mocks):
+        cache.set(candidates.VERSION_KEY, 2)
+
+        self.assertEqual(candidates.precompute(5, 1, workers=1, shards=4), 0)
+        materialize.assert_not_called()
+
+        # A campaign changes while the build is inserting its shards.
+        materialize.side_effect = lambda *args: cache.set(candidates.VERSION_KEY, 3) or 1
+        self.assertEqual(candidates.precompute(5, 2, workers=1, shards=4), 0)
+        self.assertEqual(materialize.call_count, 1)
+        self.assertFalse(candidates.get_build(5).ready)
+
+    def test_upserted_client_is_rematched(self, *mocks):
+        candidates.precompute(5, 0, workers=1, shards=4)
+        client = self.clients[1]
+
+        response = self.api_client.post(
+            "/clients/bulk",
+            [{"client_id": str(client.id), "login": "cand1", "age": 25,
+              "location": "Town", "gender": "MALE"}],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        client.refresh_from_db()
+        self.assertEqual(
+            set(Candidate.objects.filter(client=client).values_list(
+                "campaign_id", flat=True
+            )),
+            set(client.get_targeted_and_not_impressed_campaigns(5).values_list(
+                "id", flat=True
+            )),
+        )
+
+    def test_client_upserted_during_build_is_rematched_into_it(self, *mocks):
+        candidates.precompute(5, 0, workers=1, shards=4)
+        # Build 5:1 has inserted every shard but is not published yet.
+        cache.set(candidates.VERSION_KEY, 1)
+        cache.set(candidates.BUILDING_KEY, [5, 1])
+        self.addCleanup(cache.delete, candidates.BUILDING_KEY)
+        Candidate.materialize(5, 1)
+        client = self.clients[1]
+
+        self.api_client.post(
+            "/clients/bulk",
+            [{"client_id": str(client.id), "login": "cand1", "age": 25,
+              "location": "Town", "gender": "MALE"}],
+            format="json",
+        )
+        client.refresh_from_db()
+
+        expected = set(
+            client.get_targeted_and_not_impressed_campaigns(5).values_list("id", flat=True)
+        )
+        for version in (0, 1):
+            self.assertEqual(
+                set(Candidate.objects.filter(client=client, version=version).values_list(
+                    "campaign_id", flat=True
+                )),
+                expected,
+            )
+        # Rematching a client whose shard is not inserted yet adds no duplicates.
+        self.assertEqual(Candidate.materialize(5, 1), 0)
+
+    def test_segment_is_shared_by_clients(self, *mocks):
+        first, other = self.clients[0], self.clients[2]
+        neighbour = Client.objects.create(
+            id=uuid.uuid4(), login="cand3", age=25, location="City", gender="MALE"
+        )
+        self.api_client.get("/ads", {"client_id": first.id})
+        self.api_client.get("/ads", {"client_id": other.id})
+        self.assertEqual(len(segments), 2)
+
+        with self.assertQueryBudget(3):
+            response = self.api_client.get("/ads", {"client_id": neighbour.id})
+
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = neighbour.get_targeted_campaigns(5).values_list("id", flat=True)
+        self.assertIn(uuid.UUID(response.json()["ad_id"]), set(expected))
+
+
+class SegmentCacheTests(SimpleTestCase):
+    def test_least_recently_used_segment_is_evicted(self):
+        segment_cache = SegmentCache(max_bytes=2 * (ENTRY_OVERHEAD + 16))
+        ids = [uuid.uuid4() for _ in range(3)]
+        segment_cache.set("a", ids[:1])
+        segment_cache.set("b", ids[1:2])
+        self.assertEqual(segment_cache.get("a"), ids[:1])
+
+        segment_cache.set("c", ids[2:])
+
+        self.assertIsNone(segment_cache.get("b"))
+        self.assertEqual(segment_cache.get("a"), ids[:1])
+        self.assertEqual(segment_cache.get("c"), ids[2:])
+        self.assertEqual(segment_cache.size, 2 * (ENTRY_OVERHEAD + 16))
+
+    def test_segment_over_budget_is_not_cached(self):
+        segment_cache = SegmentCache(max_bytes=ENTRY_OVERHEAD + 16)
+        segment_cache.set("a", [uuid.uuid4(), uuid.uuid4()])
+        segment_cache.set("b", [])
+
+        self.assertIsNone(segment_cache.get("a"))
+        self.assertEqual(segment_cache.get("b"), [])
+
+
 class StatisticsTests(TestCase):
     databases = "__all__"
 
@@ -420,3 +838,936 @@ class StatisticsTests(TestCase):
         response = self.api_client.get(daily_url)
         day5_stats = next(d for d in response.data if d["date"] == 5)
         self.assertEqual(day5_stats["impressions_count"], 3)
+
+    @patch("business.views.get_current_day", return_value=7)
+    def test_daily_stats_pagination(self, mock_day):
+        Impression.objects.create(
+            client_id=self.client_user.id,
+            cost=self.campaign.cost_per_impression,
+            advertiser_id=self.advertiser.id,
+            advertisement_id=self.campaign.id,
+            day=4,
+        )
+
+        daily_url = f"/stats/campaigns/{self.campaign.id}/daily"
+        response = self.api_client.get(daily_url, {"page": 2, "size": 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Total-Count"], "7")
+        self.assertEqual([d["date"] for d in response.data], [4, 5, 6])
+        self.assertEqual(response.data[0]["impressions_count"], 1)
+
+        response = self.api_client.get(daily_url, {"page": 3, "size": 3})
+        self.assertEqual([d["date"] for d in response.data], [7])
+
+
+class DayAdvanceTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        cache.delete_many(["current_day", EPOCH_KEY, CLOSED_DAY_KEY])
+        self.addCleanup(cache.delete_many, ["current_day", EPOCH_KEY, CLOSED_DAY_KEY])
+
+    @patch.object(queue, "enqueue")
+    @patch.object(JobQueue, "connection", new_callable=PropertyMock)
+    def test_advance_publishes_and_queues_follow_up_jobs(self, connection, enqueue):
+        set_day(2)
+        version = candidates.get_version()
+        response = self.api_client.post("/time/advance", {"current_date": 5}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_epoch(), 1)
+        connection.return_value.publish.assert_called_once_with(
+            "events:day-advanced", json.dumps({"previous": 2, "day": 5, "epoch": 1})
+        )
+        enqueue.assert_has_calls(
+            [
+                # Day 2 may still get events from requests in flight.
+                call("stats.close_days", 1, 1, idempotency_key="stats-close:1:1"),
+                call(
+                    "ads.precompute_candidates", 5, version,
+                    idempotency_key=f"ads-candidates:5:{version}",
+                ),
+            ],
+            any_order=True,
+        )
+
+        enqueue.reset_mock()
+        self.api_client.post("/time/advance", {"current_date": 5}, format="json")
+        self.assertEqual(get_epoch(), 1)
+        enqueue.assert_not_called()
+
+        set_closed_day(1)
+        self.api_client.post("/time/advance", {"current_date": 6}, format="json")
+        enqueue.assert_any_call(
+            "stats.close_days", 2, 4, idempotency_key="stats-close:2:4"
+        )
+
+
+@patch("business.views.get_current_day", return_value=3)
+class StatisticsRollupTests(QueryBudgetMixin, TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        cache.delete(CLOSED_DAY_KEY)
+        self.addCleanup(cache.delete, CLOSED_DAY_KEY)
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Rollup")
+        self.campaign = Campaign.objects.create(
+            advertiser=self.advertiser,
+            impressions_limit=100,
+            clicks_limit=10,
+            cost_per_impression=1.0,
+            cost_per_click=5.0,
+            ad_title="Rollup Ad",
+            ad_text="Content",
+            start_date=1,
+            end_date=30,
+        )
+        for day, clients in ((1, 2), (2, 3), (3, 1)):
+            for _ in range(clients):
+                client_id = uuid.uuid4()
+                Impression.objects.create(
+                    client_id=client_id, cost=1.0, advertiser_id=self.advertiser.id,
+                    advertisement_id=self.campaign.id, day=day,
+                )
+                if day == 2:
+                    Click.objects.create(
+                        client_id=client_id, cost=5.0, advertiser_id=self.advertiser.id,
+                        advertisement_id=self.campaign.id, day=day,
+                    )
+
+    def test_closed_days_are_read_from_rollup(self, mock_day):
+        paths = [
+            f"/stats/campaigns/{self.campaign.id}/daily",
+            f"/stats/advertisers/{self.advertiser.id}/campaigns/daily",
+            f"/stats/campaigns/{self.campaign.id}",
+        ]
+        before = [self.api_client.get(path).json() for path in paths]
+
+        close_days(1, 2)
+        # Events of closed days are no longer read from the event tables.
+        Impression.objects.filter(day__lte=2).delete()
+
+        self.assertEqual(get_closed_day(), 2)
+        self.assertEqual(DailyCampaignStats.objects.count(), 2)
+        with self.assertQueryBudget(2):
+            after = [self.api_client.get(path).json() for path in paths[:1]]
+        after += [self.api_client.get(path).json() for path in paths[1:]]
+        self.assertEqual(after, before)
+        self.assertEqual(before[0][1]["clicks_count"], 3)
+
+    def test_advertiser_statistics_break_down_campaigns(self, mock_day):
+        other = Campaign.objects.create(
+            advertiser=self.advertiser,
+            impressions_limit=100,
+            clicks_limit=10,
+            cost_per_impression=2.0,
+            cost_per_click=5.0,
+            ad_title="Other Ad",
+            ad_text="Content",
+            start_date=1,
+            end_date=30,
+        )
+        Impression.objects.create(
+            client_id=uuid.uuid4(), cost=2.0, advertiser_id=self.advertiser.id,
+            advertisement_id=other.id, day=3,
+        )
+        close_days(1, 2)
+
+        with self.assertQueryBudget(2):
+            response = self.api_client.get(
+                f"/stats/advertisers/{self.advertiser.id}/campaigns"
+            )
+
+        data = response.json()
+        self.assertEqual((data["impressions_count"], data["clicks_count"]), (7, 3))
+        self.assertEqual(data["spent_total"], 23.0)
+        breakdown = {
+            campaign["campaign_id"]: (campaign["impressions_count"], campaign["clicks_count"])
+            for campaign in data["campaigns"]
+        }
+        self.assertEqual(breakdown, {str(self.campaign.id): (6, 3), str(other.id): (1, 0)})
+
+    def test_closing_a_day_again_recounts_it(self, mock_day):
+        close_days(1, 2)
+        Impression.objects.filter(day=2).first().delete()
+        close_days(2, 2)
+
+        stats = DailyCampaignStats.objects.get(day=2)
+        self.assertEqual((stats.impressions_count, stats.clicks_count), (2, 3))
+
+
+@patch("business.views.get_current_day", return_value=3)
+@override_settings(STATS_EXPORT_CHUNK_SIZE=2)
+class StatisticsExportTests(TestCase):
+    def setUp(self):
+        self.api_client = APIClient()
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Export")
+        self.campaign = Campaign.objects.create(
+            advertiser=self.advertiser,
+            impressions_limit=100,
+            clicks_limit=10,
+            cost_per_impression=1.0,
+            cost_per_click=5.0,
+            ad_title="Export Ad",
+            ad_text="Content",
+            start_date=1,
+            end_date=30,
+        )
+        for day in (1, 2, 2, 3):
+            self.client_id = uuid.uuid4()
+            Impression.objects.create(
+                client_id=self.client_id, cost=1.0, advertiser_id=self.advertiser.id,
+                advertisement_id=self.campaign.id, day=day,
+            )
+        Click.objects.create(
+            client_id=self.client_id, cost=5.0, advertiser_id=self.advertiser.id,
+            advertisement_id=self.campaign.id, day=2,
+        )
+
+    def export(self, **params):
+        return self.api_client.get(
+            f"/stats/advertisers/{self.advertiser.id}/export", params
+        )
+
+    def test_csv_export_streams_events_of_day_range(self, mock_day):
+        response = self.export(format="csv", from_day=2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn("attachment;", response["Content-Disposition"])
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ["event", "day", "campaign_id", "client_id", "cost"])
+        self.assertEqual(
+            [(event, day) for event, day, *_ in rows[1:]],
+            [("impression", "2"), ("impression", "2"), ("impression", "3"), ("click", "2")],
+        )
+        self.assertEqual(
+            rows[-1], ["click", "2", str(self.campaign.id), str(self.client_id), "5.0"]
+        )
+
+    def test_parquet_export_writes_row_group_per_chunk(self, mock_day):
+        response = self.export(format="parquet")
+
+        self.assertEqual(response.status_code, 200)
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(response.streaming_content)))
+        # Two chunks of impressions and one of clicks.
+        self.assertEqual(parquet.num_row_groups, 3)
+        self.assertEqual(
+            parquet.read(columns=["event"]).column("event").to_pylist(),
+            ["impression"] * 4 + ["click"],
+        )
+
+    def test_invalid_export_parameters(self, mock_day):
+        self.assertEqual(self.export(format="xlsx").status_code, 400)
+        self.assertEqual(self.export(from_day="a").status_code, 400)
+        self.assertEqual(self.export(from_day=3, to_day=2).status_code, 400)
+        response = self.api_client.get(f"/stats/advertisers/{uuid.uuid4()}/export")
+        self.assertEqual(response.status_code, 404)
+
+
+class ReachTests(TestCase):
+    def setUp(self):
+        self.api_client = APIClient()
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Reach")
+        self.campaigns = [
+            Campaign.objects.create(
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0,
+                cost_per_click=5.0,
+                ad_title=f"Reach Ad {i}",
+                ad_text="Content",
+                start_date=1,
+                end_date=30,
+            )
+            for i in range(2)
+        ]
+
+    def cleanup(self):
+        keys = queue.connection.keys(f"reach:*:{self.advertiser.id}:*")
+        for campaign in self.campaigns:
+            keys += queue.connection.keys(f"reach:*:{campaign.id}:*")
+        if keys:
+            queue.connection.delete(*keys)
+
+    @patch("business.views.get_current_day", return_value=2)
+    def test_reach_counts_distinct_clients_across_days(self, mock_day):
+        # Needs Redis, like JobQueueTests.
+        self.addCleanup(self.cleanup)
+        first, second = self.campaigns
+        clients = [uuid.uuid4() for _ in range(3)]
+        record_reach([(clients[0], first), (clients[1], first), (clients[0], second)], 1)
+        record_reach([(clients[0], first), (clients[2], second)], 2)
+
+        campaign = self.api_client.get(f"/stats/campaigns/{first.id}").json()
+        self.assertEqual(campaign["reach"], 2)
+        daily = self.api_client.get(f"/stats/campaigns/{first.id}/daily").json()
+        self.assertEqual([day["reach"] for day in daily], [2, 1])
+
+        for campaign in self.campaigns:
+            Impression.objects.create(
+                client_id=uuid.uuid4(), cost=1.0, advertiser_id=self.advertiser.id,
+                advertisement_id=campaign.id, day=1,
+            )
+        advertiser = self.api_client.get(
+            f"/stats/advertisers/{self.advertiser.id}/campaigns"
+        ).json()
+        self.assertEqual(advertiser["reach"], 3)
+        self.assertEqual(
+            {campaign["campaign_id"]: campaign["reach"] for campaign in advertiser["campaigns"]},
+            {str(first.id): 2, str(second.id): 2},
+        )
+
+    @patch("business.views.get_current_day", return_value=1)
+    @patch.object(JobQueue, "connection", new_callable=PropertyMock)
+    def test_reach_is_null_when_redis_is_down(self, connection, mock_day):
+        connection.return_value.pipeline.return_value.execute.side_effect = RedisError
+        response = self.api_client.get(f"/stats/campaigns/{self.campaigns[0].id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["reach"])
+
+    @patch("business.views.get_current_day", return_value=1000)
+    @patch.object(JobQueue, "connection", new_callable=PropertyMock)
+    def test_total_reach_counts_all_days_sketch(self, connection, mock_day):
+        pipeline = connection.return_value.pipeline.return_value
+        pipeline.execute.return_value = [4, 3]
+        campaign = self.campaigns[0]
+        Impression.objects.create(
+            client_id=uuid.uuid4(), cost=1.0, advertiser_id=self.advertiser.id,
+            advertisement_id=campaign.id, day=1,
+        )
+
+        response = self.api_client.get(f"/stats/advertisers/{self.advertiser.id}/campaigns")
+
+        self.assertEqual(response.json()["reach"], 4)
+        self.assertEqual(response.json()["campaigns"][0]["reach"], 3)
+        pipeline.pfcount.assert_has_calls(
+            [
+                call(reach_key(ADVERTISER, self.advertiser.id, ALL_DAYS)),
+                call(reach_key(CAMPAIGN, campaign.id, ALL_DAYS)),
+            ]
+        )
+
+    @patch.object(JobQueue, "connection", new_callable=PropertyMock)
+    def test_rebuild_replaces_sketches_with_impressions(self, connection):
+        connection.return_value.scan_iter.side_effect = lambda match, count: [match]
+        pipeline = connection.return_value.pipeline.return_value
+        first, second = self.campaigns
+        clients = [uuid.uuid4() for _ in range(2)]
+        for client_id, campaign, day in (
+            (clients[0], first, 1), (clients[1], first, 2), (clients[0], second, 2),
+        ):
+            Impression.objects.create(
+                client_id=client_id, cost=1.0, advertiser_id=self.advertiser.id,
+                advertisement_id=campaign.id, day=day,
+            )
+
+        self.assertEqual(rebuild_reach(self.advertiser.id), 3)
+
+        connection.return_value.unlink.assert_has_calls(
+            [
+                call(reach_key(CAMPAIGN, first.id, "*")),
+                call(reach_key(CAMPAIGN, second.id, "*")),
+                call(reach_key(ADVERTISER, self.advertiser.id, "*")),
+            ],
+            any_order=True,
+        )
+        added = {}
+        for (key, *client_ids), _ in pipeline.pfadd.call_args_list:
+            added.setdefault(key, set()).update(client_ids)
+        self.assertEqual(
+            added[reach_key(ADVERTISER, self.advertiser.id, ALL_DAYS)],
+            {str(client_id) for client_id in clients},
+        )
+        self.assertEqual(added[reach_key(CAMPAIGN, first.id, 2)], {str(clients[1])})
+        self.assertEqual(added[reach_key(CAMPAIGN, second.id, ALL_DAYS)], {str(clients[0])})
+
+    @patch.object(queue, "enqueue")
+    @patch("business.views.delete_campaign_reach")
+    def test_deleting_campaign_rebuilds_advertiser_reach(self, delete_reach, enqueue):
+        campaign = self.campaigns[0]
+        response = self.api_client.delete(
+            f"/advertisers/{self.advertiser.id}/campaigns/{campaign.id}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        delete_reach.assert_called_once_with(campaign.id)
+        enqueue.assert_called_once_with("reach.rebuild", str(self.advertiser.id))
+
+    @patch("client.views.record_reach")
+    def test_reserved_impressions_are_added_to_reach(self, record):
+        client_id = uuid.uuid4()
+        chosen = reserve_impressions({client_id: self.campaigns}, 4, 2)
+        self.assertEqual(chosen[client_id], self.campaigns)
+        record.assert_called_once_with(
+            [(client_id, campaign) for campaign in self.campaigns], 4
+        )
+
+
+@patch("client.views.get_current_day", return_value=3)
+class ClickTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        self.client_user = Client.objects.create(
+            id=uuid.uuid4(), login="clicker", age=25, location="City", gender="MALE"
+        )
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Clicks")
+        self.campaign = Campaign.objects.create(
+            advertiser=self.advertiser,
+            impressions_limit=100,
+            clicks_limit=10,
+            cost_per_impression=1.0,
+            cost_per_click=5.0,
+            ad_title="Click Ad",
+            ad_text="Content",
+            start_date=1,
+            end_date=30,
+        )
+
+    def click(self, client_id=None, campaign_id=None):
+        return self.api_client.post(
+            f"/ads/{campaign_id or self.campaign.id}/click",
+            {"client_id": str(client_id or self.client_user.id)},
+        )
+
+    def test_repeated_clicks_are_recorded_once(self, mock_day):
+        Impression.objects.create(
+            client_id=self.client_user.id, cost=1.0, advertiser_id=self.advertiser.id,
+            advertisement_id=self.campaign.id, day=1,
+        )
+        get_campaign_snapshot(self.campaign.id)
+
+        with self.assertNumQueries(1):
+            response = self.click()
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.click().status_code, status.HTTP_204_NO_CONTENT)
+
+        click = Click.objects.get(client_id=self.client_user.id)
+        self.assertEqual((click.cost, click.day), (5.0, 3))
+        self.assertEqual(click.advertiser_id, self.advertiser.id)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.clicks_count, 1)
+
+    def test_click_is_rejected(self, mock_day):
+        cases = [
+            ({}, status.HTTP_403_FORBIDDEN),
+            ({"client_id": uuid.uuid4()}, status.HTTP_404_NOT_FOUND),
+            ({"client_id": "not-a-uuid"}, status.HTTP_404_NOT_FOUND),
+            ({"campaign_id": uuid.uuid4()}, status.HTTP_404_NOT_FOUND),
+        ]
+        for kwargs, expected in cases:
+            with self.subTest(**kwargs):
+                self.assertEqual(self.click(**kwargs).status_code, expected)
+        self.assertFalse(Click.objects.exists())
+
+
+@patch("client.views.get_current_day", return_value=3)
+class IdempotencyKeyTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        segments.clear()
+        self.client_user = Client.objects.create(
+            id=uuid.uuid4(), login="retrier", age=25, location="City", gender="MALE"
+        )
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Retries")
+        for i in range(2):
+            Campaign.objects.create(
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0,
+                cost_per_click=5.0,
+                ad_title=f"Retry Ad {i}",
+                ad_text="Content",
+                start_date=1,
+                end_date=30,
+            )
+        set_local_cache_cur_min_max_score()
+        self.key = uuid.uuid4().hex
+
+    def test_ads_retry_replays_the_reserved_ad(self, mock_day):
+        headers = {"Idempotency-Key": self.key}
+        first = self.api_client.get("/ads", {"client_id": self.client_user.id}, headers=headers)
+        with self.assertNumQueries(0):
+            retry = self.api_client.get(
+                "/ads", {"client_id": self.client_user.id}, headers=headers
+            )
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Impression.objects.count(), 1)
+
+    def test_click_retry_is_not_recorded_again(self, mock_day):
+        campaign = Campaign.objects.first()
+        Impression.objects.create(
+            client_id=self.client_user.id, cost=1.0, advertiser_id=self.advertiser.id,
+            advertisement_id=campaign.id, day=1,
+        )
+        path = f"/ads/{campaign.id}/click"
+        body = {"client_id": str(self.client_user.id)}
+        headers = {"Idempotency-Key": self.key}
+
+        self.api_client.post(path, body, format="json", headers=headers)
+        with self.assertNumQueries(0):
+            retry = self.api_client.post(path, body, format="json", headers=headers)
+        self.assertEqual(retry.status_code, status.HTTP_204_NO_CONTENT)
+
+        other = self.api_client.post(
+            path, {"client_id": str(uuid.uuid4())}, format="json", headers=headers
+        )
+        self.assertEqual(other.status_code, 422)
+
+    def test_concurrent_retry_is_rejected(self, mock_day):
+        def view(request):
+            retry = self.api_client.get(
+                "/ads", {"client_id": self.client_user.id}, headers=headers
+            )
+            self.assertEqual(retry.status_code, status.HTTP_409_CONFLICT)
+            return HttpResponse(status=204)
+
+        headers = {"Idempotency-Key": self.key}
+        request = RequestFactory().get(
+            "/ads", {"client_id": self.client_user.id}, headers=headers
+        )
+        self.assertEqual(idempotent(view)(request).status_code, 204)
+
+    @override_settings(IDEMPOTENCY_IN_PROGRESS_TTL=1, IDEMPOTENCY_KEY_TTL=600)
+    @patch("app.idempotency.cache")
+    def test_in_progress_key_expires_sooner_than_response(self, cache_mock, mock_day):
+        cache_mock.add.return_value = True
+        request = RequestFactory().get("/ads", headers={"Idempotency-Key": self.key})
+
+        idempotent(lambda request: HttpResponse(status=204))(request)
+
+        self.assertEqual(cache_mock.add.call_args.args[2], 1)
+        self.assertEqual(cache_mock.set.call_args.args[2], 600)
+
+
+class CampaignSnapshotTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Snapshot")
+        self.campaign = Campaign.objects.create(
+            advertiser=self.advertiser,
+            impressions_limit=100,
+            clicks_limit=10,
+            cost_per_impression=1.0,
+            cost_per_click=5.0,
+            ad_title="Snapshot Ad",
+            ad_text="Content",
+            start_date=1,
+            end_date=30,
+        )
+        self.addCleanup(
+            cache.delete_many,
+            [version_key(self.campaign.id)]
+            + [snapshot_key(self.campaign.id, version) for version in range(3)],
+        )
+
+    def test_click_does_not_query_campaign(self):
+        client = Client.objects.create(
+            id=uuid.uuid4(), login="snap", age=25, location="City", gender="MALE"
+        )
+        Impression.objects.create(
+            client_id=client.id, cost=1.0, advertiser_id=self.advertiser.id,
+            advertisement_id=self.campaign.id, day=1,
+        )
+        get_campaign_snapshot(self.campaign.id)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.api_client.post(
+                f"/ads/{self.campaign.id}/click", {"client_id": str(client.id)}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        campaign_reads = [
+            q["sql"]
+            for q in context.captured_queries
+            if re.search(r'FROM "?business_campaign"?\b', q["sql"])
+        ]
+        self.assertFalse(campaign_reads)
+        click = Click.objects.get(client_id=client.id)
+        self.assertEqual((click.cost, click.advertiser_id), (5.0, self.advertiser.id))
+
+    @patch.object(queue, "enqueue")
+    def test_update_and_delete_invalidate_snapshot(self, enqueue):
+        path = f"/advertisers/{self.advertiser.id}/campaigns/{self.campaign.id}"
+        self.assertEqual(get_campaign_snapshot(self.campaign.id).ad_title, "Snapshot Ad")
+
+        self.api_client.patch(path, {"ad_title": "Renamed"}, format="json")
+        with self.assertNumQueries(1):
+            self.assertEqual(get_campaign_snapshot(self.campaign.id).ad_title, "Renamed")
+        with self.assertNumQueries(0):
+            get_campaign_snapshot(self.campaign.id)
+
+        self.api_client.delete(path)
+        self.assertIsNone(get_campaign_snapshot(self.campaign.id))
+
+    def test_missing_snapshot_is_filled_once(self):
+        key = snapshot_key(self.campaign.id, 0)
+        cache.add(f"{key}:fill", 1)
+        self.addCleanup(cache.delete, f"{key}:fill")
+
+        def fill_by_other_process(seconds):
+            cache.set(key, ("filled", *[None] * 13))
+
+        with patch("business.snapshots.time.sleep", side_effect=fill_by_other_process):
+            with self.assertNumQueries(0):
+                snapshot = get_campaign_snapshot(self.campaign.id)
+        self.assertEqual(snapshot.id, "filled")
+
+
+class StressTestHelpersTests(SimpleTestCase):
+    def test_latency_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 100_001):
+            histogram.record(value)
+
+        self.assertEqual(histogram.total, 100_000)
+        self.assertEqual(histogram.max, 100_000)
+        self.assertAlmostEqual(histogram.percentile(50), 50_000, delta=500)
+        self.assertAlmostEqual(histogram.percentile(99), 99_000, delta=1_000)
+
+    def test_arrival_offsets(self):
+        constant = list(arrival_offsets("constant", 10, 2))
+        self.assertEqual(len(constant), 19)
+
+        poisson = list(arrival_offsets("poisson", 1000, 1, rng=random.Random(0)))
+        self.assertAlmostEqual(len(poisson), 1000, delta=100)
+
+        ramp = list(arrival_offsets("ramp", 100, 2, ramp_to=300))
+        self.assertAlmostEqual(len(ramp), 400, delta=20)
+
+
+@patch("app.middleware.initialized", True)
+class GenerateDataTests(TestCase):
+    # DEBUG wraps cursors in CursorDebugWrapper, which the command must work with.
+    @override_settings(DEBUG=True)
+    @patch("business.management.commands.generate_data.rebuild_reach")
+    def test_generates_small_dataset(self, rebuild):
+        call_command(
+            "generate_data",
+            advertisers=2,
+            campaigns=3,
+            clients=10,
+            impressions=30,
+            seed=1,
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(Advertiser.objects.count(), 2)
+        self.assertEqual(Campaign.objects.count(), 3)
+        self.assertEqual(Client.objects.count(), 10)
+        self.assertEqual(
+            Impression.objects.count(),
+            sum(Campaign.objects.values_list("impressions_count", flat=True)),
+        )
+        self.assertFalse(Campaign.objects.filter(created_at__isnull=True).exists())
+        rebuild.assert_called_once_with()
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    def test_metrics_endpoint(self):
+        self.client.get("/ping")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",route="ping"', response.content)
+
+
+class TracingMiddlewareTests(SimpleTestCase):
+    def handler(self, request):
+        with span("lookup"):
+            caches["local"].get("tracing-test-missing")
+        return HttpResponse("ok")
+
+    @override_settings(TRACING_SAMPLE_RATE=1.0)
+    def test_sampled_request_is_logged(self):
+        request = RequestFactory().get("/ads")
+        with self.assertLogs("app.tracing", level="INFO") as logs:
+            response = TracingMiddleware(self.handler)(request)
+
+        self.assertEqual(response.status_code, 200)
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual(trace["path"], "/ads")
+        self.assertEqual([s["name"] for s in trace["spans"]], ["lookup"])
+        self.assertEqual(trace["cache"][0]["op"], "get")
+        self.assertFalse(trace["cache"][0]["hit"])
+
+    @override_settings(TRACING_SAMPLE_RATE=0.0)
+    def test_unsampled_request_is_not_logged(self):
+        request = RequestFactory().get("/ads")
+        with self.assertNoLogs("app.tracing", level="INFO"):
+            TracingMiddleware(self.handler)(request)
+
+
+@patch("app.middleware.initialized", True)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.api_client = APIClient()
+        segments.clear()
+        self.client_user = Client.objects.create(
+            id=uuid.uuid4(), login="budget", age=25, location="City", gender="MALE"
+        )
+        self.advertiser = Advertiser.objects.create(id=uuid.uuid4(), name="Budget")
+        self.campaigns = [
+            Campaign.objects.create(
+                id=uuid.uuid4(),
+                advertiser=self.advertiser,
+                impressions_limit=100,
+                clicks_limit=10,
+                cost_per_impression=1.0,
+                cost_per_click=5.0,
+                ad_title=f"Budget Ad {i}",
+                ad_text="Content",
+                start_date=1,
+                end_date=30,
+            )
+            for i in range(5)
+        ]
+        Score.objects.create(client=self.client_user, advertiser=self.advertiser, score=50)
+        for day in range(1, 11):
+            Impression.objects.create(
+                client_id=uuid.uuid4(),
+                cost=1.0,
+                advertiser_id=self.advertiser.id,
+                advertisement_id=self.campaigns[0].id,
+                day=day,
+            )
+        set_local_cache_cur_min_max_score()
+
+    @patch("client.views.get_current_day", return_value=5)
+    def test_ads_query_budget(self, mock_day):
+        with self.assertQueryBudget(3):
+            response = self.api_client.get(f"/ads?client_id={self.client_user.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @patch("business.views.get_current_day", return_value=30)
+    def test_daily_statistics_query_budget(self, mock_day):
+        with self.assertQueryBudget(2):
+            response = self.api_client.get(f"/stats/campaigns/{self.campaigns[0].id}/daily")
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(response.data[9]["impressions_count"], 1)
+
+        with self.assertQueryBudget(2):
+            self.api_client.get(f"/stats/advertisers/{self.advertiser.id}/campaigns/daily")
+
+
+class QueryShapeTests(SimpleTestCase):
+    def test_literals_are_normalized(self):
+        first = query_shape(
+            "SELECT * FROM client_impression WHERE day = 1 AND client_id = "
+            "'6f1c0f4e-9a43-4c57-8a53-1b0e7b3ad0a2' AND id IN (1, 2, 3)"
+        )
+        second = query_shape(
+            "SELECT *  FROM client_impression WHERE day = 25 AND client_id = "
+            "'0b7c1d32-52f4-4d4e-9a77-3b8f0c1d2e3f' AND id IN (7)"
+        )
+        self.assertEqual(first, second)
+
+
+@task("tests.record")
+def record_job(value):
+    JobQueueTests.calls.append(value)
+
+
+@task("tests.fail", max_retries=1)
+def failing_job():
+    raise RuntimeError("boom")
+
+
+@override_settings(JOBS_RETRY_BASE_DELAY=0)
+class JobQueueTests(SimpleTestCase):
+    calls = []
+
+    def setUp(self):
+        self.queue = JobQueue("tests")
+        self.addCleanup(self.cleanup)
+        JobQueueTests.calls = []
+
+    def cleanup(self):
+        keys = self.queue.connection.keys("jobs:tests:*")
+        if keys:
+            self.queue.connection.delete(*keys)
+
+    def drain(self):
+        while raw := self.queue.reserve("worker", timeout=0.1):
+            self.queue.run("worker", raw)
+
+    def test_idempotency_key_skips_duplicates(self):
+        queued = self.queue.enqueue_many(
+            "tests.record", [((1,), {}), ((2,), {})], ["same", "same"]
+        )
+        self.drain()
+
+        self.assertEqual(queued, [True, False])
+        self.assertEqual(self.calls, [1])
+
+    def test_failed_job_is_retried_then_dead_lettered(self):
+        self.queue.enqueue("tests.fail")
+        with self.assertLogs("app.jobs", level="WARNING"):
+            for _ in range(3):
+                self.drain()
+
+        self.assertEqual(self.queue.connection.llen(self.queue.key("failed")), 1)
+        self.assertEqual(self.queue.connection.llen(self.queue.key("processing", "worker")), 0)
+
+
+class StubGrafanaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, payload, status_code=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        users = list(self.server.users.values())
+        self.reply({"totalCount": len(users), "users": users})
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/api/admin/users":
+            user_id = len(self.server.users) + 100
+            self.server.users[user_id] = {"id": user_id, "login": data["login"]}
+            self.reply({"id": user_id})
+        else:
+            self.reply({"message": "ok"})
+
+    def do_DELETE(self):
+        user_id = int(self.path.rsplit("/", 1)[1])
+        self.server.users.pop(user_id)
+        self.reply({"message": "deleted"})
+
+
+class GrafanaReconciliationTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGrafanaHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.kept = Advertiser(id=uuid.uuid4(), name="Kept")
+        self.new = Advertiser(id=uuid.uuid4(), name="New")
+        self.stale_login = str(uuid.uuid4())
+        self.server.users = {
+            1: {"id": 1, "login": "admin"},
+            2: {"id": 2, "login": str(self.kept.id)},
+            3: {"id": 3, "login": self.stale_login},
+        }
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        settings_override = override_settings(GRAFANA_API_URL=url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_reconcile_creates_and_deletes(self):
+        result = reconcile_grafana_users([self.kept, self.new], workers=2)
+
+        self.assertEqual(result["created"], [str(self.new.id)])
+        self.assertEqual(result["deleted"], [self.stale_login])
+        logins = {user["login"] for user in self.server.users.values()}
+        self.assertEqual(logins, {"admin", str(self.kept.id), str(self.new.id)})
+
+    def test_purge_keeps_non_advertiser_users(self):
+        result = reconcile_grafana_users([self.kept], purge=True)
+
+        self.assertEqual(result["created"], [])
+        self.assertEqual(len(result["deleted"]), 2)
+        self.assertEqual(list(self.server.users), [1])
+
+    @patch.object(queue, "enqueue", side_effect=RedisError("down"))
+    def test_purge_is_unavailable_without_redis(self, enqueue):
+        with self.assertLogs("business.views", level="ERROR"):
+            response = APIClient().post("/delete-grafana-users")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+LOCAL_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "ai-tests"},
+    "local": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "ai-tests-local"},
+}
+STUB_GENERATION = {
+    "BACKEND": "business.ai.StubBackend",
+    "MODEL": "stub",
+    "TEMPERATURE": 0,
+    "CACHE_TIMEOUT": 60,
+    "JOB_TIMEOUT": 60,
+    "OPTIONS": {"delay": 0.2},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES, AD_TEXT_GENERATION=STUB_GENERATION)
+class AdTextGenerationTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+        StubBackend.calls = 0
+
+    def test_identical_prompts_are_cached(self):
+        first = generate_advertising_text("Кофе", "студенты")
+        second = generate_advertising_text("Кофе", "студенты")
+        generate_advertising_text("Кофе", "пенсионеры")
+
+        self.assertEqual(first, second)
+        self.assertEqual(StubBackend.calls, 2)
+
+    def test_concurrent_identical_prompts_are_coalesced(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(generate_advertising_text("Чай")))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(StubBackend.calls, 1)
+
+
+class CampaignImageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name, base_url="/media/")
+
+    def upload(self, size=(2000, 1000), mode="RGBA", image_format="PNG"):
+        buffer = io.BytesIO()
+        Image.new(mode, size, (200, 10, 10, 128)[: len(mode)]).save(buffer, image_format)
+        return SimpleUploadedFile("image.png", buffer.getvalue())
+
+    def test_variants_are_stored_by_content_hash(self):
+        name = store_campaign_image(self.upload(), storage=self.storage)
+        again = store_campaign_image(self.upload(), storage=self.storage)
+
+        self.assertEqual(name, again)
+        self.assertRegex(name, r"^campaigns/[0-9a-f]{32}_large\.jpg$")
+        variants = image_variant_urls(name, storage=self.storage)
+        self.assertEqual(set(variants), {"large", "medium", "thumb"})
+        with self.storage.open(name.replace("large.jpg", "thumb.webp")) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+        with self.storage.open(name) as f:
+            self.assertEqual(Image.open(f).size, (1280, 640))
+
+    @override_settings(CAMPAIGN_IMAGE_MAX_PIXELS=1000)
+    def test_oversized_image_is_rejected(self):
+        with self.assertRaises(CustomAPIException) as error:
+            store_campaign_image(self.upload(), storage=self.storage)
+        self.assertEqual(error.exception.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,16 +1,20 @@
 from django.urls import path
 from business.views import (
+    AdvertiserBatchView,
     BulkCreateAdvertisersView,
+    CampaignBatchView,
     GetAdvertiserView,
     CreateScoreView,
     CreateCampaignView,
     RetrieveUpdateDestroyCampaignView,
     AdvertiserStatisticsView,
+    AdvertiserStatisticsExportView,
     CampaignStatisticsView,
     AdvertiserDailyStatisticsView,
     CampaignDailyStatisticsView,
     update_add_campaign_image_view,
     GenerateAdTextView,
+    GenerateAdTextJobView,
     get_score,
     delete_grafana_users,
     register_advertiser_to_grafana,
@@ -18,6 +22,8 @@ from business.views import (
 
 urlpatterns = [
     path("advertisers/bulk", BulkCreateAdvertisersView.as_view()),
+    path("advertisers/batch", AdvertiserBatchView.as_view()),
+    path("campaigns/batch", CampaignBatchView.as_view()),
     path("advertisers/<uuid:id>", GetAdvertiserView.as_view()),
     path("ml-scores", CreateScoreView.as_view()),
     path("advertisers/<uuid:advertiser_id>/campaigns", CreateCampaignView.as_view()),
@@ -42,10 +48,18 @@ urlpatterns = [
         "stats/advertisers/<uuid:advertiser_id>/campaigns/daily",
         AdvertiserDailyStatisticsView.as_view(),
     ),
+    path(
+        "stats/advertisers/<uuid:advertiser_id>/export",
+        AdvertiserStatisticsExportView.as_view(),
+    ),
     path(
         "generate-text",
         GenerateAdTextView.as_view(),
     ),
+    path(
+        "generate-text/<str:job_id>",
+        GenerateAdTextJobView.as_view(),
+    ),
     path(
         "score",
         get_score,
@@ -1,6 +1,11 @@
-from django.core.cache import caches
+from django.core.cache import cache, caches
 
-from business.models import Score
+from business.models import Campaign, Score
+
+# The counter is rebuilt from the database when it expires, which also
+# corrects drift from campaigns changed outside the API.
+CAMPAIGN_COUNT_TIMEOUT = 10 * 60
+CLOSED_DAY_KEY = "stats:closed-day"
 
 
 def set_local_cache_cur_min_max_score():
@@ -10,3 +15,35 @@ def set_local_cache_cur_min_max_score():
 
     local_cache.set("score_ml_min", ml_min or 0, None)
     local_cache.set("score_ml_max", ml_max or 0, None)
+
+
+def campaign_count_cache_key(advertiser_id):
+    return f"campaign-count:{advertiser_id}"
+
+
+def get_campaign_count(advertiser_id):
+    """Approximate number of the advertiser's campaigns from a counter cache."""
+    key = campaign_count_cache_key(advertiser_id)
+    count = cache.get(key)
+    if count is None:
+        count = Campaign.objects.filter(advertiser_id=advertiser_id).count()
+        cache.add(key, count, CAMPAIGN_COUNT_TIMEOUT)
+    return count
+
+
+def adjust_campaign_count(advertiser_id, delta):
+    try:
+        cache.incr(campaign_count_cache_key(advertiser_id), delta)
+    except ValueError:
+        # Not cached, the next read counts from the database.
+        pass
+
+
+def get_closed_day():
+    """Last day whose statistics were rolled up into DailyCampaignStats."""
+    return cache.get(CLOSED_DAY_KEY, 0)
+
+
+def set_closed_day(day):
+    if day > get_closed_day():
+        cache.set(CLOSED_DAY_KEY, day, None)
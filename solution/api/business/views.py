@@ -1,7 +1,10 @@
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import uuid
 
-from django.db.models import Sum, Min, Max
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import conditional_page
+from django.db.models import Count, Sum, Min, Max, Value
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.generics import (
@@ -13,25 +16,48 @@ from rest_framework.generics import (
 )
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from redis import RedisError
 
 from app.exceptions import CustomAPIException
-from app.paginations import PurePageNumberPagination
+from app.jobs import queue
+from app.paginations import KeysetPagination, OptionalPageNumberPagination
 from app.utils import get_current_day
-from business.ai import generate_advertising_text
+from business.ai import (
+    generate_advertising_text,
+    get_advertising_text_job,
+    submit_advertising_text,
+)
+from business.exports import export_events
 from business.algorithm import compute_ad_score, get_max_P
-from business.models import Advertiser, Score, Campaign
+from business.images import check_upload_size, image_variant_urls, store_campaign_image
+from business.models import Advertiser, Score, Campaign, DailyCampaignStats
+from business.reach import (
+    ADVERTISER,
+    ALL_DAYS,
+    CAMPAIGN,
+    count_reach,
+    delete_campaign_reach,
+    reach_keys,
+)
+from business.snapshots import bump_campaign_version, get_campaign_snapshot
 from business.serializers import (
     AdvertiserSerializer,
     CreateScoreBodySerializer,
     CampaignSerializer,
     CreateCampaignSerializer,
     StatisticsSerializer,
+    DailyStatisticsSerializer,
 )
 from business.grafana import (
     process_grafana_user,
-    delete_advertiser_from_grafana,
 )
-from business.utils import set_local_cache_cur_min_max_score
+from business.utils import (
+    adjust_campaign_count,
+    get_campaign_count,
+    get_closed_day,
+    set_local_cache_cur_min_max_score,
+)
+from client import candidates
 from client.models import Client, Impression, Click
 
 from django.db import transaction
@@ -67,9 +93,15 @@ class BulkCreateAdvertisersView(APIView):
                 update_fields=["name"],
             )
 
-        logger.info("Starting advertisers grafana accounts creation")
-        executor = ThreadPoolExecutor(max_workers=10)
-        executor.map(process_grafana_user, advertisers)
+        try:
+            queued = queue.enqueue_many(
+                "grafana.provision_user",
+                [((str(advertiser.id),), {}) for advertiser in advertisers],
+                [f"grafana-user:{advertiser.id}" for advertiser in advertisers],
+            )
+            logger.info(f"Queued {sum(queued)} advertisers grafana accounts creation")
+        except RedisError as e:
+            logger.error(f"Failed to queue advertisers grafana accounts creation: {e}")
 
         return Response(
             AdvertiserSerializer(advertisers, many=True).data,
@@ -83,6 +115,52 @@ class GetAdvertiserView(RetrieveAPIView):
     lookup_field = "id"
 
 
+@method_decorator(conditional_page, name="dispatch")
+class BatchRetrieveView(ListAPIView):
+    """
+    Objects by ``?ids=<uuid>,<uuid>`` in one query, in the requested order.
+    Unknown ids are skipped. Responses carry an ETag and a matching
+    If-None-Match is answered with 304.
+    """
+
+    max_ids = 100
+    pagination_class = None
+
+    def get_ids(self):
+        raw_ids = self.request.query_params.get("ids", "")
+        try:
+            ids = [uuid.UUID(value) for value in raw_ids.split(",") if value]
+        except ValueError:
+            raise CustomAPIException(
+                detail="Неверный идентификатор.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > self.max_ids:
+            raise CustomAPIException(
+                detail=f"Можно запросить не больше {self.max_ids} объектов.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        return list(dict.fromkeys(ids))
+
+    def list(self, request, *args, **kwargs):
+        ids = self.get_ids()
+        objects = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [objects[pk] for pk in ids if pk in objects], many=True
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AdvertiserBatchView(BatchRetrieveView):
+    serializer_class = AdvertiserSerializer
+    queryset = Advertiser.objects.all()
+
+
+class CampaignBatchView(BatchRetrieveView):
+    serializer_class = CampaignSerializer
+    queryset = Campaign.objects.all()
+
+
 class CreateScoreView(APIView):
     def post(self, request, *args, **kwargs):
         scores_data = request.data
@@ -119,7 +197,15 @@ class CreateScoreView(APIView):
 
 class CreateCampaignView(ListAPIView, CreateAPIView):
     serializer_class = CampaignSerializer
-    pagination_class = PurePageNumberPagination
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get("count"):
+            response["X-Total-Count"] = str(
+                get_campaign_count(self.kwargs.get("advertiser_id"))
+            )
+        return response
 
     def create(self, request, *args, **kwargs):
         advertiser_id = kwargs.get("advertiser_id")
@@ -133,6 +219,8 @@ class CreateCampaignView(ListAPIView, CreateAPIView):
         serializer = CreateCampaignSerializer(data=serializer_data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        adjust_campaign_count(advertiser_id, 1)
+        candidates.invalidate()
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -160,36 +248,124 @@ class RetrieveUpdateDestroyCampaignView(RetrieveUpdateDestroyAPIView):
 
         return campaign
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        bump_campaign_version(serializer.instance.id)
+        candidates.invalidate()
+
+    def perform_destroy(self, instance):
+        # Deleting clears the instance's pk.
+        campaign_id = instance.id
+        super().perform_destroy(instance)
+        bump_campaign_version(campaign_id)
+        adjust_campaign_count(instance.advertiser_id, -1)
+        # The advertiser's sketches still hold the clients of the deleted campaign.
+        delete_campaign_reach(campaign_id)
+        try:
+            queue.enqueue("reach.rebuild", str(instance.advertiser_id))
+        except RedisError as e:
+            logger.error(
+                f"Failed to queue reach rebuild of advertiser {instance.advertiser_id}: {e}"
+            )
+
 
 class StatisticsView(GenericAPIView):
-    def get_impressions(self, day=None):
-        return Impression.objects.all()
+    # Filter field whose HyperLogLog sketches give the reach, see business/reach.py.
+    reach_field = None
+
+    def get_filters(self):
+        return {}
+
+    def get_reach(self, filters, day_groups):
+        """Unique clients of every ``{group: days}`` entry, over the union of its days."""
+        owner_id = filters[self.reach_field]
+        return count_reach(
+            {
+                group: reach_keys(self.reach_field, owner_id, days)
+                for group, days in day_groups.items()
+            }
+        )
+
+    def get_totals(self, filters, group_by="day"):
+        """
+        Impression and click counts and spend per day (or per campaign with
+        ``group_by="advertisement_id"``), fetched with a single grouped query.
+        Closed days are read from the DailyCampaignStats rollup, later days
+        from the event tables.
+        """
+        closed_day = get_closed_day()
+        impressions = (
+            Impression.objects.filter(**filters).filter(day__gt=closed_day)
+            .values(group_by)
+            .annotate(kind=Value("impressions"), count=Count("id"), spent=Sum("cost"))
+        )
+        clicks = (
+            Click.objects.filter(**filters).filter(day__gt=closed_day)
+            .values(group_by)
+            .annotate(kind=Value("clicks"), count=Count("id"), spent=Sum("cost"))
+        )
+        rows = impressions.union(clicks, all=True)
+        if closed_day:
+            rollup = DailyCampaignStats.objects.filter(**filters).filter(
+                day__lte=closed_day
+            )
+            rows = rows.union(
+                rollup.values(group_by).annotate(
+                    kind=Value("impressions"),
+                    count=Sum("impressions_count"),
+                    spent=Sum("spent_impressions"),
+                ),
+                rollup.values(group_by).annotate(
+                    kind=Value("clicks"),
+                    count=Sum("clicks_count"),
+                    spent=Sum("spent_clicks"),
+                ),
+                all=True,
+            )
 
-    def get_clicks(self, day=None):
-        return Click.objects.all()
+        totals = {}
+        for row in rows:
+            group_totals = totals.setdefault(
+                row[group_by], {"impressions": (0, 0), "clicks": (0, 0)}
+            )
+            # The same campaign may come from both the rollup and the events.
+            count, spent = group_totals[row["kind"]]
+            group_totals[row["kind"]] = (count + row["count"], spent + (row["spent"] or 0))
+        return totals
+
+    def sum_totals(self, totals):
+        return {
+            kind: (
+                sum(group[kind][0] for group in totals),
+                sum(group[kind][1] for group in totals),
+            )
+            for kind in ("impressions", "clicks")
+        }
 
-    def get_statistics_values(self, impressions, clicks):
-        impressions_count = impressions.count()
-        clicks_count = clicks.count()
+    def get_statistics_values(self, totals, reach=None):
+        impressions_count, spent_impressions = totals["impressions"]
+        clicks_count, spent_clicks = totals["clicks"]
         conversion = round(
             ((clicks_count / impressions_count * 100) if impressions_count > 0 else 0),
             2,
         )
-        spent_impressions = impressions.aggregate(total=Sum("cost"))["total"] or 0
-        spent_clicks = clicks.aggregate(total=Sum("cost"))["total"] or 0  # FIX
         spent_total = spent_impressions + spent_clicks
 
         return {
             "impressions_count": impressions_count,
             "clicks_count": clicks_count,
-            "conversion": conversion,
-            "spent_impressions": spent_impressions,
-            "spent_clicks": spent_clicks,
-            "spent_total": spent_total,
+            "conversion": float(conversion),
+            "spent_impressions": float(spent_impressions),
+            "spent_clicks": float(spent_clicks),
+            "spent_total": float(spent_total),
+            "reach": reach,
         }
 
     def get_statistics(self):
-        return self.get_statistics_values(self.get_impressions(), self.get_clicks())
+        filters = self.get_filters()
+        daily_totals = self.get_totals(filters).values()
+        reach = self.get_reach(filters, {None: [ALL_DAYS]})[None]
+        return self.get_statistics_values(self.sum_totals(daily_totals), reach)
 
     def get(self, request, *args, **kwargs):
         statistics_data = self.get_statistics()
@@ -199,26 +375,40 @@ class StatisticsView(GenericAPIView):
 
 
 class DailyStatisticsView(StatisticsView):
-    def get_statistics(self):
-        current_day = get_current_day()
-
-        daily_stats = []
-        for day in range(1, current_day + 1):  # TODO: Ticket 8373
-            impressions = self.get_impressions(day)
-            clicks = self.get_clicks(day)
-            daily_stats.append(self.get_statistics_values(impressions, clicks))
-
-        return daily_stats
+    pagination_class = OptionalPageNumberPagination
+
+    def get_statistics(self, days):
+        if not days:
+            return []
+        filters = {**self.get_filters(), "day__gte": days[0], "day__lte": days[-1]}
+        daily_totals = self.get_totals(filters)
+        daily_reach = self.get_reach(filters, {day: [day] for day in days})
+
+        empty = {"impressions": (0, 0), "clicks": (0, 0)}
+        return [
+            {
+                "date": day,
+                **self.get_statistics_values(
+                    daily_totals.get(day, empty), daily_reach[day]
+                ),
+            }
+            for day in days
+        ]
 
     def get(self, request, *args, **kwargs):
-        statistics_data = self.get_statistics()
-        return Response(
-            StatisticsSerializer(statistics_data, many=True).data,
-            status=status.HTTP_200_OK,
-        )
+        days = range(1, get_current_day() + 1)
+        # With ?page=&size= only the days of the requested page are queried.
+        page = self.paginate_queryset(days)
+        statistics_data = self.get_statistics(days if page is None else page)
+        data = DailyStatisticsSerializer(statistics_data, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class AdvertiserStatisticsView(StatisticsView):
+    reach_field = ADVERTISER
+
     def get_advertiser(self):
         advertiser_id = self.kwargs.get("advertiser_id")
         if not (advertiser := Advertiser.objects.filter(pk=advertiser_id).first()):
@@ -228,20 +418,87 @@ class AdvertiserStatisticsView(StatisticsView):
             )
         return advertiser
 
-    def get_impressions(self, day=None):
-        advertiser = self.get_advertiser()
-        if day is None:
-            return Impression.objects.filter(advertiser_id=advertiser.id)
-        return Impression.objects.filter(advertiser_id=advertiser.id, day=day)
+    def get_filters(self):
+        return {"advertiser_id": self.get_advertiser().id}
+
+    def get(self, request, *args, **kwargs):
+        """
+        Totals of the advertiser with a breakdown per campaign that has
+        impressions, both from one query grouped by campaign. The reach of
+        the advertiser and of its campaigns is counted with one Redis round
+        trip.
+        """
+        filters = self.get_filters()
+        campaign_totals = self.get_totals(filters, "advertisement_id")
+        reach = count_reach(
+            {
+                None: reach_keys(ADVERTISER, filters[ADVERTISER], [ALL_DAYS]),
+                **{
+                    campaign_id: reach_keys(CAMPAIGN, campaign_id, [ALL_DAYS])
+                    for campaign_id in campaign_totals
+                },
+            }
+        )
+        return Response(
+            {
+                **self.get_statistics_values(
+                    self.sum_totals(campaign_totals.values()), reach[None]
+                ),
+                "campaigns": [
+                    {
+                        "campaign_id": campaign_id,
+                        **self.get_statistics_values(totals, reach[campaign_id]),
+                    }
+                    for campaign_id, totals in campaign_totals.items()
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class AdvertiserStatisticsExportView(AdvertiserStatisticsView):
+    def perform_content_negotiation(self, request, force=False):
+        # ``?format=`` names the export format, not a DRF renderer.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get_day(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise CustomAPIException(
+                detail=f"{name} должен быть целым числом.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
 
-    def get_clicks(self, day=None):
+    def get(self, request, *args, **kwargs):
+        """
+        Impressions and clicks of the advertiser for ``?from_day=&to_day=``
+        streamed as ``?format=csv`` (default) or ``parquet``.
+        """
         advertiser = self.get_advertiser()
-        if day is None:
-            return Click.objects.filter(advertiser_id=advertiser.id)
-        return Click.objects.filter(advertiser_id=advertiser.id, day=day)
+        from_day = self.get_day("from_day", 1)
+        to_day = self.get_day("to_day", get_current_day())
+        if from_day > to_day:
+            raise CustomAPIException(
+                detail="from_day не может быть больше to_day.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        stream, content_type, extension = export_events(
+            advertiser.id, from_day, to_day, request.query_params.get("format", "csv")
+        )
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="{advertiser.id}_{from_day}-{to_day}.{extension}"'
+        )
+        return response
 
 
 class CampaignStatisticsView(StatisticsView):
+    reach_field = CAMPAIGN
+
     def get_campaign(self):
         campaign_id = self.kwargs.get("campaign_id")
         if not (campaign := Campaign.objects.filter(pk=campaign_id).first()):
@@ -251,17 +508,8 @@ class CampaignStatisticsView(StatisticsView):
             )
         return campaign
 
-    def get_impressions(self, day=None):
-        campaign = self.get_campaign()
-        if day is None:
-            return Impression.objects.filter(advertisement_id=campaign.id)
-        return Impression.objects.filter(advertisement_id=campaign.id, day=day)
-
-    def get_clicks(self, day=None):
-        campaign = self.get_campaign()
-        if day is None:
-            return Click.objects.filter(advertisement_id=campaign.id)
-        return Click.objects.filter(advertisement_id=campaign.id, day=day)
+    def get_filters(self):
+        return {"advertisement_id": self.get_campaign().id}
 
 
 class AdvertiserDailyStatisticsView(DailyStatisticsView, AdvertiserStatisticsView):
@@ -274,6 +522,7 @@ class CampaignDailyStatisticsView(DailyStatisticsView, CampaignStatisticsView):
 
 @api_view(["POST", "PUT"])
 def update_add_campaign_image_view(request, *args, **kwargs):
+    check_upload_size(request)
     advertiser_id = kwargs.get("advertiser_id")
     if not Advertiser.objects.filter(pk=advertiser_id).exists():
         raise CustomAPIException(
@@ -292,8 +541,15 @@ def update_add_campaign_image_view(request, *args, **kwargs):
             detail="image обязателен.",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    campaign.image.save(image.name, image)
-    return Response({"image": campaign.image.url}, status=status.HTTP_200_OK)
+    campaign.image.name = store_campaign_image(image)
+    campaign.save(update_fields=["image"])
+    return Response(
+        {
+            "image": campaign.image.url,
+            "variants": image_variant_urls(campaign.image.name),
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 class GenerateAdTextView(APIView):
@@ -305,14 +561,38 @@ class GenerateAdTextView(APIView):
                 status_code=status.HTTP_400_BAD_REQUEST,
             )
 
+        if request.query_params.get("async") in ("1", "true"):
+            job_id, generated_text = submit_advertising_text(title, targeting)
+            if generated_text is None:
+                return Response({"job_id": job_id}, status=status.HTTP_202_ACCEPTED)
+            return Response(
+                {"job_id": job_id, "text": generated_text}, status=status.HTTP_200_OK
+            )
+
         generated_text = generate_advertising_text(title, targeting)
         return Response({"text": generated_text}, status=status.HTTP_200_OK)
 
 
+class GenerateAdTextJobView(APIView):
+    def get(self, request, *args, **kwargs):
+        job_id = kwargs.get("job_id")
+        pending, generated_text = get_advertising_text_job(job_id)
+        if generated_text is not None:
+            return Response(
+                {"job_id": job_id, "text": generated_text}, status=status.HTTP_200_OK
+            )
+        if not pending:
+            raise CustomAPIException(
+                detail="Задача не найдена.",
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"job_id": job_id}, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(["GET"])
 def get_score(request, *args, **kwargs):
     campaign_id = request.query_params.get("campaign_id")
-    if not (campaign := Campaign.objects.filter(pk=campaign_id).first()):
+    if not (campaign := get_campaign_snapshot(campaign_id)):
         raise CustomAPIException(
             detail="Кампания не найден.",
             status_code=status.HTTP_404_NOT_FOUND,
@@ -331,11 +611,11 @@ def get_score(request, *args, **kwargs):
     set_local_cache_cur_min_max_score()
     ml_min, ml_max = Score.get_min_and_max()
     ml_score_inctance = Score.objects.filter(
-        client=client, advertiser=campaign.advertiser
+        client=client, advertiser_id=campaign.advertiser_id
     ).first()
     ml_score = ml_score_inctance.score if ml_score_inctance else 0
 
-    campaigns = client.get_targered_and_not_impressed_campaigns()
+    campaigns = client.get_targeted_and_not_impressed_campaigns(get_current_day())
     max_P = get_max_P(client, campaigns)
 
     score = compute_ad_score(
@@ -354,11 +634,15 @@ def get_score(request, *args, **kwargs):
 
 @api_view(["POST"])
 def delete_grafana_users(request, *args, **kwargs):
-    advertisers = Advertiser.objects.all()
-    for advertiser in advertisers:
-        delete_advertiser_from_grafana(advertiser)
-
-    return Response({"status": "ok"}, status=status.HTTP_200_OK)
+    try:
+        queue.enqueue("grafana.reconcile_users", purge=True)
+    except RedisError as e:
+        logger.error(f"Failed to queue grafana users purge: {e}")
+        raise CustomAPIException(
+            detail="Не удалось поставить задачу в очередь.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return Response({"status": "queued"}, status=status.HTTP_202_ACCEPTED)
 
 
 @api_view(["POST"])
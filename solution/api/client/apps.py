@@ -7,6 +7,7 @@ class ClientConfig(AppConfig):
 
     def ready(self):
         from business.models import Score
+        from . import signals  # noqa: F401
 
         # local_cache = caches['local']
         # score_agg = Score.objects.aggregate(ml_max=Max("score"), ml_min=Min("score"))
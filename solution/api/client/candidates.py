@@ -0,0 +1,166 @@
+"""
+Precomputed ad candidates.
+
+Targeting depends only on the client, the campaign and the current day, so
+the matching is done once per day by the ``ads.precompute_candidates`` job
+instead of on every GET /ads. A build is identified by ``(day, version)``:
+advancing the day or changing a campaign starts a new build, and requests
+fall back to matching targeting themselves until it is ready.
+"""
+import logging
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from redis import RedisError
+
+from app.events import EPOCH_KEY
+from app.jobs import queue
+from app.utils import get_current_day
+from .models import Candidate
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "ads-candidates:version"
+READY_KEY = "ads-candidates:ready"
+BUILDING_KEY = "ads-candidates:building"
+
+
+def get_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+class Build(NamedTuple):
+    day: int
+    version: int
+    ready: bool
+    epoch: int
+
+
+def get_build(current_day):
+    """
+    Returns the build that serves ``current_day``. Its version and the day
+    epoch also key the segment cache, so campaign changes and day advances
+    reach every server process.
+    """
+    values = cache.get_many([VERSION_KEY, READY_KEY, EPOCH_KEY])
+    version = values.get(VERSION_KEY, 0)
+    ready = values.get(READY_KEY)
+    return Build(
+        current_day,
+        version,
+        ready is not None and tuple(ready) == (current_day, version),
+        values.get(EPOCH_KEY, 0),
+    )
+
+
+def schedule_rebuild(day=None):
+    day = get_current_day() if day is None else day
+    version = get_version()
+    try:
+        queue.enqueue(
+            "ads.precompute_candidates",
+            day,
+            version,
+            idempotency_key=f"ads-candidates:{day}:{version}",
+        )
+    except RedisError as e:
+        logger.error(f"Failed to queue ad candidates precomputation: {e}")
+
+
+def invalidate():
+    """Makes the current build stale after campaigns change and queues a new one."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+    schedule_rebuild()
+
+
+def refresh_clients(client_ids):
+    """
+    Rematches the candidates of upserted clients in the ready build and in
+    the build in progress, whose shard of these clients may already be
+    inserted.
+    """
+    values = cache.get_many([READY_KEY, BUILDING_KEY])
+    builds = {tuple(build) for build in values.values() if build is not None}
+    for day, version in builds:
+        Candidate.objects.filter(
+            client_id__in=client_ids, day=day, version=version
+        ).delete()
+        Candidate.materialize(day, version, client_ids=client_ids)
+
+
+def shard_bounds(shards):
+    """Splits the uuid space into ``shards`` ``[lower, upper)`` ranges."""
+    step = 2**128 // shards
+    bounds = [uuid.UUID(int=step * i) for i in range(1, shards)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def is_current(day, version):
+    return (day, version) == (get_current_day(), get_version())
+
+
+def insert_shard(day, version, lower, upper):
+    # Campaign changes in a row queue a build each, only the last one is kept.
+    if not is_current(day, version):
+        return 0
+    return Candidate.materialize(day, version, lower, upper)
+
+
+def build_shard(day, version, lower, upper):
+    close_old_connections()
+    try:
+        return insert_shard(day, version, lower, upper)
+    finally:
+        connections.close_all()
+
+
+def precompute(day, version, workers=None, shards=None):
+    """
+    Materializes the candidates of every client for ``(day, version)``. Client
+    shards are inserted by a pool of processes, each with its own database
+    connection, then the build is published and older builds are removed.
+    """
+    options = settings.ADS_CANDIDATES
+    workers = workers or options["WORKERS"]
+    shards = shards or options["SHARDS"]
+    if not is_current(day, version):
+        logger.info(f"Ad candidates build {day}:{version} is outdated, skipped")
+        return 0
+
+    # Rows of an interrupted attempt of the same build.
+    Candidate.objects.filter(day=day, version=version).delete()
+    # Upserted clients are rematched into this build from now on.
+    cache.set(BUILDING_KEY, [day, version], None)
+    tasks = [(day, version, lower, upper) for lower, upper in shard_bounds(shards)]
+    if workers > 1:
+        # Forked children must not share the parent's connections.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            rows = sum(pool.map(build_shard, *zip(*tasks)))
+    else:
+        rows = sum(insert_shard(*task) for task in tasks)
+
+    published = is_current(day, version)
+    if published:
+        cache.set(READY_KEY, [day, version], None)
+    if cache.get(BUILDING_KEY) == [day, version]:
+        cache.delete(BUILDING_KEY)
+    if not published:
+        logger.info(f"Ad candidates build {day}:{version} is outdated, not published")
+        Candidate.objects.filter(day=day, version=version).delete()
+        return 0
+    Candidate.objects.filter(
+        Q(day__lt=day) | Q(day=day, version__lt=version)
+    ).delete()
+    return rows
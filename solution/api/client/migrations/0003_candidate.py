@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0004_campaign_created_at'),
+        ('client', '0002_remove_click_client_clic_adverti_13c970_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.BigIntegerField()),
+                ('version', models.PositiveIntegerField()),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidates', to='business.campaign')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='client.client')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'day', 'version'], name='client_cand_client__d22571_idx'), models.Index(fields=['day', 'version'], name='client_cand_day_87999b_idx')],
+            },
+        ),
+    ]
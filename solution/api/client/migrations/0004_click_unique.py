@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0005_dailycampaignstats'),
+        ('client', '0003_candidate'),
+    ]
+
+    operations = [
+        # Repeated clicks were recorded once per day and counted every time.
+        # Keep the first click of each client and campaign and recount.
+        migrations.RunSQL(
+            sql="""
+                DELETE FROM client_click AS duplicate
+                USING client_click AS first
+                WHERE duplicate.client_id = first.client_id
+                    AND duplicate.advertisement_id = first.advertisement_id
+                    AND duplicate.id > first.id;
+
+                UPDATE business_campaign AS campaign
+                SET clicks_count = (
+                    SELECT COUNT(*) FROM client_click
+                    WHERE client_click.advertisement_id = campaign.id
+                );
+
+                UPDATE business_dailycampaignstats AS stats
+                SET clicks_count = clicks.count, spent_clicks = clicks.spent
+                FROM (
+                    SELECT rollup.id, COUNT(click.id) AS count,
+                           COALESCE(SUM(click.cost), 0) AS spent
+                    FROM business_dailycampaignstats AS rollup
+                    LEFT JOIN client_click AS click
+                        ON click.advertisement_id = rollup.advertisement_id
+                        AND click.day = rollup.day
+                    GROUP BY rollup.id
+                ) AS clicks
+                WHERE clicks.id = stats.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='click',
+            unique_together={('client_id', 'advertisement')},
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0005_dailycampaignstats'),
+        ('client', '0004_click_unique'),
+    ]
+
+    operations = [
+        # Rows a rematch and a shard inserted twice.
+        migrations.RunSQL(
+            """
+            DELETE FROM client_candidate AS candidate
+            USING client_candidate AS other
+            WHERE candidate.day = other.day
+                AND candidate.version = other.version
+                AND candidate.client_id = other.client_id
+                AND candidate.campaign_id = other.campaign_id
+                AND candidate.id > other.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='candidate',
+            constraint=models.UniqueConstraint(fields=('day', 'version', 'client', 'campaign'), name='client_candidate_unique'),
+        ),
+    ]
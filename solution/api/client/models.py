@@ -1,7 +1,8 @@
 import logging
+import time
 
 from django.core.cache import caches
-from django.db import models
+from django.db import connection, models
 from django.db.models import (
     Q,
     QuerySet,
@@ -14,13 +15,14 @@ from django.db.models import (
     F, Exists,
 )
 
+from app.metrics import ADS_CANDIDATES, record_cache_access
+from app.tracing import observe_stage
 from app.validators import profanity_validator
 from django.db.models.functions import Coalesce
 
 from business.algorithm import compute_ad_score, normalize_ml_score
 from business.models import Campaign, Advertiser, Score
-
-from business.algorithm import get_max_profit
+from .segments import segments
 
 logger = logging.getLogger(__name__)
 
@@ -37,34 +39,26 @@ class Client(models.Model):
     location = models.CharField(max_length=500, validators=[profanity_validator])
     gender = models.CharField(max_length=6, choices=CLIENT_GENDER_CHOICES)
 
-    def get_relevant_advertisement(self, current_day):
+    def get_relevant_advertisement(self, current_day, build=None):
         local_cache = caches['local']
         ml_min, ml_max = local_cache.get("score_ml_min"), local_cache.get("score_ml_max")
+        record_cache_access("score_bounds", ml_min is not None)
 
-        campaigns = list(
-            self.get_targeted_and_not_impressed_campaigns(current_day)
-            .annotate(
-                ml_score=Coalesce(
-                    Subquery(
-                        Score.objects.filter(
-                            client=self, advertiser_id=OuterRef("advertiser_id")
-                        ).values("score")[:1]
-                    ),
-                    Value(0),
-                ),
-            )
-            .filter(
-                impressions_count__lt=F("impressions_limit"),
-                clicks_count__lt=F("clicks_limit"),
-            )
-        )
+        started = time.perf_counter()
+        campaigns = self.get_candidate_campaigns(current_day, build)
+        ADS_CANDIDATES.observe(len(campaigns))
 
         if not campaigns:
+            observe_stage("candidate_query", started)
             return None
 
-        campaign_ids = tuple(campaign.id for campaign in campaigns)
-
-        max_profit = get_max_profit(self.id, campaign_ids)
+        # Highest profit P over the candidates, with the ML score taken as score / 100.
+        max_profit = max(
+            campaign.cost_per_impression + campaign.ml_score / 100 * campaign.cost_per_click
+            for campaign in campaigns
+        )
+        scoring_started = time.perf_counter()
+        observe_stage("candidate_query", started, scoring_started)
 
         for campaign in campaigns:
             # Normalize ML score inline
@@ -99,32 +93,94 @@ class Client(models.Model):
             campaign.ad_score = base_score * D
 
         campaigns.sort(key=lambda c: c.ad_score, reverse=True)
+        observe_stage("scoring", scoring_started)
         return campaigns
 
-    def get_targeted_and_not_impressed_campaigns(self, current_day):
-        return (
-            Campaign.objects
-            .filter(
-                start_date__lte=current_day,
-                end_date__gte=current_day,
+    def get_candidate_campaigns(self, current_day, build=None):
+        """
+        Unseen campaigns targeting the client that are under their limits,
+        annotated with the client's ML score. Without a ready build the
+        targeting is taken from the segment cache, shared by all clients
+        with the same gender, age and location.
+        """
+        ml_score = Coalesce(
+            Subquery(
+                Score.objects.filter(
+                    client=self, advertiser_id=OuterRef("advertiser_id")
+                ).values("score")[:1]
+            ),
+            Value(0),
+        )
+        under_limits = Q(
+            impressions_count__lt=F("impressions_limit"),
+            clicks_count__lt=F("clicks_limit"),
+        )
+        if build is None or build.ready:
+            return list(
+                self.get_targeted_and_not_impressed_campaigns(current_day, build)
+                .annotate(ml_score=ml_score)
+                .filter(under_limits)
             )
-            .filter(
-                Q(targeted_gender=self.gender) | Q(targeted_gender="ALL") | Q(targeted_gender__isnull=True),
-                Q(targeted_age_from__lte=self.age) | Q(targeted_age_from__isnull=True),
-                Q(targeted_age_to__gte=self.age) | Q(targeted_age_to__isnull=True),
-                Q(targeted_location=self.location) | Q(targeted_location__isnull=True),
+
+        segments.sync(build.epoch)
+        key = (build.day, build.version, self.gender, self.age, self.location)
+        if (campaign_ids := segments.get(key)) is not None:
+            if not campaign_ids:
+                return []
+            return list(
+                Campaign.objects.filter(id__in=campaign_ids)
+                .annotate(has_impression=self.impression_exists())
+                .filter(has_impression=False)
+                .annotate(ml_score=ml_score)
+                .filter(under_limits)
             )
-            .annotate(
-                has_impression=Exists(
-                    Impression.objects.filter(
-                        client_id=self.id,
-                        advertisement_id=OuterRef("pk"),
-                    )
-                )
+
+        # Seen and exhausted campaigns are kept in the result and dropped
+        # here, so the same query also fills the segment.
+        campaigns = list(
+            self.get_targeted_campaigns(current_day).annotate(
+                has_impression=self.impression_exists(), ml_score=ml_score
             )
+        )
+        segments.set(key, [campaign.id for campaign in campaigns])
+        return [
+            campaign
+            for campaign in campaigns
+            if not campaign.has_impression
+            and campaign.impressions_count < campaign.impressions_limit
+            and campaign.clicks_count < campaign.clicks_limit
+        ]
+
+    def get_targeted_campaigns(self, current_day, build=None):
+        if build is not None and build.ready:
+            # Targeting was matched ahead of time by client.candidates.
+            return Campaign.objects.filter(
+                candidates__client=self,
+                candidates__day=build.day,
+                candidates__version=build.version,
+            )
+        return Campaign.objects.filter(
+            start_date__lte=current_day,
+            end_date__gte=current_day,
+        ).filter(
+            Q(targeted_gender=self.gender) | Q(targeted_gender="ALL") | Q(targeted_gender__isnull=True),
+            Q(targeted_age_from__lte=self.age) | Q(targeted_age_from__isnull=True),
+            Q(targeted_age_to__gte=self.age) | Q(targeted_age_to__isnull=True),
+            Q(targeted_location=self.location) | Q(targeted_location__isnull=True),
+        )
+
+    def get_targeted_and_not_impressed_campaigns(self, current_day, build=None):
+        return (
+            self.get_targeted_campaigns(current_day, build)
+            .annotate(has_impression=self.impression_exists())
             .filter(has_impression=False)
         )
 
+    def impression_exists(self):
+        return Exists(
+            Impression.objects.filter(client_id=self.id, advertisement_id=OuterRef("pk"))
+        )
+
     def get_normalized_ml_score(self, advertiser: Advertiser):
         score = Score.objects.filter(advertiser=advertiser, client=self).first()
         ml_min, ml_max = Score.get_min_and_max()
@@ -156,6 +212,160 @@ class Impression(models.Model):
     def __str__(self):
         return f"Impression(advertisement_id={self.advertisement.id}, day={self.day})"
 
+    @staticmethod
+    def reserve(client_id, advertisement, day):
+        """
+        Records an impression and bumps the campaign counter in one statement.
+        Returns False when the client has already seen this advertisement.
+        """
+        return bool(Impression.reserve_many([(client_id, advertisement)], day))
+
+    @staticmethod
+    def reserve_many(reservations, day):
+        """
+        Records impressions for ``(client_id, advertisement)`` pairs and bumps
+        the campaign counters, all in one statement. Returns the
+        ``(client_id, advertisement_id)`` pairs (as strings) that were
+        recorded, pairs the client has already seen are skipped.
+
+        The campaign rows are locked in id order before any impression is
+        inserted, so concurrent batches with overlapping campaigns wait for
+        each other instead of deadlocking. Under the lock each campaign takes
+        its pairs in the given order only up to the impressions it has left,
+        so a batch never pushes a campaign over its limit.
+        """
+        if not reservations:
+            return set()
+        values = ", ".join(
+            ["(%s::integer, %s::uuid, %s::double precision, %s::uuid, %s::uuid, %s::bigint)"]
+            * len(reservations)
+        )
+        query = f"""
+            WITH locked AS MATERIALIZED (
+                SELECT id, impressions_limit - impressions_count AS remaining
+                FROM business_campaign
+                WHERE id = ANY(%s::uuid[])
+                ORDER BY id
+                FOR NO KEY UPDATE
+            ), ranked AS (
+                SELECT
+                    reservation.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY reservation.advertisement_id
+                        ORDER BY reservation.position
+                    ) AS rank
+                FROM (VALUES {values}) AS reservation (
+                    position, client_id, cost, advertiser_id, advertisement_id, day
+                )
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM client_impression
+                    WHERE client_impression.client_id = reservation.client_id
+                      AND client_impression.advertisement_id = reservation.advertisement_id
+                )
+            ), reserved AS (
+                INSERT INTO client_impression (client_id, cost, advertiser_id, advertisement_id, day)
+                SELECT ranked.client_id, ranked.cost, ranked.advertiser_id, ranked.advertisement_id, ranked.day
+                FROM ranked
+                JOIN locked ON locked.id = ranked.advertisement_id
+                WHERE ranked.rank <= locked.remaining
+                ON CONFLICT (client_id, advertisement_id) DO NOTHING
+                RETURNING client_id, advertisement_id
+            ), counted AS (
+                UPDATE business_campaign
+                SET impressions_count = impressions_count + reserved_count.n
+                FROM (
+                    SELECT advertisement_id, COUNT(*) AS n
+                    FROM reserved
+                    GROUP BY advertisement_id
+                ) AS reserved_count
+                WHERE business_campaign.id = reserved_count.advertisement_id
+            )
+            SELECT client_id, advertisement_id FROM reserved;
+        """
+        params = [sorted({str(advertisement.id) for _, advertisement in reservations})]
+        for position, (client_id, advertisement) in enumerate(reservations):
+            params += [
+                position,
+                str(client_id),
+                advertisement.cost_per_impression,
+                str(advertisement.advertiser_id),
+                str(advertisement.id),
+                day,
+            ]
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return {
+                (str(client_id), str(advertisement_id))
+                for client_id, advertisement_id in cursor.fetchall()
+            }
+
+
+class Candidate(models.Model):
+    """
+    Campaign whose targeting and dates match the client on ``day``. Rows are
+    materialized by client.candidates in builds numbered by ``version``, so
+    GET /ads only checks the live counters and the impressions.
+    """
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.CASCADE, related_name="candidates"
+    )
+    day = models.BigIntegerField()
+    version = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["client", "day", "version"]),
+            models.Index(fields=["day", "version"]),
+        ]
+        constraints = [
+            # A client rematched during a build may also be inserted by its shard.
+            models.UniqueConstraint(
+                fields=["day", "version", "client", "campaign"],
+                name="client_candidate_unique",
+            ),
+        ]
+
+    @staticmethod
+    def materialize(day, version, lower=None, upper=None, client_ids=None):
+        """
+        Inserts the candidates of clients with ids in ``[lower, upper)`` or in
+        ``client_ids`` with a single statement. Returns the number of rows.
+        """
+        conditions, params = [], [day, version, day, day]
+        if lower is not None:
+            conditions.append("client.id >= %s")
+            params.append(str(lower))
+        if upper is not None:
+            conditions.append("client.id < %s")
+            params.append(str(upper))
+        if client_ids is not None:
+            conditions.append("client.id = ANY(%s::uuid[])")
+            params.append([str(client_id) for client_id in client_ids])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            INSERT INTO client_candidate (client_id, campaign_id, day, version)
+            SELECT client.id, campaign.id, %s, %s
+            FROM client_client AS client
+            JOIN business_campaign AS campaign
+                ON campaign.start_date <= %s AND campaign.end_date >= %s
+                AND (campaign.targeted_gender = client.gender
+                     OR campaign.targeted_gender = 'ALL'
+                     OR campaign.targeted_gender IS NULL)
+                AND (campaign.targeted_age_from <= client.age
+                     OR campaign.targeted_age_from IS NULL)
+                AND (campaign.targeted_age_to >= client.age
+                     OR campaign.targeted_age_to IS NULL)
+                AND (campaign.targeted_location = client.location
+                     OR campaign.targeted_location IS NULL)
+            {where}
+            ON CONFLICT DO NOTHING;
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
 
 class Click(models.Model):
     client_id = models.UUIDField(db_index=True)
@@ -168,6 +378,7 @@ class Click(models.Model):
     day = models.BigIntegerField(db_index=True)
 
     class Meta:
+        unique_together = (("client_id", "advertisement",),)
         indexes = [
             models.Index(fields=["client_id"]),
             models.Index(fields=["advertisement"]),
@@ -176,3 +387,57 @@ class Click(models.Model):
 
     def __str__(self):
         return f"Click(advertisement_id={self.advertisement.id}, day={self.day})"
+
+    RECORDED = "recorded"
+    DUPLICATE = "duplicate"
+    CLIENT_NOT_FOUND = "client_not_found"
+    NOT_IMPRESSED = "not_impressed"
+
+    @staticmethod
+    def record(client_id, campaign, day):
+        """
+        Checks the client and the impression, records the click and bumps the
+        campaign counter, all in one statement. ``campaign`` is a snapshot
+        (see business.snapshots), so the campaign row is not read. A
+        client's repeated clicks on a campaign are recorded and counted once.
+        Returns one of the status constants above.
+        """
+        query = """
+            WITH client AS (
+                SELECT id FROM client_client WHERE id = %(client_id)s
+            ), impression AS (
+                SELECT 1 FROM client_impression
+                WHERE client_id = %(client_id)s AND advertisement_id = %(campaign_id)s
+            ), clicked AS (
+                INSERT INTO client_click (client_id, cost, advertiser_id, advertisement_id, day)
+                SELECT client.id, %(cost)s, %(advertiser_id)s, %(campaign_id)s, %(day)s
+                FROM client
+                WHERE EXISTS (SELECT 1 FROM impression)
+                ON CONFLICT (client_id, advertisement_id) DO NOTHING
+                RETURNING advertisement_id
+            ), counted AS (
+                UPDATE business_campaign
+                SET clicks_count = clicks_count + 1
+                WHERE id IN (SELECT advertisement_id FROM clicked)
+            )
+            SELECT CASE
+                WHEN NOT EXISTS (SELECT 1 FROM client) THEN %(client_not_found)s
+                WHEN NOT EXISTS (SELECT 1 FROM impression) THEN %(not_impressed)s
+                WHEN EXISTS (SELECT 1 FROM clicked) THEN %(recorded)s
+                ELSE %(duplicate)s
+            END;
+        """
+        params = {
+            "client_id": str(client_id),
+            "campaign_id": str(campaign.id),
+            "advertiser_id": str(campaign.advertiser_id),
+            "cost": campaign.cost_per_click,
+            "day": day,
+            "client_not_found": Click.CLIENT_NOT_FOUND,
+            "not_impressed": Click.NOT_IMPRESSED,
+            "recorded": Click.RECORDED,
+            "duplicate": Click.DUPLICATE,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
@@ -0,0 +1,72 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from app.metrics import record_cache_access
+
+UUID_SIZE = 16
+# Rough size of the key tuple and the dictionary slots of one entry.
+ENTRY_OVERHEAD = 200
+
+
+class SegmentCache:
+    """
+    In-process LRU cache of the campaign ids that target a segment, i.e. all
+    clients with the same ``(gender, age, location)``. Ids are packed into
+    one bytes object per segment and the least recently used segments are
+    evicted once the entries take more than ``max_bytes``. Entries of past
+    days are dropped at once when the day epoch moves (see app.events).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.epoch = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            packed = self._entries.get(key)
+            if packed is not None:
+                self._entries.move_to_end(key)
+        record_cache_access("ads_segment", packed is not None)
+        if packed is None:
+            return None
+        return [
+            uuid.UUID(bytes=packed[i : i + UUID_SIZE])
+            for i in range(0, len(packed), UUID_SIZE)
+        ]
+
+    def set(self, key, campaign_ids):
+        packed = b"".join(campaign_id.bytes for campaign_id in campaign_ids)
+        if len(packed) + ENTRY_OVERHEAD > self.max_bytes:
+            return
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self.size -= len(previous) + ENTRY_OVERHEAD
+            self._entries[key] = packed
+            self.size += len(packed) + ENTRY_OVERHEAD
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted) + ENTRY_OVERHEAD
+
+    def sync(self, epoch):
+        if epoch != self.epoch:
+            with self._lock:
+                self._entries.clear()
+                self.size = 0
+                self.epoch = epoch
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+segments = SegmentCache(settings.ADS_SEGMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,10 @@
+from django.dispatch import receiver
+
+from app.events import day_advanced
+from . import candidates
+
+
+@receiver(day_advanced)
+def rebuild_candidates(sender, day, **kwargs):
+    # Campaigns starting or ending on the new day change every client's list.
+    candidates.schedule_rebuild(day)
@@ -0,0 +1,13 @@
+import logging
+
+from app.jobs import task
+from . import candidates
+
+logger = logging.getLogger(__name__)
+
+
+@task("ads.precompute_candidates", max_retries=3)
+def precompute_candidates(day, version):
+    rows = candidates.precompute(day, version)
+    logger.info(f"Precomputed {rows} ad candidates for build {day}:{version}")
+    return rows
@@ -1,6 +1,8 @@
-from django.db import IntegrityError, transaction
-from django.db.models import F
+import uuid
+
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
+from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_GET
 from rest_framework import status
 from rest_framework.generics import RetrieveAPIView
@@ -8,8 +10,13 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from app.exceptions import CustomAPIException
+from app.idempotency import idempotent
+from app.metrics import ADS_RESERVATION_ATTEMPTS
+from app.tracing import stage
 from app.utils import get_current_day
-from business.models import Campaign
+from business.reach import record_reach
+from business.snapshots import get_campaign_snapshot
+from . import candidates
 from .models import Client, Click, Impression
 from .serializers import ClientSerializer
 
@@ -39,6 +46,7 @@ class BulkCreateClientsView(APIView):
             unique_fields=["id"],
             update_fields=["login", "age", "location", "gender"],
         )
+        candidates.refresh_clients([client.id for client in clients])
 
         return Response(
             ClientSerializer(clients, many=True).data, status=status.HTTP_201_CREATED
@@ -51,82 +59,182 @@ class GetClientView(RetrieveAPIView):
     lookup_field = "id"
 
 
+MAX_RESERVATION_ATTEMPTS = 50
+MAX_ADS_PER_BATCH = 20
+MAX_CLIENTS_PER_BATCH = 100
+
+
+def reserve_impressions(rankings, current_day, n, max_retries=MAX_RESERVATION_ATTEMPTS):
+    """
+    Reserves up to ``n`` ads for every client of ``rankings`` (client id to
+    ranked candidates), best first. Each round reserves the next candidates
+    of all clients with one statement, another round is needed only for
+    candidates taken concurrently by another request or whose campaign ran
+    out of impressions.
+    """
+    chosen = {client_id: [] for client_id in rankings}
+    tried = dict.fromkeys(rankings, 0)
+    while True:
+        round_reservations = []
+        for client_id, advertisements in rankings.items():
+            start = tried[client_id]
+            stop = min(
+                start + n - len(chosen[client_id]), len(advertisements), max_retries
+            )
+            round_reservations += [(client_id, ad) for ad in advertisements[start:stop]]
+            tried[client_id] = stop
+        if not round_reservations:
+            break
+
+        reserved = Impression.reserve_many(round_reservations, current_day)
+        for client_id, advertisement in round_reservations:
+            if (str(client_id), str(advertisement.id)) in reserved:
+                chosen[client_id].append(advertisement)
+
+    for attempts in tried.values():
+        ADS_RESERVATION_ATTEMPTS.observe(attempts)
+    record_reach(
+        [(client_id, ad) for client_id, ads in chosen.items() for ad in ads],
+        current_day,
+    )
+    return chosen
+
+
+def reserve_impression(client_id, sorted_advertisements, current_day, max_retries):
+    chosen = reserve_impressions(
+        {client_id: sorted_advertisements}, current_day, 1, max_retries
+    )
+    return next(iter(chosen[client_id]), None)
+
+
+def serialize_advertisement(advertisement):
+    response_data = {
+        "ad_id": str(advertisement.id),
+        "ad_title": advertisement.ad_title,
+        "ad_text": advertisement.ad_text,
+        "advertiser_id": advertisement.advertiser_id,
+    }
+    return {k: v for k, v in response_data.items() if v is not None}
+
+
 @require_GET
+@idempotent
 def get_advertisement_view(request):
     client_id = request.GET.get("client_id")
     if not client_id:
         return JsonResponse({"detail": "client_id not provided"}, status=400)
 
-    try:
-        client = Client.objects.get(pk=client_id)
-    except Client.DoesNotExist:
-        return JsonResponse({"detail": "client not found"}, status=404)
+    with stage("client_load"):
+        try:
+            client = Client.objects.get(pk=client_id)
+        except Client.DoesNotExist:
+            return JsonResponse({"detail": "client not found"}, status=404)
 
     current_day = get_current_day()
-    max_retries = 50
+    build = candidates.get_build(current_day)
 
-    sorted_advertisements = client.get_relevant_advertisement(current_day)
+    sorted_advertisements = client.get_relevant_advertisement(current_day, build)
     if not sorted_advertisements:
         return JsonResponse({"message": "not relevant ads"}, status=404)
 
-    for tries in range(min(max_retries, len(sorted_advertisements))):
-        try:
-            advertisement = sorted_advertisements[tries]
-            with transaction.atomic():
-                impression, created = Impression.objects.get_or_create(
-                    client_id=client_id,
-                    advertiser_id=advertisement.advertiser_id,
-                    advertisement=advertisement,
-                    day=current_day,
-                    defaults={"cost": advertisement.cost_per_impression},
-                )
-                if created:
-                    Campaign.objects.filter(id=advertisement.id).update(impressions_count=F('impressions_count') + 1)
-
-                    response_data = {
-                        "ad_id": str(advertisement.id),
-                        "ad_title": advertisement.ad_title,
-                        "ad_text": advertisement.ad_text,
-                        "advertiser_id": advertisement.advertiser_id,
-                    }
-                    return JsonResponse({k: v for k, v in response_data.items() if v is not None})
-        except IntegrityError:
-            continue
+    with stage("reservation"):
+        advertisement = reserve_impression(
+            client_id, sorted_advertisements, current_day, MAX_RESERVATION_ATTEMPTS
+        )
+    if advertisement:
+        return JsonResponse(serialize_advertisement(advertisement))
 
     return JsonResponse({"message": "No new advertisements available"}, status=404)
 
 
+@require_GET
+@idempotent
+def get_advertisements_batch_view(request):
+    """
+    Up to ``n`` distinct ads per client from a single ranking pass.
+    ``?client_id=`` returns a list of ads; ``?client_ids=a,b`` (server-side
+    prefetch) returns ads keyed by client id, unknown clients get none.
+    """
+    try:
+        n = int(request.GET.get("n", 1))
+    except ValueError:
+        n = 0
+    if not 1 <= n <= MAX_ADS_PER_BATCH:
+        return JsonResponse(
+            {"detail": f"n must be between 1 and {MAX_ADS_PER_BATCH}"}, status=400
+        )
+
+    many = "client_ids" in request.GET
+    if many:
+        client_ids = [
+            client_id for client_id in request.GET["client_ids"].split(",") if client_id
+        ]
+    else:
+        client_ids = [request.GET["client_id"]] if request.GET.get("client_id") else []
+    if not client_ids:
+        return JsonResponse({"detail": "client_id not provided"}, status=400)
+    if len(client_ids) > MAX_CLIENTS_PER_BATCH:
+        return JsonResponse(
+            {"detail": f"at most {MAX_CLIENTS_PER_BATCH} clients per request"},
+            status=400,
+        )
+
+    with stage("client_load"):
+        try:
+            clients = Client.objects.in_bulk(client_ids)
+        except ValidationError:
+            return JsonResponse({"detail": "invalid client_id"}, status=400)
+    if not many and not clients:
+        return JsonResponse({"detail": "client not found"}, status=404)
+
+    current_day = get_current_day()
+    build = candidates.get_build(current_day)
+    rankings = {
+        str(client_id): client.get_relevant_advertisement(current_day, build) or []
+        for client_id, client in clients.items()
+    }
+    with stage("reservation"):
+        chosen = reserve_impressions(rankings, current_day, n)
+
+    ads = {
+        client_id: [serialize_advertisement(ad) for ad in advertisements]
+        for client_id, advertisements in chosen.items()
+    }
+    if many:
+        return JsonResponse(
+            {client_id: ads.get(str(uuid.UUID(client_id)), []) for client_id in client_ids}
+        )
+    return JsonResponse(next(iter(ads.values())), safe=False)
+
+
+@method_decorator(idempotent, name="dispatch")
 class ClickAdvertisementView(APIView):
+    errors = {
+        Click.CLIENT_NOT_FOUND: ("Клиент не найден.", status.HTTP_404_NOT_FOUND),
+        Click.NOT_IMPRESSED: (
+            "Вы не можете перейти по рекламе без показа.",
+            status.HTTP_403_FORBIDDEN,
+        ),
+    }
+
     def post(self, request, *args, **kwargs):
-        client_id = request.data.get("client_id")
-        if not Client.objects.filter(pk=client_id).exists():
+        try:
+            client_id = uuid.UUID(str(request.data.get("client_id")))
+        except ValueError:
             raise CustomAPIException(
                 detail="Клиент не найден.",
                 status_code=status.HTTP_404_NOT_FOUND,
             )
-        campaign_id = kwargs.get("campaign_id")
-        if not (campaign := Campaign.objects.filter(pk=campaign_id).first()):
+
+        if not (campaign := get_campaign_snapshot(kwargs.get("campaign_id"))):
             raise CustomAPIException(
                 detail="Кампания не найден.",
                 status_code=status.HTTP_404_NOT_FOUND,
             )
-        if not Impression.objects.filter(
-            advertisement_id=campaign_id, client_id=client_id
-        ).exists():
-            raise CustomAPIException(
-                detail="Вы не можете перейти по рекламе без показа.",
-                status_code=status.HTTP_403_FORBIDDEN,
-            )
 
-        current_day = get_current_day()
-        with transaction.atomic():
-            Click.objects.get_or_create(
-                client_id=client_id,
-                advertisement_id=campaign_id,
-                advertiser_id=campaign.advertiser_id,
-                day=current_day,
-                cost=campaign.cost_per_click,
-            )
-            Campaign.objects.filter(id=campaign_id).update(clicks_count=F('clicks_count') + 1)
+        result = Click.record(client_id, campaign, get_current_day())
+        if result in self.errors:
+            detail, status_code = self.errors[result]
+            raise CustomAPIException(detail=detail, status_code=status_code)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
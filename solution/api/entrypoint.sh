@@ -1,6 +1,14 @@
 #!/bin/sh
 
+# Metric files of the previous run must not be merged into the new one. The
+# directory must exist before manage.py imports app.metrics.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 /app/.venv/bin/python manage.py makemigrations
 /app/.venv/bin/python manage.py migrate
+
 #/app/.venv/bin/python manage.py runserver $SERVER_ADDRESS
-/app/.venv/bin/gunicorn --workers=2 --threads=40 --bind $SERVER_ADDRESS app.wsgi:application
\ No newline at end of file
+/app/.venv/bin/gunicorn -c gunicorn.conf.py --workers=2 --threads=40 --bind $SERVER_ADDRESS app.wsgi:application
\ No newline at end of file
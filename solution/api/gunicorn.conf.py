@@ -0,0 +1,6 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drop live gauges of the exited worker from the shared metrics directory.
+    multiprocess.mark_process_dead(worker.pid)
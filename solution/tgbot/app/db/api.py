@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, BinaryIO, Callable, NamedTuple
+from urllib.parse import urlencode
+
+import aiohttp
+from redis.asyncio.client import Redis
+from redis.exceptions import RedisError
+
+from .cache import RedisResponseCache
+
+logger = logging.getLogger(__name__)
+
+# Methods that can be sent again without changing the result.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+# Validators of conditional GETs live much longer than cached statistics,
+# a stale entry costs one full response.
+ETAG_TTL = 24 * 60 * 60
+# The API publishes every day advance here, see app/events.py of the API.
+DAY_ADVANCED_CHANNEL = "events:day-advanced"
+
+
+class ApiResponse(NamedTuple):
+    status: int
+    headers: Any
+    data: Any
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, data: Any):
+        super().__init__(f"API responded with {status}: {data}")
+        self.status = status
+        self.data = data
+
+
+class ApiClient:
+    """
+    Client of the advertising API. One instance is created in ``main()`` and
+    shared by all handlers through the dispatcher (``dp["api"]``), so the
+    connections to the API are pooled and kept alive between updates.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        timeout: float = 10,
+        connect_timeout: float = 3,
+        limit: int = 100,
+        keepalive_timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.3,
+        cache: RedisResponseCache | None = None,
+        current_day_ttl: float = 5,
+    ):
+        self.base_url = (
+            base_url or os.getenv("API_URL", "http://localhost:8080")
+        ).rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.current_day_ttl = current_day_ttl
+        self._current_day: tuple[int, float] | None = None
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily, the session has to be bound to the running loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def request(self, method: str, path: str, **kwargs) -> Any:
+        return (await self.send(method, path, **kwargs)).data
+
+    async def send(
+        self,
+        method: str,
+        path: str,
+        *,
+        retry: bool | None = None,
+        form: dict | None = None,
+        **kwargs,
+    ) -> ApiResponse:
+        """
+        Sends a request and returns the status, headers and decoded JSON body.
+        Connection errors, timeouts and 502-504 answers are retried with
+        exponential backoff for idempotent methods or when ``retry`` is set.
+        ``form`` maps field names to ``(filename, content, content_type)`` and
+        is sent as multipart, the form is rebuilt for every attempt.
+        """
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        attempts = self.retries + 1 if retry else 1
+
+        for attempt in range(1, attempts + 1):
+            if form is not None:
+                kwargs["data"] = build_form(form)
+            try:
+                async with self.session.request(
+                    method, f"{self.base_url}{path}", **kwargs
+                ) as response:
+                    if response.status in RETRY_STATUSES and attempt < attempts:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                        )
+                    data = await response.json(content_type=None)
+                    if response.status >= 400:
+                        raise ApiError(response.status, data)
+                    return ApiResponse(response.status, response.headers, data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= attempts:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1) * (1 + random.random())
+                logger.warning(
+                    f"{method} {path} failed ({e}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def create_campaign(
+        self,
+        advertiser_id: str,
+        campaign_data: dict,
+        image: BinaryIO | bytes | None = None,
+    ) -> dict:
+        campaign = await self.request(
+            "POST", f"/advertisers/{advertiser_id}/campaigns", json=campaign_data
+        )
+        if image:
+            uploaded = await self.upload_image(
+                advertiser_id, campaign["campaign_id"], image
+            )
+            campaign["image"] = uploaded["image"]
+        return campaign
+
+    async def update_campaign(
+        self,
+        advertiser_id: str,
+        campaign_id: str,
+        campaign_data: dict,
+        image: BinaryIO | bytes | None = None,
+    ) -> dict:
+        campaign = await self.request(
+            "PATCH",
+            f"/advertisers/{advertiser_id}/campaigns/{campaign_id}",
+            json=campaign_data,
+            retry=True,
+        )
+        if image:
+            uploaded = await self.upload_image(advertiser_id, campaign_id, image)
+            campaign["image"] = uploaded["image"]
+        return campaign
+
+    async def upload_image(
+        self, advertiser_id: str, campaign_id: str, image: BinaryIO | bytes
+    ) -> dict:
+        # Images are stored by content hash, so an upload can be repeated.
+        if not isinstance(image, bytes):
+            image = image.read()
+        return await self.request(
+            "PUT",
+            f"/advertisers/{advertiser_id}/campaigns/{campaign_id}/image",
+            form={"image": ("image.jpg", image, "image/jpeg")},
+        )
+
+    async def get_current_day(self) -> int:
+        data = await self.request("GET", "/time/current")
+        current_day = data["current_date"]
+        self._current_day = (current_day, time.monotonic() + self.current_day_ttl)
+        return current_day
+
+    async def get_cached_current_day(self) -> int:
+        # Used for cache keys only, so a day advance is noticed within
+        # current_day_ttl seconds without asking the API on every render.
+        if self._current_day is not None and self._current_day[1] > time.monotonic():
+            return self._current_day[0]
+        return await self.get_current_day()
+
+    def day_advanced(self, day: int) -> None:
+        self._current_day = (day, time.monotonic() + self.current_day_ttl)
+
+    async def watch_day_advances(self, redis: Redis, reconnect_delay: float = 5) -> None:
+        """
+        Takes day advances as soon as the API publishes them, so cached
+        statistics of the previous day are not served for up to
+        ``current_day_ttl`` seconds. Runs until cancelled.
+        """
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(DAY_ADVANCED_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.day_advanced(json.loads(message["data"])["day"])
+            except RedisError as e:
+                # Advances missed meanwhile are picked up by current_day_ttl.
+                logger.warning(f"Day advance subscription failed ({e}), reconnecting")
+                await asyncio.sleep(reconnect_delay)
+
+    async def cached(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached value of ``key`` for the current day or fetches it."""
+        if self.cache is None:
+            return await fetch()
+        key = f"{key}:day:{await self.get_cached_current_day()}"
+        if (value := await self.cache.get(key)) is not None:
+            return value
+        value = await fetch()
+        await self.cache.set(key, value)
+        return value
+
+    async def get_conditional(self, path: str, params: dict | None = None) -> Any:
+        """
+        GET revalidated with the ETag of the last response. An unchanged
+        resource is answered with an empty 304 and served from the cache.
+        """
+        if self.cache is None:
+            return await self.request("GET", path, params=params)
+        key = f"etag:{path}?{urlencode(sorted((params or {}).items()))}"
+        cached = await self.cache.get(key)
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+
+        response = await self.send("GET", path, params=params, headers=headers)
+        if response.status == 304 and cached:
+            return cached["data"]
+        if etag := response.headers.get("ETag"):
+            await self.cache.set(key, {"etag": etag, "data": response.data}, ETAG_TTL)
+        return response.data
+
+    async def get_campaigns(self, campaign_ids: list[str]) -> list[dict]:
+        return await self.get_conditional(
+            "/campaigns/batch", {"ids": ",".join(map(str, campaign_ids))}
+        )
+
+    async def get_campaign(self, campaign_id: str) -> dict | None:
+        campaigns = await self.get_campaigns([campaign_id])
+        return campaigns[0] if campaigns else None
+
+    async def get_advertisers(self, advertiser_ids: list[str]) -> list[dict]:
+        return await self.get_conditional(
+            "/advertisers/batch", {"ids": ",".join(map(str, advertiser_ids))}
+        )
+
+    async def get_advertiser(self, advertiser_id: str) -> dict | None:
+        advertisers = await self.get_advertisers([advertiser_id])
+        return advertisers[0] if advertisers else None
+
+    async def get_page(self, path: str, page: int, size: int) -> dict:
+        response = await self.send("GET", path, params={"page": page, "size": size})
+        total = response.headers.get("X-Total-Count", len(response.data))
+        return {"items": response.data, "total": int(total)}
+
+    async def get_campaign_statistics(self, campaign_id: str) -> dict:
+        path = f"/stats/campaigns/{campaign_id}"
+        return await self.cached(path, lambda: self.request("GET", path))
+
+    async def get_campaign_daily_statistics(
+        self, campaign_id: str, page: int = 1, size: int = 1
+    ) -> dict:
+        """Returns ``{"items": [...], "total": <number of days>}`` of one page."""
+        path = f"/stats/campaigns/{campaign_id}/daily"
+        return await self.cached(
+            f"{path}:{page}:{size}", lambda: self.get_page(path, page, size)
+        )
+
+    async def get_advertiser_statistics(self, advertiser_id: str) -> dict:
+        path = f"/stats/advertisers/{advertiser_id}/campaigns"
+        return await self.cached(path, lambda: self.request("GET", path))
+
+    async def get_advertiser_daily_statistics(
+        self, advertiser_id: str, page: int = 1, size: int = 1
+    ) -> dict:
+        path = f"/stats/advertisers/{advertiser_id}/campaigns/daily"
+        return await self.cached(
+            f"{path}:{page}:{size}", lambda: self.get_page(path, page, size)
+        )
+
+    async def list_campaigns(
+        self, advertiser_id: str, cursor: str | None = None, size: int = 6
+    ) -> dict:
+        """
+        One keyset page of the advertiser's campaigns in creation order with
+        the cursors of the neighbouring pages and an approximate total.
+        """
+        params = {"size": size, "count": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = await self.send(
+            "GET", f"/advertisers/{advertiser_id}/campaigns", params=params
+        )
+        headers = response.headers
+        return {
+            "items": response.data,
+            "next": headers.get("X-Next-Cursor"),
+            "previous": headers.get("X-Previous-Cursor"),
+            "last": headers.get("X-Last-Cursor"),
+            "total": int(headers.get("X-Total-Count", len(response.data))),
+        }
+
+    async def delete_campaign(self, advertiser_id: str, campaign_id: str) -> None:
+        await self.request(
+            "DELETE", f"/advertisers/{advertiser_id}/campaigns/{campaign_id}"
+        )
+
+    async def generate_text(self, title: str, targeting: str | None = None) -> str:
+        params = {"title": title}
+        if targeting:
+            params["targeting"] = targeting
+        # Generation runs a language model and may take much longer than a
+        # regular request.
+        data = await self.request(
+            "GET",
+            "/generate-text",
+            params=params,
+            timeout=aiohttp.ClientTimeout(total=120, connect=self.timeout.connect),
+            retry=False,
+        )
+        return data["text"]
+
+
+def build_form(fields: dict) -> aiohttp.FormData:
+    form = aiohttp.FormData()
+    for name, (filename, value, content_type) in fields.items():
+        form.add_field(name, value, filename=filename, content_type=content_type)
+    return form
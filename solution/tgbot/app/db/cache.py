@@ -0,0 +1,26 @@
+import json
+from typing import Any
+
+from redis.asyncio.client import Redis
+
+
+class RedisResponseCache:
+    """
+    API responses shared by all bot instances. Entries expire after ``ttl``
+    seconds; callers put the current day into the key, so advancing the day
+    makes every cached statistics entry stale at once.
+    """
+
+    def __init__(self, redis: Redis, prefix: str = "api", ttl: int = 60):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Any | None:
+        raw = await self.redis.get(f"{self.prefix}:{key}")
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: int | None = None) -> None:
+        await self.redis.set(
+            f"{self.prefix}:{key}", json.dumps(value), ex=ttl or self.ttl
+        )
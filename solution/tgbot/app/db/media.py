@@ -0,0 +1,67 @@
+import json
+import re
+
+from aiogram.enums import ContentType
+from aiogram_dialog.api.entities import MediaId
+from aiogram_dialog.api.protocols import MediaIdStorageProtocol
+from redis.asyncio.client import Redis
+
+# Campaign images are stored as campaigns/<content hash>_<variant>.<ext>.
+CONTENT_HASH = re.compile(r"/campaigns/([0-9a-f]{32})_")
+MEDIA_ID_TTL = 90 * 24 * 60 * 60
+
+
+class RedisMediaIdStorage(MediaIdStorageProtocol):
+    """
+    Remembers the Telegram file_id of every sent media by its URL and, for
+    campaign images, by content hash. Later renders send the file_id, so the
+    image is neither downloaded nor uploaded to Telegram again.
+    """
+
+    def __init__(self, redis: Redis, prefix: str = "media"):
+        self.redis = redis
+        self.prefix = prefix
+
+    def _keys(self, path: str | None, url: str | None, type: ContentType) -> list[str]:
+        keys = []
+        type = getattr(type, "value", type)
+        if url:
+            keys.append(f"{self.prefix}:{type}:url:{url}")
+            if match := CONTENT_HASH.search(url):
+                keys.append(f"{self.prefix}:{type}:sha256:{match.group(1)}")
+        elif path:
+            keys.append(f"{self.prefix}:{type}:path:{path}")
+        return keys
+
+    async def get_media_id(
+        self,
+        path: str | None,
+        url: str | None,
+        type: ContentType,
+    ) -> MediaId | None:
+        keys = self._keys(path, url, type)
+        if not keys:
+            return None
+        for raw in await self.redis.mget(keys):
+            if raw:
+                data = json.loads(raw)
+                return MediaId(data["file_id"], data["file_unique_id"])
+        return None
+
+    async def save_media_id(
+        self,
+        path: str | None,
+        url: str | None,
+        type: ContentType,
+        media_id: MediaId,
+    ) -> None:
+        keys = self._keys(path, url, type)
+        if not keys:
+            return
+        value = json.dumps(
+            {"file_id": media_id.file_id, "file_unique_id": media_id.file_unique_id}
+        )
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(key, value, ex=MEDIA_ID_TTL)
+            await pipe.execute()
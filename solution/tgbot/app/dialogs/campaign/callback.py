@@ -1,12 +1,14 @@
+from aiogram.enums import ContentType
 from aiogram.types import Message, CallbackQuery
 from aiogram_dialog import DialogManager, ShowMode
+from aiogram_dialog.api.entities import MediaId
 from aiogram_dialog.widgets.input import MessageInput
 from aiogram_dialog.widgets.kbd import Button
 
-from db.db import send_create_campaign, send_update_campaign, get_current_day
+from db.api import ApiClient
 from dialogs.campaign.states import CampaignSG, UpdateCampaignSG
 from dialogs.menu.states import MenuSG
-from db.models import TelegramUser, Campaign
+from db.models import TelegramUser
 
 from .states import CreateCampaignSG
 
@@ -94,8 +96,9 @@ async def update_ad_text_handler(
     manager.dialog_data["ad_text"] = message.text
 
     campaign_id = manager.start_data["campaign_id"]
-    campaign = await Campaign.filter(id=campaign_id).first()
-    if campaign.start_date <= await get_current_day():
+    api: ApiClient = manager.middleware_data["api"]
+    campaign = await api.get_campaign(campaign_id)
+    if campaign["start_date"] <= await api.get_current_day():
         await manager.switch_to(UpdateCampaignSG.cost_per_impression)
     else:
         await manager.switch_to(UpdateCampaignSG.start_date)
@@ -106,8 +109,9 @@ async def update_generated_text_handler(
     manager: DialogManager,
 ):
     campaign_id = manager.start_data["campaign_id"]
-    campaign = await Campaign.filter(id=campaign_id).first()
-    if campaign.start_date <= await get_current_day():
+    api: ApiClient = manager.middleware_data["api"]
+    campaign = await api.get_campaign(campaign_id)
+    if campaign["start_date"] <= await api.get_current_day():
         await manager.switch_to(UpdateCampaignSG.cost_per_impression)
     else:
         await manager.next()
@@ -163,8 +167,6 @@ async def update_location_handler(
         manager.dialog_data["targeting"] = {}
     manager.dialog_data["targeting"]["location"] = message.text
 
-    campaign_id = manager.start_data["campaign_id"]
-    campaign = await Campaign.filter(id=campaign_id).first()
     await manager.next()
 
 
@@ -209,17 +211,34 @@ async def min_age_handler(
         await message.reply(str(e))
 
 
+async def remember_uploaded_image(manager: DialogManager, response_data: dict):
+    # Telegram already has the photo the user sent, so the stored copy is shown
+    # by the same file_id without an upload.
+    if (file_id := manager.dialog_data.get("image_file_id")) and response_data.get("image"):
+        await manager.middleware_data["media_storage"].save_media_id(
+            path=None,
+            url=response_data["image"],
+            type=ContentType.PHOTO,
+            media_id=MediaId(file_id),
+        )
+
+
 async def create_campaign_handler(
     message: Message,
     message_input: MessageInput,
     manager: DialogManager,
 ):
     data = manager.dialog_data
+    image = None
     if data.get("image_file_id"):
-        data["image"] = await message.bot.download(data["image_file_id"])
+        image = await message.bot.download(data["image_file_id"])
     advertiser = await TelegramUser.get(telegram_id=str(message.from_user.id))
 
-    response_data = await send_create_campaign(data, advertiser.advertiser_id)
+    api: ApiClient = manager.middleware_data["api"]
+    response_data = await api.create_campaign(
+        str(advertiser.advertiser_id), data, image=image
+    )
+    await remember_uploaded_image(manager, response_data)
 
     campaign_id = response_data["campaign_id"]
 
@@ -289,7 +308,10 @@ async def campaign_delete(
     callback: CallbackQuery, button: Button, manager: DialogManager
 ):
     campaign_id = manager.start_data["campaign_id"]
-    await Campaign.filter(id=campaign_id).delete()
+    advertiser = await TelegramUser.get(telegram_id=str(callback.from_user.id))
+    # Deleted through the API, which keeps the campaign counter up to date.
+    api: ApiClient = manager.middleware_data["api"]
+    await api.delete_campaign(str(advertiser.advertiser_id), campaign_id)
     await manager.start(MenuSG.main)
 
 
@@ -307,13 +329,19 @@ async def update_campaign_handler(
 ):
     data = manager.dialog_data
 
+    image = None
     if data.get("image_file_id"):
-        data["image"] = await message.bot.download(data.get("image_file_id"))
+        image = await message.bot.download(data.get("image_file_id"))
     advertiser = await TelegramUser.get(telegram_id=str(message.from_user.id))
 
-    await send_update_campaign(
-        data, advertiser.advertiser_id, manager.start_data["campaign_id"]
+    api: ApiClient = manager.middleware_data["api"]
+    response_data = await api.update_campaign(
+        str(advertiser.advertiser_id),
+        manager.start_data["campaign_id"],
+        data,
+        image=image,
     )
+    await remember_uploaded_image(manager, response_data)
 
     await manager.start(
         state=CampaignSG.main, data={"campaign_id": manager.start_data["campaign_id"]}
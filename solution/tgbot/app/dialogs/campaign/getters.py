@@ -2,27 +2,20 @@ from aiogram.enums import ContentType
 from aiogram_dialog import DialogManager
 from aiogram_dialog.api.entities import MediaAttachment, MediaId
 
-from db.db import (
-    get_campaign,
-    get_image_path,
-    get_gaily_statistics,
-    get_all_statistics,
-)
+from db.api import ApiClient
 
-from db.db import generate_text
 
-
-async def campaign_getter(dialog_manager: DialogManager, **kwargs):
-    campaign = await get_campaign(campaign_id=dialog_manager.start_data["campaign_id"])
-    dialog_manager.dialog_data.pop("daily_statisticss", None)
+async def campaign_getter(dialog_manager: DialogManager, api: ApiClient, **kwargs):
+    campaign = await api.get_campaign(dialog_manager.start_data["campaign_id"])
+    targeting = campaign.get("targeting", {})
     targeted_age = ""
-    if campaign.targeted_age_from is not None:
-        targeted_age = f"с {campaign.targeted_age_from} "
-    if campaign.targeted_age_to is not None:
-        targeted_age += f"до {campaign.targeted_age_to}"
+    if targeting.get("age_from") is not None:
+        targeted_age = f"с {targeting['age_from']} "
+    if targeting.get("age_to") is not None:
+        targeted_age += f"до {targeting['age_to']}"
     if not targeted_age:
         targeted_age = "Все"
-    match campaign.targeted_gender:
+    match targeting.get("gender"):
         case "MALE":
             targeted_gender = "Мужской"
         case "FEMALE":
@@ -31,23 +24,24 @@ async def campaign_getter(dialog_manager: DialogManager, **kwargs):
             targeted_gender = "Все"
 
     image = None
-    if campaign.image.url:
-        image_path = await get_image_path(campaign.image.url)
-        image = MediaAttachment(path=image_path, type=ContentType.PHOTO)
+    if campaign.get("image"):
+        # Sent by file_id once Telegram has seen it (see db.media), otherwise
+        # streamed from storage without touching the disk.
+        image = MediaAttachment(
+            url=campaign["image"], type=ContentType.PHOTO, use_pipe=True
+        )
     return {
-        "cost_per_impression": campaign.cost_per_impression,
-        "cost_per_click": campaign.cost_per_click,
-        "title": campaign.ad_title,
-        "text": campaign.ad_text,
-        "dates": f"Действительна с {campaign.start_date} по {campaign.end_date}",
+        "cost_per_impression": campaign["cost_per_impression"],
+        "cost_per_click": campaign["cost_per_click"],
+        "title": campaign["ad_title"],
+        "text": campaign["ad_text"],
+        "dates": f"Действительна с {campaign['start_date']} по {campaign['end_date']}",
         "targeted_gender": targeted_gender,
         "targeted_age": targeted_age,
-        "targeted_location": campaign.targeted_location
-        if campaign.targeted_location
-        else "Все",
+        "targeted_location": targeting.get("location") or "Все",
         "image": image,
         "has_image": True if image else False,
-        "erid": campaign.erid if campaign.erid else "Не обозначен",
+        "erid": campaign.get("erid") or "Не обозначен",
     }
 
 
@@ -100,24 +94,23 @@ async def campaign_check_getter(dialog_manager: DialogManager, **kwargs):
     }
 
 
-async def daily_statistics_getter(dialog_manager: DialogManager, **kwargs):
+async def daily_statistics_getter(
+    dialog_manager: DialogManager, api: ApiClient, **kwargs
+):
     campaign_id = dialog_manager.start_data["campaign_id"]
-    if not dialog_manager.dialog_data.get("daily_statisticss"):
-        statistics_data = await get_gaily_statistics(campaign_id)
-        dialog_manager.dialog_data["daily_statisticss"] = statistics_data
-
-    statistics_data = dialog_manager.dialog_data["daily_statisticss"]
     if not (page := dialog_manager.dialog_data.get("stat_page")):
         page = 1
         dialog_manager.dialog_data["stat_page"] = page
-    max_page = len(statistics_data)
+    # One day per page, only the visible day is fetched.
+    statistics_page = await api.get_campaign_daily_statistics(campaign_id, page=page)
+    max_page = statistics_page["total"]
 
     if not (next_page := dialog_manager.dialog_data.get("next_page")):
         next_page = page + 1 if page != max_page else 1
     if not (previous_page := dialog_manager.dialog_data.get("previous_page")):
         previous_page = page - 1 if page != 1 else max_page
 
-    data = {"statistics": statistics_data[page - 1]}
+    data = {"statistics": statistics_page["items"][0]}
     dialog_manager.dialog_data["max_stat_page"] = max_page
     data["previous_page"] = previous_page
     data["next_page"] = next_page
@@ -126,14 +119,18 @@ async def daily_statistics_getter(dialog_manager: DialogManager, **kwargs):
     return data
 
 
-async def all_statistics_getter(dialog_manager: DialogManager, **kwargs):
+async def all_statistics_getter(
+    dialog_manager: DialogManager, api: ApiClient, **kwargs
+):
     campaign_id = dialog_manager.start_data["campaign_id"]
-    statistics_data = await get_all_statistics(campaign_id)
+    statistics_data = await api.get_campaign_statistics(campaign_id)
 
     data = {"statistics": statistics_data}
     return data
 
-async def generate_text_getter(dialog_manager: DialogManager, **kwargs):
+async def generate_text_getter(
+    dialog_manager: DialogManager, api: ApiClient, **kwargs
+):
     title = dialog_manager.dialog_data["ad_title"]
     targeted_age = ""
     if dialog_manager.dialog_data["targeting"].get("age_from") is not None:
@@ -148,7 +145,7 @@ async def generate_text_getter(dialog_manager: DialogManager, **kwargs):
         case _:
             targeted_gender = ''
 
-    generated_text = await generate_text(title, f"{targeted_age} {targeted_gender}")
+    generated_text = await api.generate_text(title, f"{targeted_age} {targeted_gender}")
     dialog_manager.dialog_data["ad_text"] = generated_text
 
     return {
@@ -5,55 +5,34 @@ from aiogram_dialog import DialogManager, ShowMode, StartMode
 from aiogram_dialog.widgets.input import MessageInput
 from aiogram_dialog.widgets.kbd import Button
 
-from db.db import advertiser_exists, register_user
+from db.api import ApiClient
+from db.db import register_user
 from dialogs.campaign.states import CampaignSG
 from .states import MenuSG, ProfileSG
 from db.models import TelegramUser
 
 
-async def get_next_page(diaglog_data):
-    next_page = (
-        diaglog_data["campaign_page"] + 1
-        if diaglog_data["campaign_page"] != diaglog_data["max_campaign_page"]
-        else 1
-    )
-    return next_page
-
-
-async def get_previous_page(diaglog_data):
-    previous_page = (
-        diaglog_data["campaign_page"] - 1
-        if diaglog_data["campaign_page"] != 1
-        else diaglog_data["max_campaign_page"]
-    )
-    return previous_page
-
-
 async def previous_page(
     callback: CallbackQuery, button: Button, manager: DialogManager
 ):
-    if manager.dialog_data["campaign_page"] > 1:
-        manager.dialog_data["campaign_page"] -= 1
+    data = manager.dialog_data
+    if data.get("previous_campaign_cursor"):
+        data["campaign_cursor"] = data["previous_campaign_cursor"]
+        data["campaign_page"] = max(data["campaign_page"] - 1, 1)
     else:
-        manager.dialog_data["campaign_page"] = manager.dialog_data["max_campaign_page"]
-        manager.dialog_data["next_page"] = (
-            manager.dialog_data["campaign_page"] + 1
-            if manager.dialog_data["campaign_page"]
-            != manager.dialog_data["max_campaign_page"]
-            else 1
-        )
-    manager.dialog_data["previous_page"] = await get_previous_page(manager.dialog_data)
-    manager.dialog_data["next_page"] = await get_next_page(manager.dialog_data)
+        data["campaign_cursor"] = data.get("last_campaign_cursor")
+        data["campaign_page"] = data["max_campaign_page"]
     await manager.switch_to(MenuSG.main, show_mode=ShowMode.EDIT)
 
 
 async def next_page(callback: CallbackQuery, button: Button, manager: DialogManager):
-    if manager.dialog_data["campaign_page"] < manager.dialog_data["max_campaign_page"]:
-        manager.dialog_data["campaign_page"] += 1
+    data = manager.dialog_data
+    if data.get("next_campaign_cursor"):
+        data["campaign_cursor"] = data["next_campaign_cursor"]
+        data["campaign_page"] += 1
     else:
-        manager.dialog_data["campaign_page"] = 1
-    manager.dialog_data["previous_page"] = await get_previous_page(manager.dialog_data)
-    manager.dialog_data["next_page"] = await get_next_page(manager.dialog_data)
+        data["campaign_cursor"] = None
+        data["campaign_page"] = 1
     await manager.switch_to(MenuSG.main, show_mode=ShowMode.EDIT)
 
 
@@ -65,16 +44,16 @@ async def campaign_click(
 
 
 async def first_page(callback: CallbackQuery, button: Button, manager: DialogManager):
+    manager.dialog_data["campaign_cursor"] = None
     manager.dialog_data["campaign_page"] = 1
-    manager.dialog_data["previous_page"] = await get_previous_page(manager.dialog_data)
-    manager.dialog_data["next_page"] = await get_next_page(manager.dialog_data)
     await manager.switch_to(MenuSG.main, show_mode=ShowMode.EDIT)
 
 
 async def last_page(callback: CallbackQuery, button: Button, manager: DialogManager):
+    manager.dialog_data["campaign_cursor"] = manager.dialog_data.get(
+        "last_campaign_cursor"
+    )
     manager.dialog_data["campaign_page"] = manager.dialog_data["max_campaign_page"]
-    manager.dialog_data["previous_page"] = await get_previous_page(manager.dialog_data)
-    manager.dialog_data["next_page"] = await get_next_page(manager.dialog_data)
     await manager.switch_to(MenuSG.main, show_mode=ShowMode.EDIT)
 
 
@@ -85,7 +64,8 @@ async def advertiser_id_entered(
 ):
     try:
         advertiser_id = uuid.UUID(message.text).hex
-        if await advertiser_exists(advertiser_id):
+        api: ApiClient = manager.middleware_data["api"]
+        if await api.get_advertiser(advertiser_id):
             await register_user(str(message.from_user.id), advertiser_id)
             manager.dialog_data["advertiser_id"] = advertiser_id
             await manager.switch_to(MenuSG.main)
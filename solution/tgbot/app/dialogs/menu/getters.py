@@ -1,98 +1,99 @@
+from math import ceil
+
 from aiogram.types import User
 from aiogram_dialog import DialogManager
 
-from db.db import (
-    get_advertiser_campaigns,
-    get_advertiser_id,
-    get_advertiser_statistics,
-    get_advertiser_daily_statistics,
-)
-from db.models import Advertiser
+from db.api import ApiClient
+from db.db import get_advertiser_id
+
+CAMPAIGN_PAGE_SIZE = 6
 
 
 async def main_menu_getter(
-    dialog_manager: DialogManager, event_from_user: User, **kwargs
+    dialog_manager: DialogManager, event_from_user: User, api: ApiClient, **kwargs
 ):
     data = {}
     advertiser_id = await get_advertiser_id(
         str(event_from_user.id), dialog_data=dialog_manager.dialog_data
     )
-    advertiser = await Advertiser.filter(id=str(advertiser_id)).first()
-    data["advertiser_name"] = advertiser.name
-
-    if not (page := dialog_manager.dialog_data.get("campaign_page")):
-        page = 1
-        dialog_manager.dialog_data["campaign_page"] = page
-    advertiser_campaigns, max_page = await get_advertiser_campaigns(
-        advertiser, page=page
+    advertiser = await api.get_advertiser(advertiser_id)
+    data["advertiser_name"] = advertiser["name"]
+
+    # Pages are walked with API cursors, the page numbers only label them.
+    page = dialog_manager.dialog_data.setdefault("campaign_page", 1)
+    campaigns_page = await api.list_campaigns(
+        advertiser_id,
+        cursor=dialog_manager.dialog_data.get("campaign_cursor"),
+        size=CAMPAIGN_PAGE_SIZE,
     )
-
-    if not (next_page := dialog_manager.dialog_data.get("next_page")):
-        next_page = page + 1 if page != max_page else 1
-    if not (previous_page := dialog_manager.dialog_data.get("previous_page")):
-        previous_page = page - 1 if page != 1 else max_page
-
-    dialog_manager.dialog_data["max_campaign_page"] = max_page
-    data["previous_page"] = previous_page
-    data["next_page"] = next_page
+    max_page = max(ceil(campaigns_page["total"] / CAMPAIGN_PAGE_SIZE), 1)
+    page = min(page, max_page)
+
+    dialog_manager.dialog_data.update(
+        campaign_page=page,
+        max_campaign_page=max_page,
+        next_campaign_cursor=campaigns_page["next"],
+        previous_campaign_cursor=campaigns_page["previous"],
+        last_campaign_cursor=campaigns_page["last"],
+    )
+    data["previous_page"] = page - 1 if campaigns_page["previous"] else max_page
+    data["next_page"] = page + 1 if campaigns_page["next"] else 1
     data["max_campaign_page"] = max_page
     data["campaign_page"] = page
     data["campaigns"] = [
-        {"title": campaign.ad_title, "id": str(campaign.id)}
-        for i, campaign in enumerate(advertiser_campaigns)
+        {"title": campaign["ad_title"], "id": campaign["campaign_id"]}
+        for campaign in campaigns_page["items"]
     ]
 
     return data
 
 
 async def get_advertiser_info(
-    dialog_manager: DialogManager, event_from_user: User, **kwargs
+    dialog_manager: DialogManager, event_from_user: User, api: ApiClient, **kwargs
 ):
     advertiser_id = await get_advertiser_id(
         str(event_from_user.id), dialog_data=dialog_manager.dialog_data
     )
-    advertiser = await Advertiser.filter(id=str(advertiser_id)).first()
-    dialog_manager.dialog_data.pop("daily_statistics", None)
+    advertiser = await api.get_advertiser(advertiser_id)
 
     data = {
-        "name": advertiser.name,
-        "id": advertiser.id,
+        "name": advertiser["name"],
+        "id": advertiser["advertiser_id"],
     }
     return data
 
 
 async def advertiser_statistics_getter(
-    dialog_manager: DialogManager, event_from_user: User, **kwargs
+    dialog_manager: DialogManager, event_from_user: User, api: ApiClient, **kwargs
 ):
     advertiser_id = await get_advertiser_id(
         str(event_from_user.id), dialog_data=dialog_manager.dialog_data
     )
-    statistics = await get_advertiser_statistics(advertiser_id)
+    statistics = await api.get_advertiser_statistics(advertiser_id)
     data = {"statistics": statistics}
     return data
 
 
 async def advertiser_daily_statistics_getter(
-    dialog_manager: DialogManager, event_from_user: User, **kwargs
+    dialog_manager: DialogManager, event_from_user: User, api: ApiClient, **kwargs
 ):
     advertiser_id = await get_advertiser_id(
         str(event_from_user.id), dialog_data=dialog_manager.dialog_data
     )
-    if not dialog_manager.dialog_data.get("daily_statistics"):
-        statistics_data = await get_advertiser_daily_statistics(advertiser_id)
-        dialog_manager.dialog_data["daily_statistics"] = statistics_data
-
-    statistics_data = dialog_manager.dialog_data["daily_statistics"]
     if not (page := dialog_manager.dialog_data.get("stat_page")):
         page = 1
         dialog_manager.dialog_data["stat_page"] = page
-    max_page = len(statistics_data)
+    # One day per page, only the visible day is fetched.
+    statistics_page = await api.get_advertiser_daily_statistics(
+        advertiser_id, page=page
+    )
+    max_page = statistics_page["total"]
 
     if not (next_page := dialog_manager.dialog_data.get("next_page")):
         next_page = page + 1 if page != max_page else 1
     if not (previous_page := dialog_manager.dialog_data.get("previous_page")):
         previous_page = page - 1 if page != 1 else max_page
-    data = {"statistics": statistics_data[page - 1]}
+    data = {"statistics": statistics_page["items"][0]}
     dialog_manager.dialog_data["max_stat_page"] = max_page
     data["previous_page"] = previous_page
     data["next_page"] = next_page
@@ -3,10 +3,14 @@ import logging
 import os.path
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, ExceptionTypeFilter
 from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
 from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram_dialog.api.exceptions import UnknownIntent, UnknownState
+from aiohttp import web
 from redis.asyncio.client import Redis
 
 from aiogram_dialog import (
@@ -16,7 +20,10 @@ from aiogram_dialog import (
 )
 from tortoise import run_async
 
+from db.api import ApiClient
+from db.cache import RedisResponseCache
 from db.db import user_is_registered, init
+from db.media import RedisMediaIdStorage
 from dialogs.campaign.dialog import (
     campaign_dialog,
     create_campaign_dialog,
@@ -24,6 +31,7 @@ from dialogs.campaign.dialog import (
 )
 from dialogs.menu.dialog import main_dialog, profile_dialog
 from dialogs.menu.states import MenuSG
+from ordering import ChatOrderedDispatcher
 
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = os.environ.get("REDIS_PORT", "6380")
@@ -31,6 +39,13 @@ REDIS_DB = os.environ.get("REDIS_DB", "1")
 BOT_TOKEM = os.environ.get(
     "BOT_TOKEM", "REDACTED"
 )
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+# Polling is used unless a public webhook URL is configured.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
 
 
 async def start(message: Message, dialog_manager: DialogManager):
@@ -40,18 +55,43 @@ async def start(message: Message, dialog_manager: DialogManager):
         await dialog_manager.start(MenuSG.not_registered, mode=StartMode.RESET_STACK)
 
 
-async def main():
-    logging.basicConfig(level=logging.INFO)
-    bot = Bot(token=BOT_TOKEM)
+def create_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        # A local Bot API server, or a stub of it in tests.
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(token=BOT_TOKEM, session=session)
+
+
+def create_dispatcher() -> Dispatcher:
+    redis = Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+    )
     storage = RedisStorage(
-        Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=REDIS_DB,
-        ),
+        redis,
         key_builder=DefaultKeyBuilder(with_destiny=True),
     )
-    dp = Dispatcher(storage=storage)
+    media_storage = RedisMediaIdStorage(redis)
+    # Updates of one chat are handled one at a time and in update_id order
+    # across all replicas.
+    dp = ChatOrderedDispatcher(
+        storage=storage, events_isolation=storage.create_isolation()
+    )
+    dp["media_storage"] = media_storage
+    api = ApiClient(cache=RedisResponseCache(redis))
+    dp["api"] = api
+
+    async def watch_day_advances():
+        dp["day_watcher"] = asyncio.create_task(api.watch_day_advances(redis))
+
+    async def stop_watching_day_advances():
+        dp["day_watcher"].cancel()
+
+    dp.startup.register(watch_day_advances)
+    dp.shutdown.register(stop_watching_day_advances)
+    dp.shutdown.register(api.close)
     dp.message.register(start, CommandStart())
     dp.errors.register(
         start,
@@ -68,11 +108,55 @@ async def main():
         profile_dialog,
         edit_campaign_dialog,
     )
-    setup_dialogs(dp)
+    setup_dialogs(dp, media_id_storage=media_storage)
+    return dp
+
 
+def create_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    Serves updates pushed by Telegram. Any number of replicas can run behind
+    a load balancer, they share the FSM storage, the per-chat lock and the
+    per-chat update order in Redis. An update is answered only after it is
+    handled, so Telegram does not see it as delivered before the handler has
+    finished.
+    """
+
+    async def set_webhook(bot: Bot):
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    dp.startup.register(set_webhook)
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    bot = create_bot()
+    dp = create_dispatcher()
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 
+def run_webhook():
+    logging.basicConfig(level=logging.INFO)
+    app = create_webhook_app(create_dispatcher(), create_bot())
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+
+
 if __name__ == "__main__":
     run_async(init())
-    asyncio.run(main())
+    if WEBHOOK_URL:
+        run_webhook()
+    else:
+        asyncio.run(main())
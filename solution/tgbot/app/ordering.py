@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+ORDER_DESTINY = "order"
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """
+    Handles the updates of a chat in ``update_id`` order across all replicas.
+
+    Every update of a chat is registered as pending in the FSM storage, held
+    for ``order_delay`` seconds and then waits until it is the oldest pending
+    update of the chat. Updates that overtook each other on the way to the
+    replicas are so handled in order, as long as they arrive within
+    ``order_delay`` of each other or while an earlier update of the chat is
+    still being handled. An update arriving even later than that is handled
+    late, with a warning, rather than lost. Pending updates that were not
+    seen for ``order_timeout`` seconds, e.g. of a crashed replica, stop
+    holding the chat.
+
+    The bookkeeping is locked with the dispatcher's events isolation under
+    its own key, so waiting never blocks the chat's FSM lock.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        order_delay: float = 0.2,
+        order_timeout: float = 30,
+        order_poll_interval: float = 0.05,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.order_delay = order_delay
+        self.order_timeout = order_timeout
+        self.order_poll_interval = order_poll_interval
+
+    def order_key(self, bot: Bot, chat_id: int) -> StorageKey:
+        return StorageKey(
+            bot_id=bot.id, chat_id=chat_id, user_id=chat_id, destiny=ORDER_DESTINY
+        )
+
+    async def take_turn(self, key: StorageKey, update_id: int, ready: bool = True) -> bool:
+        """
+        Registers the update as pending, or refreshes it. Returns True when it
+        is ``ready`` and the oldest pending update of the chat.
+        """
+        async with self.fsm.events_isolation.lock(key):
+            order = await self.storage.get_data(key)
+            now = time.time()
+            pending = {
+                pending_id: seen
+                for pending_id, seen in order.get("pending", {}).items()
+                if now - seen < self.order_timeout
+            }
+            pending[str(update_id)] = now
+            last = order.get("last", 0)
+            turn = ready and min(map(int, pending)) == update_id
+            if turn and update_id < last:
+                logger.warning(
+                    f"Update {update_id} of chat {key.chat_id} arrived after "
+                    f"update {last}, handled out of order"
+                )
+            if turn:
+                last = max(last, update_id)
+            await self.storage.set_data(key, {"last": last, "pending": pending})
+            return turn
+
+    async def finish_turn(self, key: StorageKey, update_id: int) -> None:
+        async with self.fsm.events_isolation.lock(key):
+            order = await self.storage.get_data(key)
+            order.get("pending", {}).pop(str(update_id), None)
+            await self.storage.set_data(key, order)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        chat_id = UserContextMiddleware.resolve_event_context(update).chat_id
+        if chat_id is None:
+            return await super().feed_update(bot, update, **kwargs)
+
+        key = self.order_key(bot, chat_id)
+        await self.take_turn(key, update.update_id, ready=False)
+        try:
+            await asyncio.sleep(self.order_delay)
+            while not await self.take_turn(key, update.update_id):
+                await asyncio.sleep(self.order_poll_interval)
+            return await super().feed_update(bot, update, **kwargs)
+        finally:
+            await self.finish_turn(key, update.update_id)
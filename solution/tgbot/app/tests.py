@@ -0,0 +1,217 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+from aiogram.types import Message
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import main
+from db.api import DAY_ADVANCED_CHANNEL, ApiClient
+from ordering import ChatOrderedDispatcher
+
+SECRET = "test-secret"
+
+
+class StubBotAPI:
+    """Records Bot API calls and answers them like Telegram would."""
+
+    def __init__(self):
+        self.calls = []
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls.append((method, data))
+        result = True
+        if method == "sendMessage":
+            result = {
+                "message_id": len(self.calls),
+                "date": 0,
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "text": data["text"],
+            }
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+class WebhookTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bot_api = StubBotAPI()
+        self.bot_api_server = TestServer(self.bot_api.app)
+        await self.bot_api_server.start_server()
+
+        self.events = []
+        self.released = asyncio.Event()
+        self.released.set()
+        self.dp = ChatOrderedDispatcher(
+            storage=MemoryStorage(), events_isolation=SimpleEventIsolation()
+        )
+        self.dp.message.register(self.echo)
+
+        base = str(self.bot_api_server.make_url("")).rstrip("/")
+        with patch.multiple(
+            main,
+            BOT_TOKEM="42:TEST",
+            TELEGRAM_API_URL=base,
+            WEBHOOK_URL="https://bot.example.com/webhook",
+            WEBHOOK_SECRET=SECRET,
+        ):
+            self.bot = main.create_bot()
+            app = main.create_webhook_app(self.dp, self.bot)
+            self.client = TestClient(TestServer(app))
+            await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.bot_api_server.close()
+
+    async def echo(self, message: Message):
+        self.events.append(("start", message.text))
+        await self.released.wait()
+        await asyncio.sleep(0.05)
+        self.events.append(("end", message.text))
+        await message.answer(message.text)
+
+    async def post_update(self, update: dict, secret: str = SECRET):
+        return await self.client.post(
+            main.WEBHOOK_PATH,
+            json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+        )
+
+    async def test_webhook_is_registered_on_startup(self):
+        method, data = self.bot_api.calls[0]
+        self.assertEqual(method, "setWebhook")
+        self.assertEqual(data["url"], "https://bot.example.com/webhook")
+        self.assertEqual(data["secret_token"], SECRET)
+
+    async def test_update_is_handled(self):
+        response = await self.post_update(make_update(1, 42, "hello"))
+        self.assertEqual(response.status, 200)
+        sent = [data for method, data in self.bot_api.calls if method == "sendMessage"]
+        self.assertEqual(len(sent), 1)
+        self.assertEqual((sent[0]["chat_id"], sent[0]["text"]), ("42", "hello"))
+
+    async def test_wrong_secret_is_rejected(self):
+        response = await self.post_update(make_update(1, 42, "hello"), secret="x")
+        self.assertEqual(response.status, 401)
+        self.assertEqual(self.events, [])
+
+    async def test_updates_of_one_chat_are_not_interleaved(self):
+        await asyncio.gather(
+            *(self.post_update(make_update(i, 42, str(i))) for i in range(3))
+        )
+        self.assertEqual(len(self.events), 6)
+        for i in range(0, len(self.events), 2):
+            self.assertEqual(self.events[i][0], "start")
+            self.assertEqual(self.events[i + 1], ("end", self.events[i][1]))
+
+    async def wait_for_pending(self, chat_id: int, count: int):
+        key = self.dp.order_key(self.bot, chat_id)
+        async with asyncio.timeout(1):
+            while len((await self.dp.storage.get_data(key)).get("pending", {})) < count:
+                await asyncio.sleep(0.01)
+
+    async def test_updates_of_one_chat_are_handled_in_order(self):
+        self.released.clear()
+        first = asyncio.create_task(self.post_update(make_update(1, 42, "1")))
+        await self.wait_for_pending(42, 1)
+        # Later updates overtake each other on the way to the bot.
+        later = [
+            asyncio.create_task(self.post_update(make_update(i, 42, str(i))))
+            for i in (4, 3, 2)
+        ]
+        await self.wait_for_pending(42, 4)
+        self.released.set()
+        await asyncio.gather(first, *later)
+
+        started = [text for kind, text in self.events if kind == "start"]
+        self.assertEqual(started, ["1", "2", "3", "4"])
+        sent = [data["text"] for method, data in self.bot_api.calls if method == "sendMessage"]
+        self.assertEqual(sent, ["1", "2", "3", "4"])
+
+    async def test_update_overtaken_within_order_delay_is_handled_first(self):
+        second = asyncio.create_task(self.post_update(make_update(2, 42, "2")))
+        await self.wait_for_pending(42, 1)
+        await self.post_update(make_update(1, 42, "1"))
+        await second
+
+        started = [text for kind, text in self.events if kind == "start"]
+        self.assertEqual(started, ["1", "2"])
+
+    async def test_late_update_is_handled_out_of_order(self):
+        await self.post_update(make_update(2, 42, "2"))
+        with self.assertLogs("ordering", level="WARNING"):
+            await self.post_update(make_update(1, 42, "1"))
+        await self.post_update(make_update(1, 7, "other chat"))
+
+        started = [text for kind, text in self.events if kind == "start"]
+        self.assertEqual(started, ["2", "1", "other chat"])
+
+
+class StubPubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.channels = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def listen(self):
+        for message in self.messages:
+            yield message
+        await asyncio.Event().wait()
+
+
+class StubRedis:
+    def __init__(self, messages):
+        self.pubsub_ = StubPubSub(messages)
+
+    def pubsub(self):
+        return self.pubsub_
+
+
+class DayAdvanceTests(unittest.IsolatedAsyncioTestCase):
+    async def test_published_day_replaces_cached_day(self):
+        api = ApiClient(base_url="http://api.invalid", current_day_ttl=60)
+        api.day_advanced(3)
+        redis = StubRedis(
+            [
+                {"type": "subscribe", "data": 1},
+                {"type": "message", "data": json.dumps({"previous": 3, "day": 5})},
+            ]
+        )
+
+        watcher = asyncio.create_task(api.watch_day_advances(redis))
+        await asyncio.sleep(0)
+        watcher.cancel()
+
+        self.assertEqual(redis.pubsub_.channels, [DAY_ADVANCED_CHANNEL])
+        self.assertEqual(await api.get_cached_current_day(), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()